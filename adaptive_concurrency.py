@@ -0,0 +1,117 @@
+import time
+import threading
+import collections
+
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 64
+# Средняя задержка интервала выше базовой во столько раз без роста пропускной способности -
+# запросы стоят в очереди устройства, а не выполняются параллельно
+DEFAULT_LATENCY_TOLERANCE = 2.0
+DEFAULT_DECREASE_FACTOR = 0.7
+# Прирост пропускной способности меньше этой доли считается отсутствием выигрыша
+MIN_THROUGHPUT_GAIN = 0.05
+MIN_INTERVAL_SAMPLES = 8
+# Доля ошибок в интервале, при которой параллелизм снижается (таймауты и отказы сервера)
+ERROR_RATE_THRESHOLD = 0.5
+
+ConcurrencyAdjustment = collections.namedtuple(
+    'ConcurrencyAdjustment', 'limit throughput average_latency reason'
+)
+
+
+class AdaptiveConcurrencyController:
+    # AIMD по наблюдаемым задержкам: число одновременных операций удваивается (медленный старт),
+    # пока нет признаков перегрузки, затем растет на 1 за интервал и умножается на
+    # decrease_factor, когда задержка растет без роста пропускной способности или много ошибок.
+    # На сетевом диске с задержкой в десятки миллисекунд предел уходит вверх, на локальном
+    # SSD останавливается там, где дополнительные потоки уже ничего не дают.
+    # record вызывается из рабочих потоков, current_limit - из потока, ставящего задачи
+    def __init__(self, initial_limit=4, min_limit=DEFAULT_MIN_CONCURRENCY, max_limit=DEFAULT_MAX_CONCURRENCY,
+                 latency_tolerance=DEFAULT_LATENCY_TOLERANCE, decrease_factor=DEFAULT_DECREASE_FACTOR):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.limit = self.clamp_limit(initial_limit)
+        self.initial_limit = self.limit
+        self.lowest_limit = self.limit
+        self.highest_limit = self.limit
+        self.slow_start = True
+        self.baseline_latency = None
+        self.previous_throughput = None
+        self.adjustments = collections.deque(maxlen=1000)
+        self.lock = threading.Lock()
+        self.start_interval(None)
+
+    def clamp_limit(self, limit):
+        return min(self.max_limit, max(self.min_limit, int(limit)))
+
+    def start_interval(self, started_at):
+        self.interval_started_at = started_at
+        self.interval_sample_count = 0
+        self.interval_error_count = 0
+        self.interval_latency_sum = 0.0
+        self.interval_peak_in_flight = 0
+
+    def current_limit(self):
+        return self.limit
+
+    def observe_in_flight(self, in_flight_count):
+        # Предел растет, только если он действительно был занят: при медленном обходе папок
+        # задач меньше предела, и новые потоки ничего не дадут
+        with self.lock:
+            self.interval_peak_in_flight = max(self.interval_peak_in_flight, in_flight_count)
+
+    def record(self, latency_seconds, error=False):
+        with self.lock:
+            now = time.monotonic()
+            if self.interval_started_at is None:
+                self.interval_started_at = now - latency_seconds
+            self.interval_sample_count += 1
+            self.interval_error_count += bool(error)
+            self.interval_latency_sum += latency_seconds
+            # Интервал - не меньше одного "окна" операций, чтобы каждая изменившаяся граница была измерена
+            if self.interval_sample_count >= max(MIN_INTERVAL_SAMPLES, self.limit):
+                self.finish_interval(now)
+
+    def finish_interval(self, now):
+        throughput = self.interval_sample_count / max(now - self.interval_started_at, 1e-9)
+        average_latency = self.interval_latency_sum / self.interval_sample_count
+        if self.baseline_latency is None or average_latency < self.baseline_latency:
+            self.baseline_latency = average_latency
+        if self.interval_error_count >= self.interval_sample_count * ERROR_RATE_THRESHOLD:
+            self.decrease_limit('errors', throughput, average_latency)
+        elif (average_latency > self.baseline_latency * self.latency_tolerance
+              and self.previous_throughput is not None
+              and throughput < self.previous_throughput * (1 + MIN_THROUGHPUT_GAIN)):
+            self.decrease_limit('latency', throughput, average_latency)
+        elif self.interval_peak_in_flight >= self.limit:
+            self.increase_limit(throughput, average_latency)
+        self.previous_throughput = throughput
+        self.start_interval(now)
+
+    def increase_limit(self, throughput, average_latency):
+        new_limit = self.clamp_limit(self.limit * 2 if self.slow_start else self.limit + 1)
+        self.apply_limit(new_limit, 'increase', throughput, average_latency)
+
+    def decrease_limit(self, reason, throughput, average_latency):
+        self.slow_start = False
+        self.apply_limit(self.clamp_limit(self.limit * self.decrease_factor), reason, throughput, average_latency)
+
+    def apply_limit(self, new_limit, reason, throughput, average_latency):
+        if new_limit == self.limit:
+            return
+        self.limit = new_limit
+        self.lowest_limit = min(self.lowest_limit, new_limit)
+        self.highest_limit = max(self.highest_limit, new_limit)
+        self.adjustments.append(ConcurrencyAdjustment(new_limit, throughput, average_latency, reason))
+
+    def describe(self):
+        with self.lock:
+            description = (
+                f"параллелизм {self.limit} (начальный {self.initial_limit}, "
+                f"от {self.lowest_limit} до {self.highest_limit}, изменений {len(self.adjustments)})"
+            )
+            if self.baseline_latency is not None:
+                description += f", базовая задержка {self.baseline_latency * 1000:.1f} мс"
+            return description
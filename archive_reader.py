@@ -0,0 +1,404 @@
+import os
+import io
+import time
+import zlib
+import struct
+import hashlib
+import tarfile
+import zipfile
+import threading
+import collections
+
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar',)
+COMPRESSED_TAR_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + TAR_EXTENSIONS + COMPRESSED_TAR_EXTENSIONS
+# Начало члена, которое читается, когда к его данным нет произвольного доступа
+# (сжатые члены ZIP и сжатый TAR): APP1 с EXIF у JPEG не больше 64 КБ, IFD у RAW - в первых
+# десятках килобайт. У сжатого TAR в каталоге остается только та часть, что нужна заголовку
+HEADER_PREFIX_SIZE = 128 * 1024
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+ZIP_READ_CHUNK_SIZE = 64 * 1024
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+ZIP_ENCRYPTED_FLAG = 0x1
+# Каталоги последних архивов: обходчик и чтение метаданных обращаются к одним и тем же
+CATALOG_CACHE_SIZE = 4
+
+# data_offset - начало данных в файле архива (у ZIP - смещение локального заголовка, данные
+# за ним); header_prefix - начало члена сжатого TAR; crc32 - контрольная сумма ZIP
+ArchiveMember = collections.namedtuple(
+    'ArchiveMember', 'name file_size modification_time data_offset compress_type crc32 header_prefix'
+)
+MemberStat = collections.namedtuple('MemberStat', 'st_size st_mtime_ns')
+
+
+class ArchiveError(OSError):
+    pass
+
+
+def archive_kind(file_name):
+    lowered_name = file_name.lower()
+    if lowered_name.endswith(COMPRESSED_TAR_EXTENSIONS):
+        return 'compressed_tar'
+    if lowered_name.endswith(TAR_EXTENSIONS):
+        return 'tar'
+    if lowered_name.endswith(ZIP_EXTENSIONS):
+        return 'zip'
+    return None
+
+
+def is_archive_file_name(file_name):
+    return archive_kind(file_name) is not None
+
+
+def split_archive_path(path):
+    # Путь внутри архива - "папка/снимки.zip/DCIM/IMG_0001.JPG": (путь архива, имя члена через /)
+    # или None для обычного пути. Сам архив дает (путь архива, '')
+    lowered_path = path.lower()
+    if not any(extension in lowered_path for extension in ARCHIVE_EXTENSIONS):
+        return None
+    separators = tuple(separator for separator in (os.sep, os.altsep) if separator)
+    for extension in ARCHIVE_EXTENSIONS:
+        search_start = 0
+        while True:
+            position = lowered_path.find(extension, search_start)
+            if position < 0:
+                break
+            end = position + len(extension)
+            search_start = end
+            if end != len(path) and not path.startswith(separators, end):
+                continue
+            if os.path.isfile(path[:end]):
+                member_name = path[end + 1:]
+                for separator in separators:
+                    member_name = member_name.replace(separator, '/')
+                return path[:end], member_name.strip('/')
+    return None
+
+
+def member_path(archive_path, member_name):
+    return os.path.join(archive_path, *member_name.split('/'))
+
+
+def normalize_member_name(member_name):
+    # ./DCIM/x.jpg и /DCIM/x.jpg из tar - это DCIM/x.jpg; .. внутри имени не допускается
+    name_parts = [part for part in member_name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if '..' in name_parts:
+        return None
+    return '/'.join(name_parts)
+
+
+def zip_modification_time(date_time):
+    # Время в ZIP - местное, с точностью 2 с
+    return int(time.mktime(date_time + (0, 0, -1))) * 1_000_000_000
+
+
+def read_zip_members(archive_path):
+    members = []
+    with zipfile.ZipFile(archive_path) as zip_file:
+        for zip_info in zip_file.infolist():
+            member_name = normalize_member_name(zip_info.filename)
+            if zip_info.is_dir() or not member_name:
+                continue
+            if zip_info.flag_bits & ZIP_ENCRYPTED_FLAG:
+                continue
+            members.append(ArchiveMember(
+                member_name, zip_info.file_size, zip_modification_time(zip_info.date_time),
+                zip_info.header_offset, zip_info.compress_type, zip_info.CRC, None
+            ))
+    return members
+
+
+def read_tar_members(archive_path, compressed):
+    # Несжатый TAR: читается только цепочка заголовков по 512 байт, данные пропускаются seek.
+    # Сжатый - одним потоковым проходом с распаковкой, начала членов сохраняются по пути,
+    # обрезанные до того, что читает exif_reader (обычно несколько КБ вместо 128 КБ на файл).
+    # Импорт здесь: exif_reader сам импортирует этот модуль
+    from exif_reader import measure_header_size
+    members = []
+    with tarfile.open(archive_path, 'r:*' if compressed else 'r:') as tar_file:
+        for tar_info in tar_file:
+            member_name = normalize_member_name(tar_info.name)
+            if not tar_info.isfile() or not member_name:
+                continue
+            header_prefix = None
+            if compressed:
+                header_prefix = tar_file.extractfile(tar_info).read(HEADER_PREFIX_SIZE)
+                header_prefix = header_prefix[:measure_header_size(header_prefix)]
+            members.append(ArchiveMember(
+                member_name, tar_info.size, int(tar_info.mtime) * 1_000_000_000,
+                tar_info.offset_data, None, None, header_prefix
+            ))
+    return members
+
+
+class ArchiveCatalog:
+    # Содержимое одного архива как дерево виртуальных папок
+    def __init__(self, archive_path, kind, members, file_size, modification_time):
+        self.archive_path = archive_path
+        self.kind = kind
+        self.file_size = file_size
+        self.modification_time = modification_time
+        self.members = {}
+        self.directories = collections.defaultdict(lambda: ([], set()))
+        self.directories['']
+        for archive_member in members:
+            self.members[archive_member.name] = archive_member
+            directory_name, _, _ = archive_member.name.rpartition('/')
+            self.directories[directory_name][0].append(archive_member)
+            while directory_name:
+                parent_name, _, _ = directory_name.rpartition('/')
+                self.directories[parent_name][1].add(directory_name)
+                directory_name = parent_name
+        self.directories.default_factory = None
+        # Сжатый TAR читается одним общим объектом: распаковка вперед дешевле, чем каждый раз с начала
+        self.compressed_tar_file = None
+        self.compressed_tar_lock = threading.Lock()
+
+    def get_member(self, member_name):
+        archive_member = self.members.get(member_name)
+        if archive_member is None:
+            raise FileNotFoundError(f"Нет в архиве: {member_path(self.archive_path, member_name)}")
+        return archive_member
+
+    def list_directory(self, directory_name):
+        # (члены папки, имена подпапок) или None, если такой папки в архиве нет
+        return self.directories.get(directory_name)
+
+    def close(self):
+        with self.compressed_tar_lock:
+            if self.compressed_tar_file is not None:
+                self.compressed_tar_file.close()
+                self.compressed_tar_file = None
+
+
+archive_catalogs = collections.OrderedDict()
+archive_catalogs_lock = threading.Lock()
+
+
+def load_archive_catalog(archive_path):
+    # Каталог перечитывается, если архив изменился; загрузка - вне блокировки, чтобы большой
+    # сжатый архив не задерживал обращения к другим
+    archive_stat = os.stat(archive_path)
+    cache_key = os.path.normcase(os.path.abspath(archive_path))
+    with archive_catalogs_lock:
+        archive_catalog = archive_catalogs.get(cache_key)
+        if archive_catalog is not None and (archive_catalog.file_size, archive_catalog.modification_time) == (
+                archive_stat.st_size, archive_stat.st_mtime_ns):
+            archive_catalogs.move_to_end(cache_key)
+            return archive_catalog
+    kind = archive_kind(archive_path)
+    try:
+        if kind == 'zip':
+            members = read_zip_members(archive_path)
+        elif kind in ('tar', 'compressed_tar'):
+            members = read_tar_members(archive_path, kind == 'compressed_tar')
+        else:
+            raise ArchiveError(f"Неизвестный тип архива: {archive_path}")
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error) as error:
+        raise ArchiveError(f"Архив поврежден: {archive_path} - {str(error)}")
+    archive_catalog = ArchiveCatalog(archive_path, kind, members, archive_stat.st_size, archive_stat.st_mtime_ns)
+    with archive_catalogs_lock:
+        previous_catalog = archive_catalogs.pop(cache_key, None)
+        archive_catalogs[cache_key] = archive_catalog
+        evicted_catalogs = [previous_catalog] if previous_catalog is not None else []
+        while len(archive_catalogs) > CATALOG_CACHE_SIZE:
+            evicted_catalogs.append(archive_catalogs.popitem(last=False)[1])
+    for evicted_catalog in evicted_catalogs:
+        evicted_catalog.close()
+    return archive_catalog
+
+
+def list_archive_directory(directory_path):
+    # Для обходчика: (список (путь, член), список путей подпапок) виртуальной папки архива
+    archive_location = split_archive_path(directory_path)
+    if archive_location is None:
+        raise NotADirectoryError(f"Не папка архива: {directory_path}")
+    archive_path, directory_name = archive_location
+    directory_listing = load_archive_catalog(archive_path).list_directory(directory_name)
+    if directory_listing is None:
+        raise FileNotFoundError(f"Нет в архиве: {directory_path}")
+    archive_members, subdirectory_names = directory_listing
+    return (
+        [(member_path(archive_path, archive_member.name), archive_member) for archive_member in archive_members],
+        [member_path(archive_path, subdirectory_name) for subdirectory_name in subdirectory_names]
+    )
+
+
+def stat_path(path):
+    # os.stat для обычных файлов, размер и время члена - для путей внутри архива
+    archive_location = split_archive_path(path)
+    if archive_location is None or not archive_location[1]:
+        return os.stat(path)
+    archive_member = load_archive_catalog(archive_location[0]).get_member(archive_location[1])
+    return MemberStat(archive_member.file_size, archive_member.modification_time)
+
+
+class ArchiveMemberFile(io.RawIOBase):
+    # Окно в файле архива на данные несжатого члена: seek и read в координатах члена
+    def __init__(self, archive_file, data_offset, file_size):
+        self.archive_file = archive_file
+        self.data_offset = data_offset
+        self.file_size = file_size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.file_size
+        if offset < 0:
+            raise ValueError("Отрицательное смещение")
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        read_size = max(0, min(len(buffer), self.file_size - self.position))
+        if not read_size:
+            return 0
+        self.archive_file.seek(self.data_offset + self.position)
+        data = self.archive_file.read(read_size)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.archive_file.close()
+        super().close()
+
+
+def zip_data_offset(archive_file, archive_member):
+    # Данные начинаются за локальным заголовком, длина имени и extra в нем могут
+    # отличаться от центрального каталога
+    archive_file.seek(archive_member.data_offset)
+    local_header = archive_file.read(ZIP_LOCAL_HEADER.size)
+    if len(local_header) != ZIP_LOCAL_HEADER.size:
+        raise ArchiveError("Локальный заголовок ZIP обрезан")
+    header_fields = ZIP_LOCAL_HEADER.unpack(local_header)
+    if header_fields[0] != ZIP_LOCAL_HEADER_SIGNATURE:
+        raise ArchiveError("Некорректный локальный заголовок ZIP")
+    return archive_member.data_offset + ZIP_LOCAL_HEADER.size + header_fields[9] + header_fields[10]
+
+
+def read_deflated_prefix(archive_file, data_offset, size_limit):
+    archive_file.seek(data_offset)
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    chunks = []
+    decompressed_size = 0
+    while decompressed_size < size_limit and not decompressor.eof:
+        compressed_chunk = archive_file.read(ZIP_READ_CHUNK_SIZE)
+        if not compressed_chunk:
+            break
+        chunk = decompressor.decompress(compressed_chunk, size_limit - decompressed_size)
+        chunks.append(chunk)
+        decompressed_size += len(chunk)
+    return b''.join(chunks)
+
+
+def open_archive_member(path):
+    # Файловый объект для чтения заголовка члена архива. Несжатые члены ZIP и члены
+    # несжатого TAR читаются с произвольным доступом прямо из файла архива, от сжатых
+    # доступно только начало (HEADER_PREFIX_SIZE байт)
+    archive_location = split_archive_path(path)
+    if archive_location is None or not archive_location[1]:
+        raise FileNotFoundError(f"Не путь внутри архива: {path}")
+    archive_catalog = load_archive_catalog(archive_location[0])
+    archive_member = archive_catalog.get_member(archive_location[1])
+    if archive_member.header_prefix is not None:
+        return io.BytesIO(archive_member.header_prefix)
+    archive_file = open(archive_catalog.archive_path, 'rb')
+    try:
+        data_offset = archive_member.data_offset
+        if archive_catalog.kind == 'zip':
+            data_offset = zip_data_offset(archive_file, archive_member)
+            if archive_member.compress_type == zipfile.ZIP_DEFLATED:
+                with archive_file:
+                    return io.BytesIO(read_deflated_prefix(archive_file, data_offset, HEADER_PREFIX_SIZE))
+            if archive_member.compress_type != zipfile.ZIP_STORED:
+                raise ArchiveError(f"Неподдерживаемое сжатие ZIP {archive_member.compress_type}: {path}")
+        return ArchiveMemberFile(archive_file, data_offset, archive_member.file_size)
+    except BaseException:
+        archive_file.close()
+        raise
+
+
+def iterate_member_chunks(archive_catalog, archive_member):
+    if archive_catalog.kind == 'compressed_tar':
+        # Общий объект с блокировкой: чтение в порядке архива распаковывает его один раз
+        with archive_catalog.compressed_tar_lock:
+            if archive_catalog.compressed_tar_file is None:
+                archive_catalog.compressed_tar_file = tarfile.open(archive_catalog.archive_path, 'r:*')
+            tar_file = archive_catalog.compressed_tar_file
+            tar_file.fileobj.seek(archive_member.data_offset)
+            remaining_size = archive_member.file_size
+            while remaining_size > 0:
+                chunk = tar_file.fileobj.read(min(remaining_size, COPY_CHUNK_SIZE))
+                if not chunk:
+                    raise ArchiveError(f"Архив обрезан: {archive_catalog.archive_path}")
+                remaining_size -= len(chunk)
+                yield chunk
+        return
+    if archive_catalog.kind == 'zip' and archive_member.compress_type != zipfile.ZIP_STORED:
+        with zipfile.ZipFile(archive_catalog.archive_path) as zip_file:
+            with zip_file.open(archive_member.name) as member_file:
+                yield from iter(lambda: member_file.read(COPY_CHUNK_SIZE), b'')
+        return
+    archive_file = open(archive_catalog.archive_path, 'rb')
+    try:
+        data_offset = archive_member.data_offset
+        if archive_catalog.kind == 'zip':
+            data_offset = zip_data_offset(archive_file, archive_member)
+    except BaseException:
+        archive_file.close()
+        raise
+    with ArchiveMemberFile(archive_file, data_offset, archive_member.file_size) as member_file:
+        yield from iter(lambda: member_file.read(COPY_CHUNK_SIZE), b'')
+
+
+def calculate_member_checksum(path):
+    # blake2b содержимого члена архива без записи на диск - как calculate_file_checksum у move_engine
+    archive_location = split_archive_path(path)
+    if archive_location is None or not archive_location[1]:
+        raise FileNotFoundError(f"Не путь внутри архива: {path}")
+    archive_catalog = load_archive_catalog(archive_location[0])
+    archive_member = archive_catalog.get_member(archive_location[1])
+    content_hash = hashlib.blake2b()
+    for chunk in iterate_member_chunks(archive_catalog, archive_member):
+        content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def extract_archive_member(path, target_path):
+    # Копирует член архива в target_path и ставит ему время из архива; возвращает
+    # blake2b записанного содержимого. CRC32 членов ZIP проверяется всегда
+    archive_location = split_archive_path(path)
+    if archive_location is None or not archive_location[1]:
+        raise FileNotFoundError(f"Не путь внутри архива: {path}")
+    archive_catalog = load_archive_catalog(archive_location[0])
+    archive_member = archive_catalog.get_member(archive_location[1])
+    content_hash = hashlib.blake2b()
+    crc32 = 0
+    copied_size = 0
+    with open(target_path, 'wb') as target_file:
+        for chunk in iterate_member_chunks(archive_catalog, archive_member):
+            target_file.write(chunk)
+            content_hash.update(chunk)
+            crc32 = zlib.crc32(chunk, crc32)
+            copied_size += len(chunk)
+    if copied_size != archive_member.file_size:
+        raise ArchiveError(f"Размер члена архива не совпадает: {path}")
+    if archive_member.crc32 is not None and crc32 != archive_member.crc32:
+        raise ArchiveError(f"Контрольная сумма члена архива не совпадает: {path}")
+    os.utime(target_path, ns=(archive_member.modification_time, archive_member.modification_time))
+    return content_hash.hexdigest()
@@ -0,0 +1,127 @@
+import os
+import datetime
+import collections
+
+from exif_reader import extract_photo_date
+from extraction_pool import ExtractionPool
+from photo_index import DEFAULT_INDEX_DIRECTORY
+from move_engine import MoveEngine, MoveJournal, MoveTask
+from tree_walker import IMAGE_EXTENSIONS, TreeWalker
+from exiftool_driver import EXIFTOOL_EXTENSIONS
+
+DEFAULT_DATE_FORMAT = "%Y/%m/%d"
+# Свой журнал: прерванная сортировка по датам не должна выглядеть как перемещение камеры в GUI
+DEFAULT_DATE_SORT_JOURNAL_PATH = os.path.join(DEFAULT_INDEX_DIRECTORY, "date_sort_journal.jsonl")
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+DateSortResult = collections.namedtuple('DateSortResult', 'source_path target_path status message')
+
+
+def parse_exif_date(date_time):
+    # Камеры пишут и "0000:00:00 00:00:00", и дату без времени - такие файлы не трогаем
+    if not date_time:
+        return None
+    for date_format, length in ((EXIF_DATE_FORMAT, 19), ("%Y:%m:%d", 10)):
+        try:
+            return datetime.datetime.strptime(date_time[:length], date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def read_walked_file_date(walked_file):
+    return parse_exif_date(extract_photo_date(walked_file.path))
+
+
+class DateSorter:
+    # Встроенная замена exiftool -d %Y/%m/%d "-Directory<DateTimeOriginal": файлы
+    # переносятся в <целевая папка>/ГГГГ/ММ/ДД, читаются только заголовки EXIF.
+    # Датируются только форматы exif_reader (extensions); остальное, что перенес бы
+    # exiftool (видео, HEIC, DNG...), отдается со статусом 'unsupported'
+    def __init__(self, target_directory, worker_count=4, date_format=DEFAULT_DATE_FORMAT,
+                 extensions=IMAGE_EXTENSIONS, verify_copies=False, journal_path=DEFAULT_DATE_SORT_JOURNAL_PATH):
+        self.target_directory = target_directory
+        self.worker_count = worker_count
+        self.date_format = date_format
+        self.extensions = frozenset(extensions)
+        self.verify_copies = verify_copies
+        self.journal_path = journal_path
+        self.undated_paths = []
+        self.unsupported_paths = []
+
+    def iterate_move_tasks(self, source_directory, should_stop=None, wait_while_paused=None):
+        tree_walker = TreeWalker(
+            self.extensions | EXIFTOOL_EXTENSIONS, should_stop=should_stop, wait_while_paused=wait_while_paused
+        )
+        extraction_pool = ExtractionPool(self.worker_count)
+        pool_results = extraction_pool.map_ordered(
+            read_walked_file_date,
+            self.iterate_supported_files(tree_walker.walk(source_directory)),
+            should_stop=should_stop,
+            wait_while_paused=wait_while_paused
+        )
+        for pool_result in pool_results:
+            source_path = pool_result.item.path
+            if pool_result.error is not None:
+                yield MoveTask(source_path, None, pool_result.error)
+                continue
+            if pool_result.value is None:
+                self.undated_paths.append(source_path)
+                continue
+            date_directory = pool_result.value.strftime(self.date_format)
+            yield MoveTask(
+                source_path,
+                os.path.join(self.target_directory, date_directory, os.path.basename(source_path)),
+                None
+            )
+
+    def iterate_supported_files(self, walked_files):
+        for walked_file in walked_files:
+            if os.path.splitext(walked_file.path)[1].lower() in self.extensions:
+                yield walked_file
+            else:
+                self.unsupported_paths.append(walked_file.path)
+
+    def resume_interrupted_sort(self, should_stop=None, wait_while_paused=None):
+        # Перемещения прерванной сортировки доделываются до новой; журнал остается, если были ошибки
+        error_count = 0
+        move_engine = MoveEngine(self.worker_count, self.verify_copies)
+        for move_result in move_engine.resume_journal(self.journal_path, should_stop, wait_while_paused):
+            error_count += move_result.error is not None
+            yield self.convert_move_result(move_result)
+        if error_count == 0 and not (should_stop and should_stop()):
+            MoveJournal.discard(self.journal_path)
+
+    def convert_move_result(self, move_result):
+        if move_result.error is not None:
+            return DateSortResult(move_result.source_path, move_result.target_path, 'error', str(move_result.error))
+        return DateSortResult(move_result.source_path, move_result.target_path, 'moved', None)
+
+    def sort(self, source_directory, should_stop=None, wait_while_paused=None):
+        # Статусы как у ExifToolBatchSorter; файлы без даты ('unchanged') и неподдерживаемые
+        # ('unsupported') отдаются в конце прогона
+        self.undated_paths = []
+        self.unsupported_paths = []
+        if MoveJournal.exists(self.journal_path):
+            yield from self.resume_interrupted_sort(should_stop, wait_while_paused)
+            if MoveJournal.exists(self.journal_path):
+                return
+        move_engine = MoveEngine(self.worker_count, self.verify_copies)
+        move_journal = MoveJournal.create(source_directory, self.target_directory, self.journal_path)
+        try:
+            # Весь план пишется в журнал до первого перемещения: после сбоя resume доделает
+            # и те файлы, до которых рабочие потоки еще не дошли
+            move_tasks = list(self.iterate_move_tasks(source_directory, should_stop, wait_while_paused))
+            move_journal.record_plan(move_tasks)
+            for move_result in move_engine.move_files(move_tasks, move_journal, should_stop, wait_while_paused):
+                yield self.convert_move_result(move_result)
+            if not (should_stop and should_stop()):
+                move_journal.finish()
+        finally:
+            move_journal.close()
+        for undated_path in self.undated_paths:
+            yield DateSortResult(undated_path, None, 'unchanged', None)
+        for unsupported_path in self.unsupported_paths:
+            yield DateSortResult(
+                unsupported_path, None, 'unsupported', "формат не читается встроенным модулем, нужен exiftool"
+            )
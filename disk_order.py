@@ -0,0 +1,134 @@
+import os
+import struct
+import functools
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from extraction_pool import PoolResult, NO_CACHED_RESULT
+
+# _IOWR('f', 11, struct fiemap) из linux/fs.h
+FS_IOC_FIEMAP = 0xC020660B
+# struct fiemap: fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, fm_reserved
+FIEMAP_HEADER = struct.Struct('=QQLLLL')
+# struct fiemap_extent: fe_logical, fe_physical, fe_length, fe_reserved64[2], fe_flags, fe_reserved[3]
+FIEMAP_EXTENT = struct.Struct('=QQQQQLLLL')
+# Расположение неизвестно (отложенное выделение, данные внутри inode, зашифрованные) - смещение бессмысленно
+FIEMAP_EXTENT_UNKNOWN = 0x2
+FIEMAP_EXTENT_DELALLOC = 0x4
+FIEMAP_EXTENT_DATA_INLINE = 0x200
+FIEMAP_UNUSABLE_FLAGS = FIEMAP_EXTENT_UNKNOWN | FIEMAP_EXTENT_DELALLOC | FIEMAP_EXTENT_DATA_INLINE
+
+# Ключи сортировки: сначала файлы с известным физическим смещением, затем остальные по inode
+PHYSICAL_LOCATION = 0
+INODE_LOCATION = 1
+
+
+def read_physical_offset(file_path):
+    # Физическое смещение первого блока файла на устройстве (ioctl FIEMAP, Linux).
+    # None - файловая система или ОС его не сообщают (FAT на картах, сетевые диски, Windows)
+    if fcntl is None:
+        return None
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    # Нужен только экстент с началом файла - там лежит заголовок EXIF
+    FIEMAP_HEADER.pack_into(request, 0, 0, 1, 0, 0, 1, 0)
+    try:
+        file_descriptor = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(file_descriptor, FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    finally:
+        os.close(file_descriptor)
+    if not FIEMAP_HEADER.unpack_from(request)[3]:
+        return None
+    extent_fields = FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)
+    if extent_fields[5] & FIEMAP_UNUSABLE_FLAGS:
+        return None
+    return extent_fields[1]
+
+
+def call_with_position(worker_function, positioned_item):
+    # Обертка для пула: номер элемента в логическом порядке едет вместе с ним
+    return worker_function(positioned_item[1])
+
+
+class DiskOrderScheduler:
+    # Для HDD и кардридеров: сначала собирается весь список, затем файлы читаются в порядке
+    # расположения на диске - по физическому смещению из FIEMAP, если он доступен, иначе по
+    # номеру inode (на ext4/XFS он растет вместе с местом в таблице inode и примерно с местом данных).
+    # Упреждающее чтение ограничено окном ExtractionPool; результаты отдаются в исходном
+    # логическом порядке, готовые раньше своей очереди ждут в буфере.
+    # location_file(item) - WalkedFile, по которому определяется место элемента на диске
+    def __init__(self, extraction_pool, location_file=None, use_fiemap=True):
+        self.extraction_pool = extraction_pool
+        self.location_file = location_file or (lambda item: item)
+        self.use_fiemap = use_fiemap and fcntl is not None
+        self.physical_count = 0
+        self.inode_count = 0
+        self.cached_count = 0
+        self.peak_buffered_count = 0
+
+    def disk_location(self, walked_file):
+        physical_offset = read_physical_offset(walked_file.path) if self.use_fiemap else None
+        if physical_offset is not None:
+            self.physical_count += 1
+            return PHYSICAL_LOCATION, physical_offset
+        self.inode_count += 1
+        return INODE_LOCATION, walked_file.inode
+
+    def plan_read_order(self, items, positions):
+        # FIEMAP тоже читает inode, поэтому смещения запрашиваются в порядке inode
+        positions = sorted(positions, key=lambda position: self.location_file(items[position]).inode)
+        locations = {position: self.disk_location(self.location_file(items[position])) for position in positions}
+        return sorted(positions, key=lambda position: (locations[position], position))
+
+    def map_ordered(self, worker_function, items, cached_result_lookup=None,
+                    should_stop=None, wait_while_paused=None):
+        items = list(items)
+        ready_results = {}
+        read_positions = []
+        for position, item in enumerate(items):
+            if cached_result_lookup is None:
+                read_positions.append(position)
+                continue
+            # Найденное в индексе не читается вовсе и не участвует в упорядочивании
+            try:
+                cached_value = cached_result_lookup(item)
+            except Exception as error:
+                ready_results[position] = PoolResult(item, None, error, True)
+                continue
+            if cached_value is NO_CACHED_RESULT:
+                read_positions.append(position)
+            else:
+                ready_results[position] = PoolResult(item, cached_value, None, True)
+        self.cached_count += len(ready_results)
+        read_order = self.plan_read_order(items, read_positions)
+
+        next_position = 0
+        while next_position in ready_results:
+            yield ready_results.pop(next_position)
+            next_position += 1
+        pool_results = self.extraction_pool.map_ordered(
+            functools.partial(call_with_position, worker_function),
+            ((position, items[position]) for position in read_order),
+            should_stop=should_stop,
+            wait_while_paused=wait_while_paused
+        )
+        for pool_result in pool_results:
+            position, item = pool_result.item
+            ready_results[position] = pool_result._replace(item=item)
+            self.peak_buffered_count = max(self.peak_buffered_count, len(ready_results))
+            while next_position in ready_results:
+                yield ready_results.pop(next_position)
+                next_position += 1
+
+    def describe(self):
+        return (
+            f"Порядок диска: по смещению FIEMAP {self.physical_count}, по inode {self.inode_count}, "
+            f"из индекса {self.cached_count}, наибольший буфер результатов {self.peak_buffered_count}"
+        )
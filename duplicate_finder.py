@@ -0,0 +1,144 @@
+import os
+import hashlib
+import collections
+
+from photo_index import NOT_INDEXED
+from extraction_pool import ExtractionPool, NO_CACHED_RESULT, UNKNOWN_DEVICE_WORKER_COUNT
+from move_engine import calculate_file_checksum
+from tree_walker import WalkedFile
+
+PARTIAL_HASH_BLOCK_SIZE = 16 * 1024
+DUPLICATE_ACTIONS = ('skip', 'link', 'report')
+
+# walked_files - файлы с одинаковым содержимым в порядке поступления на вход
+DuplicateGroup = collections.namedtuple('DuplicateGroup', 'file_size digest walked_files')
+
+
+def stat_walked_file(file_path):
+    file_stat = os.stat(file_path)
+    return WalkedFile(file_path, file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+
+def is_covered_by_partial_hash(file_size):
+    # Небольшой файл частичный хэш читает целиком, полный хэш для него не нужен
+    return file_size <= 2 * PARTIAL_HASH_BLOCK_SIZE
+
+
+def calculate_partial_hash(file_path, file_size):
+    # Начало и конец файла: у разных снимков одного размера отличаются уже заголовки EXIF
+    partial_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as input_file:
+        if is_covered_by_partial_hash(file_size):
+            partial_hash.update(input_file.read())
+        else:
+            partial_hash.update(input_file.read(PARTIAL_HASH_BLOCK_SIZE))
+            input_file.seek(-PARTIAL_HASH_BLOCK_SIZE, os.SEEK_END)
+            partial_hash.update(input_file.read(PARTIAL_HASH_BLOCK_SIZE))
+    return partial_hash.hexdigest()
+
+
+def calculate_full_hash(file_path, file_size):
+    return calculate_file_checksum(file_path)
+
+
+class DuplicateFinder:
+    # Отсев в три этапа: размер (без чтения файлов), хэш первых и последних
+    # 16 КБ, полный хэш только для оставшихся совпадений. Хэши кэшируются
+    # в индексе метаданных по (путь, размер, время изменения)
+    def __init__(self, metadata_index, worker_count=UNKNOWN_DEVICE_WORKER_COUNT,
+                 should_stop=None, wait_while_paused=None):
+        self.metadata_index = metadata_index
+        self.worker_count = worker_count
+        self.should_stop = should_stop
+        self.wait_while_paused = wait_while_paused
+        self.statistics = collections.Counter()
+        self.errors = []
+
+    def lookup_cached_hash(self, walked_file, hash_kind):
+        digest = self.metadata_index.get_file_hash(
+            walked_file.path, walked_file.file_size, walked_file.modification_time, hash_kind
+        )
+        return NO_CACHED_RESULT if digest is NOT_INDEXED else digest
+
+    def group_by_size(self, walked_files):
+        size_groups = collections.defaultdict(list)
+        for walked_file in walked_files:
+            self.statistics['files'] += 1
+            # Пустые файлы не считаем дубликатами друг друга
+            if walked_file.file_size > 0:
+                size_groups[walked_file.file_size].append(walked_file)
+        return [size_group for size_group in size_groups.values() if len(size_group) > 1]
+
+    def split_by_hash(self, candidate_groups, hash_kind, hash_function):
+        # Уточняет группы кандидатов по хэшу; возвращает {(размер, хэш): [файлы]} только с 2+ файлами
+        extraction_pool = ExtractionPool(self.worker_count)
+        pool_results = extraction_pool.map_ordered(
+            lambda walked_file: hash_function(walked_file.path, walked_file.file_size),
+            (walked_file for candidate_group in candidate_groups for walked_file in candidate_group),
+            cached_result_lookup=lambda walked_file: self.lookup_cached_hash(walked_file, hash_kind),
+            should_stop=self.should_stop,
+            wait_while_paused=self.wait_while_paused
+        )
+        hash_groups = collections.defaultdict(list)
+        for pool_result in pool_results:
+            walked_file = pool_result.item
+            if pool_result.error is not None:
+                self.errors.append((walked_file.path, pool_result.error))
+                continue
+            if pool_result.from_cache:
+                self.statistics['cached_hashes'] += 1
+            else:
+                self.statistics[f'{hash_kind}_hashed'] += 1
+                self.metadata_index.store_file_hash(
+                    walked_file.path, walked_file.file_size, walked_file.modification_time, hash_kind, pool_result.value
+                )
+            hash_groups[(walked_file.file_size, pool_result.value)].append(walked_file)
+        return {group_key: hash_group for group_key, hash_group in hash_groups.items() if len(hash_group) > 1}
+
+    def find_duplicate_groups(self, walked_files):
+        size_groups = self.group_by_size(walked_files)
+        self.statistics['size_candidates'] = sum(len(size_group) for size_group in size_groups)
+        partial_groups = self.split_by_hash(size_groups, 'partial', calculate_partial_hash)
+        duplicate_groups = [
+            DuplicateGroup(file_size, digest, hash_group)
+            for (file_size, digest), hash_group in partial_groups.items() if is_covered_by_partial_hash(file_size)
+        ]
+        full_candidate_groups = [
+            hash_group for (file_size, _), hash_group in partial_groups.items()
+            if not is_covered_by_partial_hash(file_size)
+        ]
+        full_groups = self.split_by_hash(full_candidate_groups, 'full', calculate_full_hash)
+        duplicate_groups.extend(
+            DuplicateGroup(file_size, digest, hash_group) for (file_size, digest), hash_group in full_groups.items()
+        )
+        self.metadata_index.flush()
+        self.statistics['duplicates'] = sum(len(group.walked_files) - 1 for group in duplicate_groups)
+        return duplicate_groups
+
+    def find_move_duplicates(self, candidate_files, reference_files):
+        # Для каждого кандидата на перемещение, содержимое которого уже есть среди
+        # reference_files (например, в архиве) или у более раннего кандидата,
+        # возвращает {путь кандидата: путь оригинала}. Из reference_files в память
+        # попадают только файлы с размером, как у какого-нибудь кандидата
+        candidate_files = list(candidate_files)
+        candidate_paths = {walked_file.path for walked_file in candidate_files}
+        candidate_sizes = {walked_file.file_size for walked_file in candidate_files}
+        matching_reference_files = [
+            walked_file for walked_file in reference_files
+            if walked_file.file_size in candidate_sizes and walked_file.path not in candidate_paths
+        ]
+        duplicate_of = {}
+        for duplicate_group in self.find_duplicate_groups(matching_reference_files + candidate_files):
+            original_path = duplicate_group.walked_files[0].path
+            for walked_file in duplicate_group.walked_files[1:]:
+                if walked_file.path in candidate_paths:
+                    duplicate_of[walked_file.path] = original_path
+        return duplicate_of
+
+    def describe_statistics(self):
+        return (
+            f"Поиск дубликатов: файлов {self.statistics['files']}, одинакового размера "
+            f"{self.statistics['size_candidates']}, частичных хэшей {self.statistics['partial_hashed']}, "
+            f"полных хэшей {self.statistics['full_hashed']}, из кэша {self.statistics['cached_hashes']}, "
+            f"дубликатов {self.statistics['duplicates']}"
+        )
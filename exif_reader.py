@@ -0,0 +1,450 @@
+import io
+import struct
+import threading
+import collections
+
+from archive_reader import split_archive_path, open_archive_member
+
+EXIF_TAG_IMAGE_WIDTH = 0x0100
+EXIF_TAG_IMAGE_HEIGHT = 0x0101
+EXIF_TAG_COMPRESSION = 0x0103
+EXIF_TAG_MAKE = 0x010F
+EXIF_TAG_MODEL = 0x0110
+EXIF_TAG_STRIP_OFFSETS = 0x0111
+EXIF_TAG_ORIENTATION = 0x0112
+EXIF_TAG_STRIP_BYTE_COUNTS = 0x0117
+EXIF_TAG_SUB_IFDS = 0x014A
+EXIF_TAG_JPEG_INTERCHANGE_FORMAT = 0x0201
+EXIF_TAG_JPEG_INTERCHANGE_FORMAT_LENGTH = 0x0202
+EXIF_TAG_EXIF_IFD_POINTER = 0x8769
+EXIF_TAG_DATE_TIME_ORIGINAL = 0x9003
+EXIF_TAG_CREATE_DATE = 0x9004
+EXIF_TAG_PIXEL_X_DIMENSION = 0xA002
+EXIF_TAG_PIXEL_Y_DIMENSION = 0xA003
+EXIF_TAG_LENS_MODEL = 0xA434
+
+READ_BLOCK_SIZE = 4096
+MAX_IFD_ENTRIES = 1024
+MAX_TAG_VALUE_SIZE = 64 * 1024
+# Обход каталогов в поиске встроенных превью: IFD0, IFD1 и SubIFD у RAW
+MAX_PREVIEW_IFDS = 16
+# Сжатие JPEG в TIFF: 6 - старый JPEG (превью CR2, NEF), 7 - JPEG
+JPEG_COMPRESSION_TYPES = (6, 7)
+# Миниатюра EXIF 160x120 занимает 5-15 КБ; для панели просмотра лучше превью побольше
+MIN_PREVIEW_BYTES = 32 * 1024
+MAX_PREVIEW_BYTES = 16 * 1024 * 1024
+
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+# Варианты TIFF-подобных RAW: стандартный TIFF, Olympus ORF, Panasonic RW2
+TIFF_MAGIC_NUMBERS = (42, 0x4F52, 0x5352, 0x55)
+
+JPEG_SIGNATURE = b'\xff\xd8'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+RAF_SIGNATURE = b'FUJIFILMCCD-RAW '
+EXIF_APP1_HEADER = b'Exif\x00\x00'
+
+# Всего прочитано байт заголовков в этом процессе - для статистики прогонов;
+# в режиме процессов чтение в дочерних процессах сюда не попадает
+header_read_statistics = {'bytes_read': 0, 'files': 0}
+header_read_statistics_lock = threading.Lock()
+
+
+# Поля для индекса и фасетных запросов; date_time - DateTimeOriginal, иначе CreateDate
+PhotoMetadata = collections.namedtuple(
+    'PhotoMetadata', 'camera_make camera_model lens_model date_time image_width image_height'
+)
+EMPTY_PHOTO_METADATA = PhotoMetadata(None, None, None, None, None, None)
+PHOTO_METADATA_TAGS = (
+    EXIF_TAG_MAKE, EXIF_TAG_MODEL, EXIF_TAG_LENS_MODEL, EXIF_TAG_DATE_TIME_ORIGINAL, EXIF_TAG_CREATE_DATE,
+    EXIF_TAG_PIXEL_X_DIMENSION, EXIF_TAG_PIXEL_Y_DIMENSION, EXIF_TAG_IMAGE_WIDTH, EXIF_TAG_IMAGE_HEIGHT
+)
+# Все теги, которые читаются из заголовка: по ним меряется, какая часть начала члена сжатого TAR нужна
+HEADER_TAGS = PHOTO_METADATA_TAGS + (EXIF_TAG_ORIENTATION,)
+
+
+class ExifReaderError(Exception):
+    pass
+
+
+class BlockFileReader:
+    def __init__(self, file_object, base_offset=0):
+        self.file_object = file_object
+        self.base_offset = base_offset
+        self.cached_blocks = {}
+        self.read_statistics = {'bytes_read': 0}
+
+    @property
+    def bytes_read(self):
+        return self.read_statistics['bytes_read']
+
+    def read_at(self, offset, size):
+        if offset < 0 or size < 0:
+            raise ExifReaderError("Некорректное смещение в заголовке")
+        absolute_offset = self.base_offset + offset
+        first_block = absolute_offset // READ_BLOCK_SIZE
+        last_block = (absolute_offset + size - 1) // READ_BLOCK_SIZE if size else first_block
+        chunks = []
+        for block_number in range(first_block, last_block + 1):
+            block = self.cached_blocks.get(block_number)
+            if block is None:
+                self.file_object.seek(block_number * READ_BLOCK_SIZE)
+                block = self.file_object.read(READ_BLOCK_SIZE)
+                self.read_statistics['bytes_read'] += len(block)
+                self.cached_blocks[block_number] = block
+            chunks.append(block)
+        data = b''.join(chunks)
+        start = absolute_offset - first_block * READ_BLOCK_SIZE
+        result = data[start:start + size]
+        if len(result) != size:
+            raise ExifReaderError("Заголовок файла обрезан")
+        return result
+
+    def with_base(self, base_offset):
+        reader = BlockFileReader(self.file_object, self.base_offset + base_offset)
+        reader.cached_blocks = self.cached_blocks
+        reader.read_statistics = self.read_statistics
+        return reader
+
+
+def decode_tag_value(reader, byte_order, field_type, value_count, value_bytes):
+    value_size = TIFF_TYPE_SIZES.get(field_type)
+    if value_size is None:
+        return None
+    total_size = value_size * value_count
+    if total_size > MAX_TAG_VALUE_SIZE:
+        return None
+    if total_size > 4:
+        value_offset = struct.unpack(byte_order + 'I', value_bytes)[0]
+        raw_value = reader.read_at(value_offset, total_size)
+    else:
+        raw_value = value_bytes[:total_size]
+
+    if field_type == 2:
+        return raw_value.split(b'\x00', 1)[0].decode('utf-8', errors='replace').strip()
+    if field_type in (3, 4) and value_count >= 1:
+        format_char = 'H' if field_type == 3 else 'I'
+        return struct.unpack(byte_order + format_char, raw_value[:value_size])[0]
+    if field_type == 5 and value_count >= 1:
+        numerator, denominator = struct.unpack(byte_order + 'II', raw_value[:8])
+        return numerator / denominator if denominator else None
+    return raw_value
+
+
+def read_ifd_tags(reader, byte_order, ifd_offset, wanted_tags, found_tags):
+    entry_count = struct.unpack(byte_order + 'H', reader.read_at(ifd_offset, 2))[0]
+    if entry_count > MAX_IFD_ENTRIES:
+        raise ExifReaderError("Поврежденный каталог IFD")
+    exif_ifd_offset = None
+    entries = reader.read_at(ifd_offset + 2, entry_count * 12)
+    for entry_number in range(entry_count):
+        entry = entries[entry_number * 12:(entry_number + 1) * 12]
+        tag_id, field_type, value_count = struct.unpack(byte_order + 'HHI', entry[:8])
+        if tag_id == EXIF_TAG_EXIF_IFD_POINTER:
+            exif_ifd_offset = struct.unpack(byte_order + 'I', entry[8:12])[0]
+        elif tag_id in wanted_tags and tag_id not in found_tags:
+            value = decode_tag_value(reader, byte_order, field_type, value_count, entry[8:12])
+            if value not in (None, ''):
+                found_tags[tag_id] = value
+            if len(found_tags) == len(wanted_tags):
+                # Все нужные теги найдены - дальше каталог не читаем
+                return None
+    return exif_ifd_offset
+
+
+def read_tiff_header(reader):
+    # Возвращает (порядок байтов для struct, смещение IFD0)
+    byte_order_mark = reader.read_at(0, 2)
+    if byte_order_mark == b'II':
+        byte_order = '<'
+    elif byte_order_mark == b'MM':
+        byte_order = '>'
+    else:
+        raise ExifReaderError("Неизвестный порядок байтов TIFF")
+    magic_number, ifd0_offset = struct.unpack(byte_order + 'HI', reader.read_at(2, 6))
+    if magic_number not in TIFF_MAGIC_NUMBERS:
+        raise ExifReaderError("Неизвестная сигнатура TIFF")
+    return byte_order, ifd0_offset
+
+
+def read_tiff_tags(reader, wanted_tags):
+    byte_order, ifd0_offset = read_tiff_header(reader)
+    found_tags = {}
+    exif_ifd_offset = read_ifd_tags(reader, byte_order, ifd0_offset, wanted_tags, found_tags)
+    if exif_ifd_offset and len(found_tags) < len(wanted_tags):
+        read_ifd_tags(reader, byte_order, exif_ifd_offset, wanted_tags, found_tags)
+    return found_tags
+
+
+def find_jpeg_exif_offset(reader, jpeg_offset=0):
+    # Смещение TIFF-заголовка внутри сегмента APP1 Exif или None
+    if reader.read_at(jpeg_offset, 2) != JPEG_SIGNATURE:
+        raise ExifReaderError("Не JPEG")
+    position = jpeg_offset + 2
+    while True:
+        marker_prefix, marker = reader.read_at(position, 2)
+        if marker_prefix != 0xFF:
+            raise ExifReaderError("Поврежденная структура JPEG")
+        if marker == 0xFF:
+            position += 1
+            continue
+        # Начало сжатых данных или конец файла - EXIF уже не встретится
+        if marker in (0xDA, 0xD9):
+            return None
+        segment_length = struct.unpack('>H', reader.read_at(position + 2, 2))[0]
+        if marker == 0xE1 and reader.read_at(position + 4, 6) == EXIF_APP1_HEADER:
+            return position + 10
+        position += 2 + segment_length
+
+
+def read_jpeg_tags(reader, wanted_tags, jpeg_offset=0):
+    exif_offset = find_jpeg_exif_offset(reader, jpeg_offset)
+    if exif_offset is None:
+        return {}
+    return read_tiff_tags(reader.with_base(exif_offset), wanted_tags)
+
+
+def read_png_tags(reader, wanted_tags):
+    position = len(PNG_SIGNATURE)
+    while True:
+        chunk_length, chunk_type = struct.unpack('>I4s', reader.read_at(position, 8))
+        if chunk_type == b'eXIf':
+            return read_tiff_tags(reader.with_base(position + 8), wanted_tags)
+        if chunk_type == b'IEND':
+            return {}
+        position += 12 + chunk_length
+
+
+def read_raf_tags(reader, wanted_tags):
+    jpeg_offset = struct.unpack('>I', reader.read_at(84, 4))[0]
+    return read_jpeg_tags(reader, wanted_tags, jpeg_offset)
+
+
+def read_exif_tags_from_file(file_object, wanted_tags):
+    reader = BlockFileReader(file_object)
+    signature = reader.read_at(0, 2)
+    if signature == JPEG_SIGNATURE:
+        found_tags = read_jpeg_tags(reader, wanted_tags)
+    elif signature in (b'II', b'MM'):
+        found_tags = read_tiff_tags(reader, wanted_tags)
+    elif signature == PNG_SIGNATURE[:2] and reader.read_at(0, 8) == PNG_SIGNATURE:
+        found_tags = read_png_tags(reader, wanted_tags)
+    elif signature == RAF_SIGNATURE[:2] and reader.read_at(0, 16) == RAF_SIGNATURE:
+        found_tags = read_raf_tags(reader, wanted_tags)
+    else:
+        raise ExifReaderError("Неподдерживаемый формат файла")
+    return found_tags, reader.bytes_read
+
+
+def read_integer_values(reader, byte_order, field_type, value_count, value_bytes):
+    # Все значения SHORT/LONG тега: у SubIFDs и StripOffsets их бывает несколько
+    if field_type not in (3, 4) or not 0 < value_count <= MAX_IFD_ENTRIES:
+        return []
+    format_char = 'H' if field_type == 3 else 'I'
+    total_size = TIFF_TYPE_SIZES[field_type] * value_count
+    if total_size > 4:
+        value_bytes = reader.read_at(struct.unpack(byte_order + 'I', value_bytes)[0], total_size)
+    return list(struct.unpack(byte_order + format_char * value_count, value_bytes[:total_size]))
+
+
+def collect_tiff_previews(reader, previews):
+    # Добавляет в previews (абсолютное смещение, длина) JPEG-превью из цепочки IFD и SubIFD
+    byte_order, ifd0_offset = read_tiff_header(reader)
+    pending_ifd_offsets = [ifd0_offset]
+    visited_ifd_offsets = set()
+    while pending_ifd_offsets and len(visited_ifd_offsets) < MAX_PREVIEW_IFDS:
+        ifd_offset = pending_ifd_offsets.pop(0)
+        if not ifd_offset or ifd_offset in visited_ifd_offsets:
+            continue
+        visited_ifd_offsets.add(ifd_offset)
+        entry_count = struct.unpack(byte_order + 'H', reader.read_at(ifd_offset, 2))[0]
+        if entry_count > MAX_IFD_ENTRIES:
+            raise ExifReaderError("Поврежденный каталог IFD")
+        entries = reader.read_at(ifd_offset + 2, entry_count * 12)
+        tag_values = {}
+        for entry_number in range(entry_count):
+            entry = entries[entry_number * 12:(entry_number + 1) * 12]
+            tag_id, field_type, value_count = struct.unpack(byte_order + 'HHI', entry[:8])
+            if tag_id in (EXIF_TAG_COMPRESSION, EXIF_TAG_STRIP_OFFSETS, EXIF_TAG_STRIP_BYTE_COUNTS, EXIF_TAG_SUB_IFDS,
+                          EXIF_TAG_JPEG_INTERCHANGE_FORMAT, EXIF_TAG_JPEG_INTERCHANGE_FORMAT_LENGTH):
+                tag_values[tag_id] = read_integer_values(reader, byte_order, field_type, value_count, entry[8:12])
+        preview_offsets = tag_values.get(EXIF_TAG_JPEG_INTERCHANGE_FORMAT)
+        preview_lengths = tag_values.get(EXIF_TAG_JPEG_INTERCHANGE_FORMAT_LENGTH)
+        compression = tag_values.get(EXIF_TAG_COMPRESSION) or [None]
+        if not (preview_offsets and preview_lengths) and compression[0] in JPEG_COMPRESSION_TYPES:
+            # Превью одной полосой StripOffsets (CR2, часть NEF); многополосный JPEG не собираем
+            preview_offsets = tag_values.get(EXIF_TAG_STRIP_OFFSETS)
+            preview_lengths = tag_values.get(EXIF_TAG_STRIP_BYTE_COUNTS)
+            if preview_offsets and len(preview_offsets) != 1:
+                preview_offsets = None
+        if preview_offsets and preview_lengths and 0 < preview_lengths[0] <= MAX_PREVIEW_BYTES:
+            previews.append((reader.base_offset + preview_offsets[0], preview_lengths[0]))
+        pending_ifd_offsets.extend(tag_values.get(EXIF_TAG_SUB_IFDS, []))
+        pending_ifd_offsets.append(
+            struct.unpack(byte_order + 'I', reader.read_at(ifd_offset + 2 + entry_count * 12, 4))[0]
+        )
+
+
+def find_embedded_previews(file_object):
+    # Все встроенные JPEG-превью файла: [(абсолютное смещение, длина), ...]
+    reader = BlockFileReader(file_object)
+    previews = []
+    signature = reader.read_at(0, 2)
+    if signature == JPEG_SIGNATURE:
+        exif_offset = find_jpeg_exif_offset(reader)
+        if exif_offset is not None:
+            collect_tiff_previews(reader.with_base(exif_offset), previews)
+    elif signature in (b'II', b'MM'):
+        collect_tiff_previews(reader, previews)
+    elif signature == RAF_SIGNATURE[:2] and reader.read_at(0, 16) == RAF_SIGNATURE:
+        jpeg_offset, jpeg_length = struct.unpack('>II', reader.read_at(84, 8))
+        if 0 < jpeg_length <= MAX_PREVIEW_BYTES:
+            previews.append((jpeg_offset, jpeg_length))
+    return previews
+
+
+class HeaderExtentFile(io.BytesIO):
+    # Запоминает, докуда из него читали
+    def __init__(self, header_bytes):
+        super().__init__(header_bytes)
+        self.read_extent = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.read_extent = max(self.read_extent, self.tell())
+        return data
+
+
+def measure_header_size(header_bytes):
+    # Сколько байт от начала файла нужно чтению тегов HEADER_TAGS (или любой их части), поиску
+    # встроенных превью и самим превью, целиком лежащим в header_bytes. Повторное чтение
+    # обрезанного до этой длины начала пойдет по тем же блокам и даст тот же результат
+    header_file = HeaderExtentFile(header_bytes)
+    try:
+        read_exif_tags_from_file(header_file, frozenset(HEADER_TAGS))
+    except (ExifReaderError, struct.error, ValueError, IndexError):
+        pass
+    try:
+        previews = find_embedded_previews(header_file)
+    except (ExifReaderError, struct.error, ValueError, IndexError):
+        previews = []
+    header_size = header_file.read_extent
+    for preview_offset, preview_length in previews:
+        if preview_offset + preview_length <= len(header_bytes):
+            header_size = max(header_size, preview_offset + preview_length)
+    return header_size
+
+
+def open_image_file(image_path):
+    # Снимок внутри ZIP/TAR (путь "архив.zip/DCIM/IMG_0001.JPG") читается из архива без распаковки
+    if split_archive_path(image_path) is not None:
+        return open_archive_member(image_path)
+    return open(image_path, 'rb')
+
+
+def read_embedded_preview(image_path, min_preview_bytes=MIN_PREVIEW_BYTES):
+    # JPEG-байты встроенного превью или None. Берется наименьшее превью не меньше
+    # min_preview_bytes (обычно полноэкранное превью RAW), иначе наибольшее из имеющихся
+    try:
+        with open_image_file(image_path) as image_file:
+            previews = find_embedded_previews(image_file)
+            if not previews:
+                return None
+            large_previews = [preview for preview in previews if preview[1] >= min_preview_bytes]
+            preview_offset, preview_length = min(large_previews, key=lambda preview: preview[1]) \
+                if large_previews else max(previews, key=lambda preview: preview[1])
+            image_file.seek(preview_offset)
+            preview_bytes = image_file.read(preview_length)
+    except (ExifReaderError, OSError, struct.error, ValueError, IndexError):
+        return None
+    if len(preview_bytes) != preview_length or not preview_bytes.startswith(JPEG_SIGNATURE):
+        return None
+    return preview_bytes
+
+
+def read_exif_tags(image_path, wanted_tags):
+    wanted_tags = frozenset(wanted_tags)
+    try:
+        with open_image_file(image_path) as image_file:
+            found_tags, bytes_read = read_exif_tags_from_file(image_file, wanted_tags)
+    except (struct.error, ValueError, IndexError) as error:
+        raise ExifReaderError(str(error))
+    with header_read_statistics_lock:
+        header_read_statistics['bytes_read'] += bytes_read
+        header_read_statistics['files'] += 1
+    return found_tags
+
+
+def get_header_bytes_read():
+    with header_read_statistics_lock:
+        return header_read_statistics['bytes_read']
+
+
+def extract_camera_model_with_pil(image_path):
+    from PIL import Image
+    from PIL.ExifTags import TAGS
+    try:
+        with Image.open(image_path) as image:
+            exif_data = image._getexif()
+            if exif_data:
+                for tag_id, value in exif_data.items():
+                    if TAGS.get(tag_id) == "Model" and value:
+                        return str(value).strip()
+    except Exception:
+        return None
+    return None
+
+
+def extract_camera_model(image_path):
+    try:
+        camera_model = read_exif_tags(image_path, (EXIF_TAG_MODEL,)).get(EXIF_TAG_MODEL)
+    except ExifReaderError:
+        return extract_camera_model_with_pil(image_path)
+    except OSError:
+        return None
+    return str(camera_model).strip() if camera_model else None
+
+
+def text_tag_value(value):
+    return (str(value).strip() or None) if value else None
+
+
+def integer_tag_value(value):
+    return value if isinstance(value, int) and value > 0 else None
+
+
+def extract_photo_metadata(image_path):
+    # Все поля индекса за одно чтение заголовка. Размеры - из PixelX/YDimension,
+    # для TIFF без них - из IFD0 (у RAW там бывает размер миниатюры)
+    try:
+        found_tags = read_exif_tags(image_path, PHOTO_METADATA_TAGS)
+    except ExifReaderError:
+        return EMPTY_PHOTO_METADATA._replace(camera_model=extract_camera_model_with_pil(image_path))
+    except OSError:
+        return EMPTY_PHOTO_METADATA
+    return PhotoMetadata(
+        text_tag_value(found_tags.get(EXIF_TAG_MAKE)),
+        text_tag_value(found_tags.get(EXIF_TAG_MODEL)),
+        text_tag_value(found_tags.get(EXIF_TAG_LENS_MODEL)),
+        text_tag_value(found_tags.get(EXIF_TAG_DATE_TIME_ORIGINAL) or found_tags.get(EXIF_TAG_CREATE_DATE)),
+        integer_tag_value(found_tags.get(EXIF_TAG_PIXEL_X_DIMENSION) or found_tags.get(EXIF_TAG_IMAGE_WIDTH)),
+        integer_tag_value(found_tags.get(EXIF_TAG_PIXEL_Y_DIMENSION) or found_tags.get(EXIF_TAG_IMAGE_HEIGHT))
+    )
+
+
+def extract_orientation(image_path):
+    # Ориентация EXIF 1-8 из IFD0; встроенные превью обычно записаны без поворота
+    try:
+        orientation = read_exif_tags(image_path, (EXIF_TAG_ORIENTATION,)).get(EXIF_TAG_ORIENTATION)
+    except (ExifReaderError, OSError):
+        return None
+    return orientation if isinstance(orientation, int) and 1 <= orientation <= 8 else None
+
+
+def extract_photo_date(image_path):
+    # DateTimeOriginal, а если его нет - CreateDate, в формате EXIF "ГГГГ:ММ:ДД ЧЧ:ММ:СС"
+    try:
+        found_tags = read_exif_tags(image_path, (EXIF_TAG_DATE_TIME_ORIGINAL, EXIF_TAG_CREATE_DATE))
+    except (ExifReaderError, OSError):
+        return None
+    date_time = found_tags.get(EXIF_TAG_DATE_TIME_ORIGINAL) or found_tags.get(EXIF_TAG_CREATE_DATE)
+    return str(date_time).strip() if date_time else None
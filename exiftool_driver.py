@@ -0,0 +1,371 @@
+import os
+import json
+import time
+import queue
+import tempfile
+import threading
+import subprocess
+import collections
+
+from photo_index import DEFAULT_INDEX_DIRECTORY, normalize_index_path
+from tree_walker import IMAGE_EXTENSIONS, TreeWalker
+
+DEFAULT_STATE_PATH = os.path.join(DEFAULT_INDEX_DIRECTORY, "exiftool_sort_state.jsonl")
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_CHUNK_TIMEOUT_SECONDS = 600
+DEFAULT_PROCESS_COUNT = 2
+# Все, что exiftool умеет переносить по дате, а не только то, что понимает анализатор моделей
+EXIFTOOL_EXTENSIONS = IMAGE_EXTENSIONS | frozenset(
+    ('.tif', '.dng', '.orf', '.rw2', '.pef', '.srw', '.heic', '.heif', '.mov', '.mp4', '.3gp', '.avi')
+)
+DATE_SORT_ARGUMENTS = ("-d", "%Y/%m/%d", "-Directory<DateTimeOriginal", "-Directory<CreateDate")
+
+ExifToolChunk = collections.namedtuple('ExifToolChunk', 'chunk_number file_paths')
+ExifToolFileResult = collections.namedtuple('ExifToolFileResult', 'chunk_number source_path status message')
+ExifToolChunkResult = collections.namedtuple('ExifToolChunkResult', 'chunk_number output errors timed_out')
+
+
+class ExifToolError(Exception):
+    pass
+
+
+class UnfinishedSortError(FileExistsError):
+    pass
+
+
+class ExifToolProcess:
+    # Один экземпляр exiftool в режиме -stay_open: команды идут через stdin,
+    # конец ответа на каждую команду отмечается строкой {readyN}
+    def __init__(self, exiftool_path, working_directory=None):
+        self.exiftool_path = exiftool_path
+        self.working_directory = working_directory
+        self.command_number = 0
+        self.process = None
+        self.stderr_lines = queue.SimpleQueue()
+        self.start()
+
+    def start(self):
+        creation_flags = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+        self.process = subprocess.Popen(
+            [self.exiftool_path, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.working_directory,
+            creationflags=creation_flags
+        )
+        threading.Thread(target=self.drain_stderr, args=(self.process,), daemon=True).start()
+
+    def drain_stderr(self, process):
+        with process.stderr:
+            for line in iter(process.stderr.readline, b''):
+                self.stderr_lines.put(line.decode('utf-8', errors='replace').rstrip('\r\n'))
+
+    def execute(self, arguments, timeout_seconds=None, line_callback=None):
+        # Возвращает (строки stdout, строки stderr); по таймауту процесс убивается
+        # и перезапускается, а ExifToolError сообщает о потерянной команде.
+        # -echo4 ставит такую же метку в конец stderr, чтобы не потерять поздние ошибки
+        self.command_number += 1
+        ready_marker = f"{{ready{self.command_number}}}"
+        command_text = ''.join(
+            argument + '\n' for argument in (*arguments, "-echo4", ready_marker)
+        ) + f"-execute{self.command_number}\n"
+        started_at = time.monotonic()
+        output_lines = []
+        reader_finished = threading.Event()
+        reader_errors = []
+        process_output = self.process.stdout
+
+        def read_until_ready():
+            try:
+                for raw_line in iter(process_output.readline, b''):
+                    line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+                    if line == ready_marker:
+                        return
+                    output_lines.append(line)
+                    if line_callback:
+                        line_callback(line)
+                reader_errors.append(ExifToolError("exiftool неожиданно завершился"))
+            except (OSError, ValueError):
+                # Канал закрыт: процесс убит по таймауту, пока поток еще читал
+                reader_errors.append(ExifToolError("exiftool неожиданно завершился"))
+            finally:
+                reader_finished.set()
+
+        try:
+            self.process.stdin.write(command_text.encode('utf-8'))
+            self.process.stdin.flush()
+        except OSError as error:
+            self.restart()
+            raise ExifToolError(f"Не удалось передать команду exiftool: {error}")
+        threading.Thread(target=read_until_ready, daemon=True).start()
+        if not reader_finished.wait(timeout_seconds):
+            self.restart()
+            raise TimeoutError(f"exiftool не ответил за {timeout_seconds} с")
+        if reader_errors:
+            self.restart()
+            raise reader_errors[0]
+        remaining_seconds = None if timeout_seconds is None else max(0.0, timeout_seconds - (time.monotonic() - started_at))
+        return output_lines, self.collect_stderr(ready_marker, remaining_seconds)
+
+    def collect_stderr(self, ready_marker, timeout_seconds):
+        error_lines = []
+        deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+        while True:
+            try:
+                line = self.stderr_lines.get(
+                    timeout=None if deadline is None else max(0.01, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                return error_lines
+            if line == ready_marker:
+                return error_lines
+            error_lines.append(line)
+
+    def restart(self):
+        self.kill()
+        self.stderr_lines = queue.SimpleQueue()
+        self.start()
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.close_pipes()
+
+    def close_pipes(self):
+        # stderr закрывает drain_stderr, дочитав его до конца
+        if self.process is None:
+            return
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.write(b"-stay_open\nFalse\n")
+            self.process.stdin.flush()
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+        self.close_pipes()
+        self.process = None
+
+
+class ExifToolSortState:
+    # План раскладки (номера пакетов и их файлы) и отметки о выполненных пакетах.
+    # После сбоя или таймаута run продолжается с первого невыполненного пакета
+    def __init__(self, state_path=DEFAULT_STATE_PATH):
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.state_file = None
+
+    def exists(self):
+        return os.path.isfile(self.state_path)
+
+    def create(self, source_directory, target_directory, chunks):
+        # Состояние незавершенной сортировки не перезаписывается: без него ее уже не продолжить
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        try:
+            self.state_file = open(self.state_path, 'x', encoding='utf-8')
+        except FileExistsError:
+            raise self.unfinished_sort_error()
+        self.write_record({'op': 'start', 'source': source_directory, 'target': target_directory})
+        for chunk in chunks:
+            self.write_record({'op': 'chunk', 'chunk': chunk.chunk_number, 'files': chunk.file_paths})
+
+    def unfinished_sort_error(self):
+        header = self.read_header()
+        description = f"из {header.get('source')} в {header.get('target')}" if header else f"({self.state_path})"
+        return UnfinishedSortError(
+            f"Есть незавершенная сортировка {description}: запустите ее еще раз с теми же папками, "
+            f"чтобы продолжить, или удалите {self.state_path}"
+        )
+
+    def read_header(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as state_file:
+                record = json.loads(state_file.readline())
+        except (OSError, ValueError):
+            return None
+        return record if isinstance(record, dict) and record.get('op') == 'start' else None
+
+    def load(self, source_directory, target_directory=None):
+        # Возвращает невыполненные пакеты или None, если состояние от другой исходной или целевой папки
+        header = None
+        chunks = {}
+        with open(self.state_path, encoding='utf-8') as state_file:
+            for line in state_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('op') == 'start':
+                    header = record
+                elif record.get('op') == 'chunk':
+                    chunks[record['chunk']] = ExifToolChunk(record['chunk'], record['files'])
+                elif record.get('op') == 'done':
+                    chunks.pop(record['chunk'], None)
+        if header is None or normalize_index_path(header['source']) != normalize_index_path(source_directory):
+            return None
+        if target_directory is not None and (
+                normalize_index_path(header.get('target') or '') != normalize_index_path(target_directory)):
+            return None
+        self.state_file = open(self.state_path, 'a', encoding='utf-8')
+        return [chunks[chunk_number] for chunk_number in sorted(chunks)]
+
+    def write_record(self, record):
+        with self.lock:
+            self.state_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.state_file.flush()
+
+    def mark_done(self, chunk_number):
+        self.write_record({'op': 'done', 'chunk': chunk_number})
+
+    def close(self):
+        if self.state_file is not None:
+            self.state_file.close()
+            self.state_file = None
+
+    def finish(self):
+        self.close()
+        if os.path.isfile(self.state_path):
+            os.remove(self.state_path)
+
+
+def plan_chunks(source_directory, chunk_size=DEFAULT_CHUNK_SIZE, extensions=EXIFTOOL_EXTENSIONS):
+    # Пакеты не пересекают границы папок: каждый процесс работает со своим поддеревом
+    chunks = []
+    current_directory = None
+    current_files = []
+    for walked_file in TreeWalker(extensions).walk(source_directory):
+        file_directory = os.path.dirname(walked_file.path)
+        if current_files and (file_directory != current_directory or len(current_files) >= chunk_size):
+            chunks.append(ExifToolChunk(len(chunks), current_files))
+            current_files = []
+        current_directory = file_directory
+        current_files.append(walked_file.path)
+    if current_files:
+        chunks.append(ExifToolChunk(len(chunks), current_files))
+    return chunks
+
+
+class ExifToolBatchSorter:
+    def __init__(self, exiftool_path, target_directory, process_count=DEFAULT_PROCESS_COUNT,
+                 chunk_size=DEFAULT_CHUNK_SIZE, chunk_timeout=DEFAULT_CHUNK_TIMEOUT_SECONDS,
+                 command_arguments=DATE_SORT_ARGUMENTS, state_path=DEFAULT_STATE_PATH):
+        self.exiftool_path = exiftool_path
+        self.target_directory = target_directory
+        self.process_count = max(1, int(process_count))
+        self.chunk_size = chunk_size
+        self.chunk_timeout = chunk_timeout
+        self.command_arguments = list(command_arguments)
+        self.sort_state = ExifToolSortState(state_path)
+
+    def prepare_chunks(self, source_directory, resume=True):
+        # Чужое незавершенное состояние (другие папки или resume=False) не перезаписывается
+        if self.sort_state.exists():
+            pending_chunks = self.sort_state.load(source_directory, self.target_directory) if resume else None
+            if pending_chunks is not None:
+                return pending_chunks, True
+            raise self.sort_state.unfinished_sort_error()
+        chunks = plan_chunks(source_directory, self.chunk_size)
+        self.sort_state.create(source_directory, self.target_directory, chunks)
+        return chunks, False
+
+    def sort(self, chunks, output_callback=None):
+        # Пакеты раздаются нескольким процессам exiftool; результаты по файлам
+        # отдаются по мере готовности пакетов, а не в конце всего прогона
+        chunk_queue = queue.SimpleQueue()
+        for chunk in chunks:
+            chunk_queue.put(chunk)
+        result_queue = queue.SimpleQueue()
+        worker_count = min(self.process_count, len(chunks))
+        workers = [
+            threading.Thread(target=self.run_worker, args=(chunk_queue, result_queue, output_callback), daemon=True)
+            for _ in range(worker_count)
+        ]
+        for worker in workers:
+            worker.start()
+
+        finished_workers = 0
+        all_chunks_done = True
+        while finished_workers < worker_count:
+            queued_item = result_queue.get()
+            if queued_item is None:
+                finished_workers += 1
+                continue
+            chunk, chunk_result = queued_item
+            if chunk_result.timed_out:
+                all_chunks_done = False
+            yield from self.collect_file_results(chunk, chunk_result)
+        for worker in workers:
+            worker.join()
+        if all_chunks_done:
+            self.sort_state.finish()
+        else:
+            self.sort_state.close()
+
+    def run_worker(self, chunk_queue, result_queue, output_callback):
+        exiftool_process = None
+        try:
+            exiftool_process = ExifToolProcess(self.exiftool_path, self.target_directory)
+            while True:
+                try:
+                    chunk = chunk_queue.get_nowait()
+                except queue.Empty:
+                    break
+                result_queue.put((chunk, self.run_chunk(exiftool_process, chunk, output_callback)))
+        except OSError as error:
+            # exiftool не запустился: оставшиеся пакеты помечаются ошибкой, но не выполненными
+            while True:
+                try:
+                    chunk = chunk_queue.get_nowait()
+                except queue.Empty:
+                    break
+                result_queue.put((chunk, ExifToolChunkResult(chunk.chunk_number, [], [str(error)], True)))
+        finally:
+            if exiftool_process is not None:
+                exiftool_process.close()
+            result_queue.put(None)
+
+    def run_chunk(self, exiftool_process, chunk, output_callback):
+        # Имена файлов передаются через argfile в UTF-8: без ограничений длины командной строки и кодировки
+        argument_file_descriptor, argument_file_path = tempfile.mkstemp(prefix="exiftool_", suffix=".args")
+        try:
+            with os.fdopen(argument_file_descriptor, 'w', encoding='utf-8') as argument_file:
+                for file_path in chunk.file_paths:
+                    argument_file.write(file_path + '\n')
+            arguments = ["-charset", "filename=utf8", *self.command_arguments, "-@", argument_file_path]
+            try:
+                output_lines, error_lines = exiftool_process.execute(arguments, self.chunk_timeout, output_callback)
+            except (TimeoutError, ExifToolError) as error:
+                return ExifToolChunkResult(chunk.chunk_number, [], [str(error)], True)
+        finally:
+            os.remove(argument_file_path)
+        self.sort_state.mark_done(chunk.chunk_number)
+        return ExifToolChunkResult(chunk.chunk_number, output_lines, error_lines, False)
+
+    def collect_file_results(self, chunk, chunk_result):
+        # exiftool не сообщает о каждом файле отдельно: перенесенный файл исчезает
+        # из исходной папки, а ошибки в stderr содержат путь к файлу
+        error_by_path = {}
+        for error_line in chunk_result.errors:
+            for file_path in chunk.file_paths:
+                if file_path in error_line:
+                    error_by_path[file_path] = error_line
+        for file_path in chunk.file_paths:
+            if not os.path.exists(file_path):
+                yield ExifToolFileResult(chunk.chunk_number, file_path, 'moved', None)
+            elif chunk_result.timed_out:
+                yield ExifToolFileResult(
+                    chunk.chunk_number, file_path, 'pending', '; '.join(chunk_result.errors)
+                )
+            elif file_path in error_by_path:
+                yield ExifToolFileResult(chunk.chunk_number, file_path, 'error', error_by_path[file_path])
+            else:
+                yield ExifToolFileResult(chunk.chunk_number, file_path, 'unchanged', None)
@@ -0,0 +1,132 @@
+import os
+import time
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+from exif_reader import extract_photo_metadata
+
+NO_CACHED_RESULT = object()
+
+HDD_WORKER_COUNT = 2
+SSD_WORKER_COUNT = min(32, (os.cpu_count() or 4) * 2)
+UNKNOWN_DEVICE_WORKER_COUNT = 4
+
+PoolResult = collections.namedtuple('PoolResult', 'item value error from_cache')
+
+
+def extract_photo_metadata_with_stat(image_path):
+    file_stat = os.stat(image_path)
+    return extract_photo_metadata(image_path), file_stat.st_size, file_stat.st_mtime_ns
+
+
+def extract_walked_file_metadata(walked_file):
+    # Размер и время изменения уже получены обходчиком из DirEntry
+    return extract_photo_metadata(walked_file.path), walked_file.file_size, walked_file.modification_time
+
+
+def is_rotational_device(directory_path):
+    # Определяется только в Linux через sysfs; None - тип носителя неизвестен
+    try:
+        device_id = os.stat(directory_path).st_dev
+    except OSError:
+        return None
+    device_directory = f"/sys/dev/block/{os.major(device_id)}:{os.minor(device_id)}"
+    for queue_directory in ("queue", os.path.join("..", "queue")):
+        rotational_path = os.path.join(device_directory, queue_directory, "rotational")
+        try:
+            with open(rotational_path) as rotational_file:
+                return rotational_file.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def suggest_worker_count(directory_path):
+    rotational = is_rotational_device(directory_path)
+    if rotational is None:
+        return UNKNOWN_DEVICE_WORKER_COUNT
+    return HDD_WORKER_COUNT if rotational else SSD_WORKER_COUNT
+
+
+class ExtractionPool:
+    def __init__(self, worker_count, use_processes=False, queue_size=None, queue_depth_callback=None,
+                 concurrency_controller=None):
+        self.worker_count = max(1, int(worker_count))
+        self.use_processes = use_processes
+        self.queue_size = queue_size or self.worker_count * 4
+        # Вызывается с числом файлов в работе после каждой постановки в очередь
+        self.queue_depth_callback = queue_depth_callback
+        # AdaptiveConcurrencyController: число файлов в работе подбирается по задержкам
+        # вместо постоянного queue_size
+        self.concurrency_controller = concurrency_controller
+
+    def create_executor(self):
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.worker_count)
+        if self.concurrency_controller is not None:
+            # Потоки создаются по мере надобности, одновременно работает не больше текущего предела
+            return ThreadPoolExecutor(max_workers=self.concurrency_controller.max_limit)
+        return ThreadPoolExecutor(max_workers=self.worker_count)
+
+    def current_queue_size(self):
+        if self.concurrency_controller is not None:
+            return self.concurrency_controller.current_limit()
+        return self.queue_size
+
+    def map_ordered(self, worker_function, items, cached_result_lookup=None,
+                    should_stop=None, wait_while_paused=None):
+        # Результаты отдаются строго в порядке входных элементов,
+        # в работе одновременно не больше queue_size файлов
+        pending_results = collections.deque()
+        executor = self.create_executor()
+        try:
+            for item in items:
+                if wait_while_paused:
+                    wait_while_paused()
+                if should_stop and should_stop():
+                    break
+                pending_results.append(self.submit_item(executor, worker_function, item, cached_result_lookup))
+                if self.queue_depth_callback is not None:
+                    self.queue_depth_callback(len(pending_results))
+                if self.concurrency_controller is not None:
+                    self.concurrency_controller.observe_in_flight(len(pending_results))
+                while len(pending_results) >= self.current_queue_size():
+                    yield self.collect_result(*pending_results.popleft())
+            while pending_results:
+                if should_stop and should_stop():
+                    break
+                yield self.collect_result(*pending_results.popleft())
+        finally:
+            for _, future, _ in pending_results:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def submit_item(self, executor, worker_function, item, cached_result_lookup):
+        if cached_result_lookup is not None:
+            completed_future = Future()
+            try:
+                cached_value = cached_result_lookup(item)
+            except Exception as error:
+                completed_future.set_exception(error)
+                return item, completed_future, True
+            if cached_value is not NO_CACHED_RESULT:
+                completed_future.set_result(cached_value)
+                return item, completed_future, True
+        future = executor.submit(worker_function, item)
+        if self.concurrency_controller is not None:
+            # Задержка - от постановки до готовности: очередь внутри процессов тоже ее увеличивает
+            submitted_at = time.monotonic()
+            future.add_done_callback(lambda done_future: self.record_latency(done_future, submitted_at))
+        return item, future, False
+
+    def record_latency(self, done_future, submitted_at):
+        if not done_future.cancelled():
+            self.concurrency_controller.record(
+                time.monotonic() - submitted_at, error=done_future.exception() is not None
+            )
+
+    def collect_result(self, item, future, from_cache):
+        try:
+            return PoolResult(item, future.result(), None, from_cache)
+        except Exception as error:
+            return PoolResult(item, None, error, from_cache)
@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import select
+import hashlib
+import collections
+
+from photo_index import DEFAULT_INDEX_DIRECTORY, normalize_index_path
+from tree_walker import IMAGE_EXTENSIONS, scan_directory
+
+SNAPSHOT_DIRECTORY = os.path.join(DEFAULT_INDEX_DIRECTORY, "snapshots")
+SNAPSHOT_FORMAT_VERSION = 1
+DEFAULT_POLL_INTERVAL_SECONDS = 30.0
+DEFAULT_SETTLE_DELAY_SECONDS = 2.0
+
+# files: {имя: (размер, время изменения)}, subdirectories: [имя, ...]
+SnapshotDirectory = collections.namedtuple('SnapshotDirectory', 'modification_time files subdirectories')
+ChangedFile = collections.namedtuple('ChangedFile', 'walked_file relative_path change_kind')
+
+
+def default_snapshot_path(source_directory):
+    source_key = hashlib.sha1(normalize_index_path(source_directory).encode('utf-8')).hexdigest()
+    return os.path.join(SNAPSHOT_DIRECTORY, f"{source_key}.json")
+
+
+class DirectorySnapshot:
+    # Состояние дерева после прошлого прогона: время изменения каждой папки
+    # и размер/время каждого файла. Ключи - пути относительно исходной папки
+    def __init__(self, source_directory, directories=None):
+        self.source_directory = source_directory
+        self.directories = dict(directories or {})
+
+    def belongs_to(self, source_directory):
+        return normalize_index_path(self.source_directory) == normalize_index_path(source_directory)
+
+    def file_count(self):
+        return sum(len(directory.files) for directory in self.directories.values())
+
+    def iterate_subtree_files(self, relative_directory):
+        directory = self.directories.get(relative_directory)
+        if directory is None:
+            return
+        for filename in directory.files:
+            yield os.path.join(relative_directory, filename)
+        for subdirectory_name in directory.subdirectories:
+            yield from self.iterate_subtree_files(os.path.join(relative_directory, subdirectory_name))
+
+    def save(self, snapshot_path=None):
+        snapshot_path = snapshot_path or default_snapshot_path(self.source_directory)
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        temporary_path = snapshot_path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump({
+                'version': SNAPSHOT_FORMAT_VERSION,
+                'source_directory': self.source_directory,
+                'directories': {
+                    relative_directory: [directory.modification_time, directory.files, directory.subdirectories]
+                    for relative_directory, directory in self.directories.items()
+                }
+            }, snapshot_file, ensure_ascii=False)
+        os.replace(temporary_path, snapshot_path)
+        return snapshot_path
+
+    @classmethod
+    def load(cls, snapshot_path):
+        with open(snapshot_path, encoding='utf-8') as snapshot_file:
+            snapshot_data = json.load(snapshot_file)
+        if snapshot_data.get('version') != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия снимка: {snapshot_data.get('version')}")
+        directories = {
+            relative_directory: SnapshotDirectory(
+                modification_time, {name: tuple(file_stat) for name, file_stat in files.items()}, subdirectories
+            )
+            for relative_directory, (modification_time, files, subdirectories) in snapshot_data['directories'].items()
+        }
+        return cls(snapshot_data['source_directory'], directories)
+
+    @classmethod
+    def load_for_directory(cls, source_directory):
+        snapshot_path = default_snapshot_path(source_directory)
+        if not os.path.isfile(snapshot_path):
+            return None
+        try:
+            snapshot = cls.load(snapshot_path)
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+        return snapshot if snapshot.belongs_to(source_directory) else None
+
+
+class IncrementalScanner:
+    # Папка с прежним временем изменения не перечитывается: набор файлов в ней
+    # тот же, берем его из снимка и спускаемся только в подпапки. Файл,
+    # перезаписанный на месте без переименования, в такой папке не заметен -
+    # фоторедакторы и камеры так не пишут, для полной проверки есть обычный анализ
+    def __init__(self, previous_snapshot, extensions=IMAGE_EXTENSIONS, should_stop=None, wait_while_paused=None):
+        self.previous_snapshot = previous_snapshot
+        self.extensions = extensions
+        self.should_stop = should_stop
+        self.wait_while_paused = wait_while_paused
+        self.current_snapshot = DirectorySnapshot(previous_snapshot.source_directory)
+        self.removed_paths = []
+        self.pruned_directory_count = 0
+        self.scanned_directory_count = 0
+
+    def scan(self):
+        source_directory = self.previous_snapshot.source_directory
+        pending_directories = ['']
+        while pending_directories:
+            relative_directory = pending_directories.pop()
+            directory_path = os.path.join(source_directory, relative_directory) if relative_directory else source_directory
+            previous_directory = self.previous_snapshot.directories.get(relative_directory)
+            try:
+                directory_modification_time = os.stat(directory_path).st_mtime_ns
+            except OSError:
+                self.removed_paths.extend(self.previous_snapshot.iterate_subtree_files(relative_directory))
+                continue
+
+            if previous_directory is not None and previous_directory.modification_time == directory_modification_time:
+                self.pruned_directory_count += 1
+                current_directory = previous_directory
+                self.current_snapshot.directories[relative_directory] = current_directory
+            else:
+                self.scanned_directory_count += 1
+                directory_listing = scan_directory(directory_path, self.extensions, self.should_stop)
+                if self.should_stop and self.should_stop():
+                    return
+                current_files = {}
+                changed_files = []
+                for walked_file in directory_listing.files:
+                    filename = os.path.basename(walked_file.path)
+                    current_files[filename] = (walked_file.file_size, walked_file.modification_time)
+                    previous_stat = previous_directory.files.get(filename) if previous_directory else None
+                    if previous_stat is None or tuple(previous_stat) != current_files[filename]:
+                        changed_files.append(ChangedFile(
+                            walked_file,
+                            os.path.join(relative_directory, filename),
+                            'new' if previous_stat is None else 'changed'
+                        ))
+                current_subdirectories = [os.path.basename(path) for path in directory_listing.subdirectories]
+                if previous_directory is not None:
+                    self.collect_removed(relative_directory, previous_directory, current_files, current_subdirectories)
+                current_directory = SnapshotDirectory(directory_modification_time, current_files, current_subdirectories)
+                # Папка попадает в снимок до выдачи файлов, чтобы forget_file мог ее найти
+                self.current_snapshot.directories[relative_directory] = current_directory
+                for changed_file in changed_files:
+                    if self.wait_while_paused:
+                        self.wait_while_paused()
+                    if self.should_stop and self.should_stop():
+                        return
+                    yield changed_file
+
+            pending_directories.extend(
+                os.path.join(relative_directory, subdirectory_name)
+                for subdirectory_name in reversed(current_directory.subdirectories)
+            )
+
+    def collect_removed(self, relative_directory, previous_directory, current_files, current_subdirectories):
+        for filename in previous_directory.files:
+            if filename not in current_files:
+                self.removed_paths.append(os.path.join(relative_directory, filename))
+        for subdirectory_name in previous_directory.subdirectories:
+            if subdirectory_name not in current_subdirectories:
+                self.removed_paths.extend(
+                    self.previous_snapshot.iterate_subtree_files(os.path.join(relative_directory, subdirectory_name))
+                )
+
+    def forget_file(self, relative_path):
+        # Файл с ошибкой чтения не запоминаем, а папку помечаем измененной,
+        # чтобы следующий прогон перечитал ее и попробовал файл снова
+        relative_directory = os.path.dirname(relative_path)
+        directory = self.current_snapshot.directories.get(relative_directory)
+        if directory is not None:
+            directory.files.pop(os.path.basename(relative_path), None)
+            self.current_snapshot.directories[relative_directory] = directory._replace(modification_time=None)
+
+
+class InotifyWaiter:
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.inotify_descriptor = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.inotify_descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.watched_directories = set()
+
+    def watch_directories(self, directory_paths):
+        import ctypes
+        for directory_path in directory_paths:
+            if directory_path in self.watched_directories:
+                continue
+            watch_descriptor = self.libc.inotify_add_watch(
+                self.inotify_descriptor, os.fsencode(directory_path), self.WATCH_MASK
+            )
+            if watch_descriptor < 0:
+                error_number = ctypes.get_errno()
+                # Папка могла исчезнуть; исчерпание лимита наблюдений - повод перейти на опрос
+                if error_number in (2, 20):
+                    continue
+                raise OSError(error_number, f"inotify_add_watch: {directory_path}")
+            self.watched_directories.add(directory_path)
+
+    def wait(self, timeout_seconds):
+        readable, _, _ = select.select([self.inotify_descriptor], [], [], timeout_seconds)
+        if not readable:
+            return False
+        while True:
+            try:
+                if not os.read(self.inotify_descriptor, 64 * 1024):
+                    break
+            except BlockingIOError:
+                break
+        return True
+
+    def close(self):
+        os.close(self.inotify_descriptor)
+
+
+class ChangeWatcher:
+    # Ждет изменений в дереве: inotify в Linux, иначе периодический опрос.
+    # После первого события выжидает settle_delay, пока копирование не затихнет
+    def __init__(self, source_directory, poll_interval=DEFAULT_POLL_INTERVAL_SECONDS,
+                 settle_delay=DEFAULT_SETTLE_DELAY_SECONDS):
+        self.source_directory = source_directory
+        self.poll_interval = poll_interval
+        self.settle_delay = settle_delay
+        self.inotify_waiter = None
+        if sys.platform.startswith('linux'):
+            try:
+                self.inotify_waiter = InotifyWaiter()
+            except (OSError, AttributeError):
+                self.inotify_waiter = None
+
+    @property
+    def uses_inotify(self):
+        return self.inotify_waiter is not None
+
+    def update_watched_directories(self, snapshot):
+        if self.inotify_waiter is None:
+            return
+        try:
+            self.inotify_waiter.watch_directories(
+                os.path.join(self.source_directory, relative_directory) if relative_directory else self.source_directory
+                for relative_directory in snapshot.directories
+            )
+        except OSError:
+            self.inotify_waiter.close()
+            self.inotify_waiter = None
+
+    def wait_for_changes(self, stop_event):
+        # Даже с inotify раз в poll_interval выполняется контрольный проход:
+        # папки, созданные между проходом и установкой наблюдения, не теряются
+        if self.inotify_waiter is None:
+            return not stop_event.wait(self.poll_interval)
+        deadline = time.monotonic() + self.poll_interval
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            if self.inotify_waiter.wait(max(0.0, min(deadline - time.monotonic(), 1.0))):
+                settle_until = time.monotonic() + self.settle_delay
+                while time.monotonic() < settle_until and not stop_event.is_set():
+                    self.inotify_waiter.wait(max(0.0, settle_until - time.monotonic()))
+                break
+        return not stop_event.is_set()
+
+    def close(self):
+        if self.inotify_waiter is not None:
+            self.inotify_waiter.close()
+            self.inotify_waiter = None
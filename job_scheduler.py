@@ -0,0 +1,187 @@
+import time
+import itertools
+import threading
+import collections
+
+JOB_STATE_TITLES = {
+    'queued': "в очереди",
+    'running': "выполняется",
+    'paused': "на паузе",
+    'finished': "завершено",
+    'cancelled': "отменено",
+    'failed': "ошибка"
+}
+
+job_identifiers = itertools.count(1)
+
+
+class Job:
+    # Фоновая работа (анализ, перемещение, сортировка) с паузой и отменой на событиях.
+    # Рабочая функция получает задание и передает движку job.should_stop и
+    # job.wait_while_paused - они проверяются перед каждым файлом
+    def __init__(self, job_name, run_function):
+        self.job_id = next(job_identifiers)
+        self.job_name = job_name
+        self.run_function = run_function
+        self.state = 'queued'
+        self.processed_count = 0
+        self.error_count = 0
+        self.summary = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        # Событие установлено, пока задание не на паузе: ожидание паузы не крутит цикл
+        self.resume_event = threading.Event()
+        self.resume_event.set()
+        self.cancel_event = threading.Event()
+        self.finished_event = threading.Event()
+
+    def pause(self):
+        if not self.is_done():
+            self.resume_event.clear()
+
+    def resume(self):
+        self.resume_event.set()
+
+    def cancel(self):
+        # Пауза снимается, чтобы ожидающий поток увидел отмену
+        self.cancel_event.set()
+        self.resume_event.set()
+
+    def is_paused(self):
+        return not self.resume_event.is_set()
+
+    def is_done(self):
+        return self.finished_event.is_set()
+
+    def should_stop(self):
+        return self.cancel_event.is_set()
+
+    def wait_while_paused(self):
+        self.resume_event.wait()
+
+    def wait(self, timeout=None):
+        return self.finished_event.wait(timeout)
+
+    def report_progress(self, error=None):
+        self.processed_count += 1
+        if error is not None:
+            self.error_count += 1
+
+    def current_state(self):
+        if self.state == 'running' and self.is_paused():
+            return 'paused'
+        return self.state
+
+    def elapsed_seconds(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def describe(self):
+        description = (
+            f"{self.job_name}: {JOB_STATE_TITLES[self.current_state()]}, файлов {self.processed_count}, "
+            f"ошибок {self.error_count}, {self.elapsed_seconds():.1f} с"
+        )
+        if self.summary:
+            description += f" - {self.summary}"
+        if self.error is not None:
+            description += f" - {str(self.error)}"
+        return description
+
+
+class JobScheduler:
+    # Задания выполняются по одному в фоновом потоке в порядке постановки:
+    # движок рассчитан на один прогон за раз (метрики, журнал перемещения).
+    # job_callback(job) вызывается из фонового потока при запуске и завершении задания
+    def __init__(self, job_callback=None):
+        self.job_callback = job_callback
+        self.pending_jobs = collections.deque()
+        self.current_job = None
+        self.condition = threading.Condition()
+        self.closed = False
+        self.worker_thread = threading.Thread(target=self.run_jobs, name="job-scheduler", daemon=True)
+        self.worker_thread.start()
+
+    def submit(self, job_name, run_function):
+        job = Job(job_name, run_function)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Планировщик заданий остановлен")
+            self.pending_jobs.append(job)
+            self.condition.notify()
+        return job
+
+    def run_jobs(self):
+        while True:
+            with self.condition:
+                while not self.pending_jobs and not self.closed:
+                    self.condition.wait()
+                if not self.pending_jobs:
+                    return
+                job = self.pending_jobs.popleft()
+                self.current_job = job
+            try:
+                self.run_job(job)
+            finally:
+                with self.condition:
+                    self.current_job = None
+                    self.condition.notify_all()
+
+    def run_job(self, job):
+        if job.should_stop():
+            # Отмененное в очереди задание не запускается
+            job.state = 'cancelled'
+            job.finished_event.set()
+            self.notify_job_changed(job)
+            return
+        job.state = 'running'
+        job.started_at = time.monotonic()
+        self.notify_job_changed(job)
+        try:
+            job.summary = job.run_function(job)
+            job.state = 'cancelled' if job.should_stop() else 'finished'
+        except Exception as error:
+            job.error = error
+            job.state = 'failed'
+        job.finished_at = time.monotonic()
+        job.finished_event.set()
+        self.notify_job_changed(job)
+
+    def notify_job_changed(self, job):
+        if self.job_callback is not None:
+            self.job_callback(job)
+
+    def get_current_job(self):
+        with self.condition:
+            return self.current_job
+
+    def get_pending_count(self):
+        with self.condition:
+            return len(self.pending_jobs)
+
+    def is_busy(self):
+        with self.condition:
+            return self.current_job is not None or bool(self.pending_jobs)
+
+    def cancel_all(self):
+        with self.condition:
+            jobs = list(self.pending_jobs)
+            if self.current_job is not None:
+                jobs.append(self.current_job)
+        for job in jobs:
+            job.cancel()
+
+    def wait_until_idle(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.current_job is None and not self.pending_jobs, timeout
+            )
+
+    def shutdown(self, wait=True):
+        self.cancel_all()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if wait:
+            self.worker_thread.join()
@@ -0,0 +1,371 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import collections
+
+from photo_index import DEFAULT_INDEX_DIRECTORY
+from extraction_pool import ExtractionPool
+from adaptive_concurrency import AdaptiveConcurrencyController
+from archive_reader import split_archive_path, stat_path, extract_archive_member, calculate_member_checksum
+
+DEFAULT_JOURNAL_PATH = os.path.join(DEFAULT_INDEX_DIRECTORY, "move_journal.jsonl")
+PARTIAL_SUFFIX = ".partial"
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# link_path - уже существующая копия того же файла: вместо переноса создается жесткая ссылка на нее
+MoveTask = collections.namedtuple('MoveTask', 'source_path target_path error link_path', defaults=(None,))
+MoveResult = collections.namedtuple('MoveResult', 'source_path target_path method error')
+
+
+def calculate_file_checksum(file_path):
+    file_hash = hashlib.blake2b()
+    with open(file_path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(CHECKSUM_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def copy_file_contents(source_path, target_path):
+    # Копирование внутри ядра: copy_file_range, затем sendfile, затем обычное чтение/запись
+    with open(source_path, 'rb') as source_file, open(target_path, 'wb') as target_file:
+        source_descriptor = source_file.fileno()
+        target_descriptor = target_file.fileno()
+        source_size = os.fstat(source_descriptor).st_size
+        for kernel_copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if kernel_copy is None:
+                continue
+            remaining_size = source_size
+            try:
+                while remaining_size > 0:
+                    chunk_size = min(remaining_size, COPY_CHUNK_SIZE)
+                    if kernel_copy is os.sendfile:
+                        copied_size = os.sendfile(target_descriptor, source_descriptor, None, chunk_size)
+                    else:
+                        copied_size = kernel_copy(source_descriptor, target_descriptor, chunk_size)
+                    if copied_size == 0:
+                        # Ядро вернуло 0 раньше конца файла - копия неполная
+                        break
+                    remaining_size -= copied_size
+                if remaining_size == 0:
+                    return
+            except OSError:
+                # Способ не поддерживается для этой пары файловых систем
+                pass
+            # Начинаем заново следующим способом
+            os.lseek(source_descriptor, 0, os.SEEK_SET)
+            os.lseek(target_descriptor, 0, os.SEEK_SET)
+            os.ftruncate(target_descriptor, 0)
+        shutil.copyfileobj(source_file, target_file, COPY_CHUNK_SIZE)
+        target_file.flush()
+        if os.fstat(target_descriptor).st_size != source_size:
+            raise OSError(f"Файл скопирован не полностью: {source_path}")
+
+
+class DirectoryCreationCache:
+    def __init__(self):
+        self.device_by_directory = {}
+        self.lock = threading.Lock()
+
+    def ensure_directory(self, directory_path):
+        device_id = self.device_by_directory.get(directory_path)
+        if device_id is None:
+            os.makedirs(directory_path, exist_ok=True)
+            device_id = os.stat(directory_path).st_dev
+            with self.lock:
+                self.device_by_directory[directory_path] = device_id
+        return device_id
+
+
+class UnfinishedJournalError(FileExistsError):
+    pass
+
+
+class MoveJournal:
+    def __init__(self, journal_path, journal_file):
+        self.journal_path = journal_path
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, source_directory, target_directory, journal_path=DEFAULT_JOURNAL_PATH):
+        # Журнал прерванного перемещения не перезаписывается: без него его уже не продолжить и не откатить
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        try:
+            journal_file = open(journal_path, 'x', encoding='utf-8')
+        except FileExistsError:
+            raise UnfinishedJournalError(
+                f"Есть незавершенное перемещение ({journal_path}): сначала продолжите или откатите его"
+            )
+        journal = cls(journal_path, journal_file)
+        journal.write_record({'op': 'start', 'source': source_directory, 'target': target_directory})
+        return journal
+
+    @classmethod
+    def reopen(cls, journal_path=DEFAULT_JOURNAL_PATH):
+        return cls(journal_path, open(journal_path, 'a', encoding='utf-8'))
+
+    @staticmethod
+    def exists(journal_path=DEFAULT_JOURNAL_PATH):
+        return os.path.isfile(journal_path)
+
+    @staticmethod
+    def load(journal_path=DEFAULT_JOURNAL_PATH):
+        # Возвращает заголовок, незавершенные и завершенные перемещения
+        header = None
+        planned_moves = {}
+        completed_moves = []
+        with open(journal_path, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Последняя строка могла остаться недописанной при сбое
+                    continue
+                operation = record.get('op')
+                if operation == 'start':
+                    header = record
+                elif operation == 'plan':
+                    planned_moves[record['source']] = MoveTask(
+                        record['source'], record['target'], None, record.get('link')
+                    )
+                elif operation in ('done', 'failed', 'undone'):
+                    planned_moves.pop(record['source'], None)
+                    if operation == 'done':
+                        completed_moves.append((record['source'], record['target']))
+                    elif operation == 'undone' and (record['source'], record['target']) in completed_moves:
+                        completed_moves.remove((record['source'], record['target']))
+        return header, list(planned_moves.values()), completed_moves
+
+    @staticmethod
+    def read_header(journal_path=DEFAULT_JOURNAL_PATH):
+        try:
+            with open(journal_path, encoding='utf-8') as journal_file:
+                record = json.loads(journal_file.readline())
+        except (OSError, ValueError):
+            return None
+        return record if isinstance(record, dict) and record.get('op') == 'start' else None
+
+    def write_record(self, record):
+        with self.lock:
+            self.journal_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.journal_file.flush()
+
+    def record_planned(self, source_path, target_path, link_path=None):
+        record = {'op': 'plan', 'source': source_path, 'target': target_path}
+        if link_path is not None:
+            record['link'] = link_path
+        self.write_record(record)
+
+    def record_plan(self, move_tasks):
+        # Весь план пишется до первого перемещения: после сбоя resume знает обо всех файлах
+        # прогона, а не только о тех, что были в работе. Задачи с ошибкой не планируются
+        plan_lines = []
+        for move_task in move_tasks:
+            if move_task.error is not None:
+                continue
+            record = {'op': 'plan', 'source': move_task.source_path, 'target': move_task.target_path}
+            if move_task.link_path is not None:
+                record['link'] = move_task.link_path
+            plan_lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+        with self.lock:
+            self.journal_file.writelines(plan_lines)
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+
+    def record_completed(self, source_path, target_path):
+        self.write_record({'op': 'done', 'source': source_path, 'target': target_path})
+
+    def record_failed(self, source_path, target_path):
+        self.write_record({'op': 'failed', 'source': source_path, 'target': target_path})
+
+    def record_undone(self, source_path, target_path):
+        self.write_record({'op': 'undone', 'source': source_path, 'target': target_path})
+
+    def close(self):
+        with self.lock:
+            self.journal_file.close()
+
+    def finish(self):
+        self.close()
+        os.remove(self.journal_path)
+
+    @staticmethod
+    def discard(journal_path=DEFAULT_JOURNAL_PATH):
+        if os.path.isfile(journal_path):
+            os.remove(journal_path)
+
+
+class MoveEngine:
+    def __init__(self, worker_count=4, verify_checksums=False, resume=False, adaptive_concurrency=False):
+        self.worker_count = worker_count
+        self.verify_checksums = verify_checksums
+        self.resume = resume
+        self.adaptive_concurrency = adaptive_concurrency
+        self.directory_cache = DirectoryCreationCache()
+
+    def move_files(self, move_tasks, journal=None, should_stop=None, wait_while_paused=None):
+        concurrency_controller = None
+        if self.adaptive_concurrency:
+            concurrency_controller = AdaptiveConcurrencyController(initial_limit=self.worker_count)
+        extraction_pool = ExtractionPool(self.worker_count, concurrency_controller=concurrency_controller)
+        pool_results = extraction_pool.map_ordered(
+            lambda move_task: self.move_single_file(move_task, journal),
+            move_tasks,
+            should_stop=should_stop,
+            wait_while_paused=wait_while_paused
+        )
+        for pool_result in pool_results:
+            move_task = pool_result.item
+            yield MoveResult(move_task.source_path, move_task.target_path, pool_result.value, pool_result.error)
+
+    def move_single_file(self, move_task, journal):
+        # План с этой задачей уже в журнале (MoveJournal.record_plan), здесь отмечается только итог
+        if move_task.error is not None:
+            raise move_task.error
+        source_path, target_path = move_task.source_path, move_task.target_path
+        try:
+            if move_task.link_path is not None:
+                move_method = self.link_file(source_path, target_path, move_task.link_path)
+            else:
+                move_method = self.transfer_file(source_path, target_path)
+        except Exception:
+            if journal is not None:
+                journal.record_failed(source_path, target_path)
+            raise
+        if journal is not None:
+            journal.record_completed(source_path, target_path)
+        return move_method
+
+    def transfer_file(self, source_path, target_path):
+        if split_archive_path(source_path) is not None:
+            return self.extract_file(source_path, target_path)
+        target_device = self.directory_cache.ensure_directory(os.path.dirname(target_path))
+        source_stat = os.stat(source_path)
+        if os.path.exists(target_path):
+            if self.resume and self.is_completed_copy(source_path, target_path):
+                # Файл был скопирован до сбоя, но исходник не успели удалить
+                os.remove(source_path)
+                return 'resumed'
+            raise FileExistsError(f"Файл уже существует: {target_path}")
+
+        if source_stat.st_dev == target_device:
+            os.rename(source_path, target_path)
+            return 'rename'
+
+        partial_path = target_path + PARTIAL_SUFFIX
+        try:
+            copy_file_contents(source_path, partial_path)
+            shutil.copystat(source_path, partial_path)
+            if self.verify_checksums and calculate_file_checksum(source_path) != calculate_file_checksum(partial_path):
+                raise OSError(f"Контрольная сумма копии не совпадает: {target_path}")
+            os.replace(partial_path, target_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        os.remove(source_path)
+        return 'copy'
+
+    def is_completed_copy(self, source_path, target_path):
+        # Цель прерванного перемещения засчитывается, только если она совпадает с исходником:
+        # по контрольной сумме, если она включена, иначе по размеру и времени изменения,
+        # которые переносят copystat и extract_archive_member
+        source_stat = stat_path(source_path)
+        target_stat = os.stat(target_path)
+        if target_stat.st_size != source_stat.st_size:
+            return False
+        if self.verify_checksums:
+            if split_archive_path(source_path) is not None:
+                source_checksum = calculate_member_checksum(source_path)
+            else:
+                source_checksum = calculate_file_checksum(source_path)
+            return source_checksum == calculate_file_checksum(target_path)
+        return target_stat.st_mtime_ns == source_stat.st_mtime_ns
+
+    def extract_file(self, source_path, target_path):
+        # Снимок из ZIP/TAR копируется в цель напрямую, архив остается без изменений
+        self.directory_cache.ensure_directory(os.path.dirname(target_path))
+        if os.path.exists(target_path):
+            if self.resume and self.is_completed_copy(source_path, target_path):
+                return 'resumed'
+            raise FileExistsError(f"Файл уже существует: {target_path}")
+        partial_path = target_path + PARTIAL_SUFFIX
+        try:
+            content_digest = extract_archive_member(source_path, partial_path)
+            if self.verify_checksums and calculate_file_checksum(partial_path) != content_digest:
+                raise OSError(f"Контрольная сумма копии не совпадает: {target_path}")
+            os.replace(partial_path, target_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        return 'extract'
+
+    def link_file(self, source_path, target_path, link_path):
+        # Дубликат не копируется: на его месте в цели появляется ссылка на оригинал,
+        # а откат журнала просто переименует ссылку обратно в исходный путь
+        self.directory_cache.ensure_directory(os.path.dirname(target_path))
+        if os.path.exists(target_path):
+            if self.resume and os.path.exists(link_path) and os.path.samefile(link_path, target_path):
+                # Ссылка создана до сбоя, но исходник не успели удалить
+                os.remove(source_path)
+                return 'resumed'
+            raise FileExistsError(f"Файл уже существует: {target_path}")
+        os.link(link_path, target_path)
+        os.remove(source_path)
+        return 'link'
+
+    def resume_journal(self, journal_path=DEFAULT_JOURNAL_PATH, should_stop=None, wait_while_paused=None):
+        # Доделываются все запланированные перемещения без отметки done/failed. Ссылки на
+        # дубликаты - вторым проходом, как и в исходном прогоне: их оригиналы должны быть на месте
+        _, pending_moves, _ = MoveJournal.load(journal_path)
+        for move_task in pending_moves:
+            if os.path.exists(move_task.target_path + PARTIAL_SUFFIX):
+                os.remove(move_task.target_path + PARTIAL_SUFFIX)
+        self.resume = True
+        # Исходника нет - файл успели перенести до сбоя, но не успели отметить
+        move_tasks = [
+            move_task for move_task in pending_moves
+            if os.path.exists(move_task.source_path) or split_archive_path(move_task.source_path) is not None
+        ]
+        journal = MoveJournal.reopen(journal_path)
+        try:
+            for link_pass in (False, True):
+                pass_move_tasks = [
+                    move_task for move_task in move_tasks if (move_task.link_path is not None) == link_pass
+                ]
+                if should_stop and should_stop():
+                    return
+                yield from self.move_files(pass_move_tasks, journal, should_stop, wait_while_paused)
+        finally:
+            journal.close()
+
+    def rollback_journal(self, journal_path=DEFAULT_JOURNAL_PATH, should_stop=None, wait_while_paused=None):
+        _, pending_moves, completed_moves = MoveJournal.load(journal_path)
+        for move_task in pending_moves:
+            if os.path.exists(move_task.target_path + PARTIAL_SUFFIX):
+                os.remove(move_task.target_path + PARTIAL_SUFFIX)
+        journal = MoveJournal.reopen(journal_path)
+        try:
+            for source_path, target_path in reversed(completed_moves):
+                if wait_while_paused:
+                    wait_while_paused()
+                if should_stop and should_stop():
+                    return
+                try:
+                    if split_archive_path(source_path) is not None:
+                        # В архив ничего не возвращается: извлеченная копия просто удаляется
+                        os.remove(target_path)
+                        move_method = 'remove'
+                    else:
+                        move_method = self.transfer_file(target_path, source_path)
+                except Exception as error:
+                    yield MoveResult(target_path, source_path, None, error)
+                    continue
+                journal.record_undone(source_path, target_path)
+                yield MoveResult(target_path, source_path, move_method, None)
+        finally:
+            journal.close()
@@ -0,0 +1,143 @@
+import os
+import re
+import json
+
+UNSAFE_DIRECTORY_CHARACTERS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+TEMPLATE_FIELDS = ('model', 'extension', 'year', 'month', 'day')
+UNKNOWN_DATE_FIELDS = {'year': 'unknown_date', 'month': '00', 'day': '00'}
+
+# Отличает "маршрут еще не вычислен" от вычисленного None (файл не перемещается)
+NOT_ROUTED = object()
+
+
+def sanitize_directory_name(name):
+    # Модель камеры становится именем папки: убираем недопустимые в Windows символы
+    sanitized_name = UNSAFE_DIRECTORY_CHARACTERS.sub('_', name).strip(' .')
+    return sanitized_name or '_'
+
+
+def normalize_rule_date(date_text):
+    # "2020-01-31" и "2020:01:31" сравниваются с датой EXIF как строки "ГГГГ:ММ:ДД"
+    return date_text.strip().replace('-', ':')[:10] if date_text else None
+
+
+class PartitionRule:
+    def __init__(self, target, model=None, model_regex=None, extensions=None, date_from=None, date_to=None):
+        if not isinstance(target, str):
+            raise ValueError(f"Шаблон папки должен быть строкой: {target!r}")
+        unknown_fields = set(re.findall(r'{(\w+)}', target)) - set(TEMPLATE_FIELDS)
+        if unknown_fields:
+            raise ValueError(f"Неизвестные поля в шаблоне папки: {', '.join(sorted(unknown_fields))}")
+        self.target = target
+        # Шаблон проверяется пробной подстановкой при загрузке, а не посреди перемещения
+        try:
+            self.format_target('model', '.jpg', '2000:01:01 00:00:00')
+        except (KeyError, IndexError, AttributeError, TypeError, ValueError) as error:
+            raise ValueError(f"Неверный шаблон папки {target!r}: {str(error)}") from error
+        self.model = model.lower() if model else None
+        try:
+            self.model_pattern = re.compile(model_regex, re.IGNORECASE) if model_regex else None
+        except (re.error, TypeError) as error:
+            raise ValueError(f"Неверное регулярное выражение {model_regex!r}: {str(error)}") from error
+        self.extensions = frozenset(
+            (extension if extension.startswith('.') else '.' + extension).lower() for extension in extensions
+        ) if extensions else None
+        self.date_from = normalize_rule_date(date_from)
+        self.date_to = normalize_rule_date(date_to)
+
+    @classmethod
+    def from_dict(cls, rule_data):
+        if 'target' not in rule_data:
+            raise ValueError(f"В правиле нет поля target: {rule_data}")
+        return cls(
+            rule_data['target'],
+            model=rule_data.get('model'),
+            model_regex=rule_data.get('model_regex'),
+            extensions=rule_data.get('extensions'),
+            date_from=rule_data.get('date_from'),
+            date_to=rule_data.get('date_to')
+        )
+
+    @property
+    def uses_date(self):
+        return bool(self.date_from or self.date_to or
+                    any(f'{{{field}}}' in self.target for field in UNKNOWN_DATE_FIELDS))
+
+    def matches_model_and_extension(self, camera_model, extension):
+        if self.extensions is not None and extension not in self.extensions:
+            return False
+        if self.model is not None and (not camera_model or self.model not in camera_model.lower()):
+            return False
+        if self.model_pattern is not None and (not camera_model or not self.model_pattern.search(camera_model)):
+            return False
+        return True
+
+    def matches_date(self, date_time):
+        if not self.date_from and not self.date_to:
+            return True
+        if not date_time:
+            return False
+        date_part = date_time[:10]
+        if self.date_from and date_part < self.date_from:
+            return False
+        if self.date_to and date_part > self.date_to:
+            return False
+        return True
+
+    def format_target(self, camera_model, extension, date_time):
+        date_fields = dict(UNKNOWN_DATE_FIELDS)
+        if date_time and len(date_time) >= 10:
+            date_fields = {'year': date_time[0:4], 'month': date_time[5:7], 'day': date_time[8:10]}
+        target_parts = self.target.format(
+            model=sanitize_directory_name(camera_model or 'unknown_camera'),
+            extension=extension.lstrip('.'),
+            **date_fields
+        ).replace('\\', '/').split('/')
+        target_parts = [sanitize_directory_name(part) for part in target_parts if part]
+        if not target_parts:
+            raise ValueError("пустой путь")
+        return os.path.join(*target_parts)
+
+
+class PartitionRuleSet:
+    # Правила проверяются по порядку, срабатывает первое подходящее. Без подходящего
+    # правила файл с известной моделью идет в <модель>/, без модели - остается на месте.
+    # Результат по (модель, расширение) запоминается, если правила не смотрят на дату
+    def __init__(self, rules=(), route_unmatched_by_model=True, unknown_model_target=None):
+        self.rules = list(rules)
+        self.route_unmatched_by_model = route_unmatched_by_model
+        self.unknown_model_target = unknown_model_target
+        self.needs_date = any(rule.uses_date for rule in self.rules)
+        self.route_cache = {}
+
+    @classmethod
+    def load(cls, rules_path):
+        with open(rules_path, encoding='utf-8') as rules_file:
+            rules_data = json.load(rules_file)
+        if isinstance(rules_data, list):
+            rules_data = {'rules': rules_data}
+        return cls(
+            [PartitionRule.from_dict(rule_data) for rule_data in rules_data.get('rules', [])],
+            route_unmatched_by_model=rules_data.get('route_unmatched_by_model', True),
+            unknown_model_target=rules_data.get('unknown_model_target')
+        )
+
+    def route(self, camera_model, extension, date_time=None):
+        extension = extension.lower()
+        if not self.needs_date:
+            cache_key = (camera_model, extension)
+            target_directory = self.route_cache.get(cache_key, NOT_ROUTED)
+            if target_directory is NOT_ROUTED:
+                target_directory = self.route_cache[cache_key] = self.evaluate(camera_model, extension, None)
+            return target_directory
+        return self.evaluate(camera_model, extension, date_time)
+
+    def evaluate(self, camera_model, extension, date_time):
+        for rule in self.rules:
+            if rule.matches_model_and_extension(camera_model, extension) and rule.matches_date(date_time):
+                return rule.format_target(camera_model, extension, date_time)
+        if camera_model and self.route_unmatched_by_model:
+            return sanitize_directory_name(camera_model)
+        if not camera_model and self.unknown_model_target:
+            return sanitize_directory_name(self.unknown_model_target)
+        return None
@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import pstats
+import datetime
+import threading
+import contextlib
+import collections
+
+from photo_index import DEFAULT_INDEX_DIRECTORY
+
+DEFAULT_METRICS_DIRECTORY = os.path.join(DEFAULT_INDEX_DIRECTORY, "metrics")
+METRICS_FORMAT_VERSION = 1
+PROFILE_MODES = ('cprofile', 'sampling')
+SAMPLING_INTERVAL_SECONDS = 0.005
+PROFILE_SUMMARY_LINES = 15
+
+RUN_TITLES = {
+    'analysis': "Анализ",
+    'incremental_analysis': "Анализ изменений",
+    'move': "Перемещение",
+    'resume': "Продолжение",
+    'rollback': "Откат",
+    'similar': "Поиск похожих"
+}
+
+# (имя метрики, поле StageStatistics, тип, описание)
+PROMETHEUS_STAGE_METRICS = (
+    ('sort_photos_stage_items_total', 'item_count', 'counter', "Файлов обработано этапом"),
+    ('sort_photos_stage_errors_total', 'error_count', 'counter', "Ошибок на этапе"),
+    ('sort_photos_stage_cached_total', 'cached_count', 'counter', "Результатов взято из кэша"),
+    ('sort_photos_stage_bytes_total', 'byte_count', 'counter', "Байт прочитано или перемещено"),
+    ('sort_photos_stage_busy_seconds_total', 'busy_seconds', 'counter', "Время работы этапа"),
+    ('sort_photos_stage_wall_seconds', 'wall_seconds', 'gauge', "Время от начала до конца этапа"),
+    ('sort_photos_stage_max_queue_depth', 'max_queue_depth', 'gauge', "Наибольшая длина очереди этапа")
+)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class StageStatistics:
+    # Счетчики одного этапа. busy_seconds - суммарное время внутри этапа
+    # (у параллельных этапов может превышать wall_seconds)
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.last_event_at = started_at
+        self.item_count = 0
+        self.error_count = 0
+        self.cached_count = 0
+        self.byte_count = 0
+        self.busy_seconds = 0.0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    @property
+    def wall_seconds(self):
+        return self.last_event_at - self.started_at
+
+    def items_per_second(self):
+        return self.item_count / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'items': self.item_count,
+            'errors': self.error_count,
+            'cached': self.cached_count,
+            'bytes': self.byte_count,
+            'busy_seconds': round(self.busy_seconds, 6),
+            'wall_seconds': round(self.wall_seconds, 6),
+            'items_per_second': round(self.items_per_second(), 1),
+            'max_queue_depth': self.max_queue_depth
+        }
+
+
+class PerformanceMetrics:
+    # Таймеры и счетчики одного прогона. Пишут в них рабочие потоки,
+    # читает GUI для строки прогресса; progress_stage - этап, по которому считается ETA
+    def __init__(self, run_name='idle', progress_stage=None, expected_total=None):
+        self.run_name = run_name
+        self.progress_stage = progress_stage
+        self.expected_total = expected_total
+        self.started_at = time.monotonic()
+        self.created = datetime.datetime.now().isoformat(timespec='seconds')
+        self.finished_at = None
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def get_stage(self, stage_name, current_time):
+        stage = self.stages.get(stage_name)
+        if stage is None:
+            stage = self.stages[stage_name] = StageStatistics(current_time)
+        return stage
+
+    def record(self, stage_name, error=False, cached=False, byte_count=0, busy_seconds=0.0, item_count=1):
+        current_time = time.monotonic()
+        with self.lock:
+            stage = self.get_stage(stage_name, current_time - busy_seconds)
+            stage.item_count += item_count
+            stage.error_count += bool(error)
+            stage.cached_count += bool(cached)
+            stage.byte_count += byte_count
+            stage.busy_seconds += busy_seconds
+            stage.last_event_at = current_time
+
+    def add_bytes(self, stage_name, byte_count):
+        self.record(stage_name, byte_count=byte_count, item_count=0)
+
+    def observe_queue_depth(self, stage_name, queue_depth):
+        with self.lock:
+            stage = self.get_stage(stage_name, time.monotonic())
+            stage.queue_depth = queue_depth
+            stage.max_queue_depth = max(stage.max_queue_depth, queue_depth)
+
+    def timed_iterator(self, stage_name, items):
+        # Время ожидания следующего элемента - это время этапа-производителя (например, обхода папок)
+        iterator = iter(items)
+        while True:
+            started_at = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage_name, busy_seconds=time.perf_counter() - started_at)
+            yield item
+
+    @contextlib.contextmanager
+    def measure(self, stage_name, item_count=1):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage_name, busy_seconds=time.perf_counter() - started_at, item_count=item_count)
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+    @property
+    def elapsed_seconds(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def progress(self):
+        # (обработано, файлов в секунду, оставшиеся секунды или None)
+        with self.lock:
+            stage = self.stages.get(self.progress_stage)
+            processed_count = stage.item_count if stage is not None else 0
+        elapsed_seconds = self.elapsed_seconds
+        items_per_second = processed_count / elapsed_seconds if elapsed_seconds > 0 else 0.0
+        remaining_seconds = None
+        if self.expected_total and items_per_second > 0:
+            remaining_seconds = max(self.expected_total - processed_count, 0) / items_per_second
+        return processed_count, items_per_second, remaining_seconds
+
+    def describe_progress(self):
+        processed_count, items_per_second, remaining_seconds = self.progress()
+        description = (
+            f"{RUN_TITLES.get(self.run_name, self.run_name)}: {processed_count}"
+            + (f" из ~{self.expected_total}" if self.expected_total else "")
+            + f" файлов, {items_per_second:.1f} файл/с, прошло {format_duration(self.elapsed_seconds)}"
+        )
+        if remaining_seconds is not None and self.finished_at is None:
+            description += f", осталось ~{format_duration(remaining_seconds)}"
+        return description
+
+    def describe_summary(self):
+        lines = [f"Статистика этапов ({RUN_TITLES.get(self.run_name, self.run_name)}, "
+                 f"{format_duration(self.elapsed_seconds)}):"]
+        with self.lock:
+            for stage_name, stage in self.stages.items():
+                line = (
+                    f"  {stage_name}: {stage.item_count} шт. за {stage.wall_seconds:.2f} с "
+                    f"({stage.items_per_second():.1f}/с)"
+                )
+                if stage.busy_seconds:
+                    line += f", в работе {stage.busy_seconds:.2f} с"
+                if stage.byte_count >= 1024 * 1024:
+                    line += f", {stage.byte_count / (1024 * 1024):.1f} МБ"
+                elif stage.byte_count:
+                    line += f", {stage.byte_count / 1024:.1f} КБ"
+                if stage.cached_count:
+                    line += f", из кэша {stage.cached_count}"
+                if stage.error_count:
+                    line += f", ошибок {stage.error_count}"
+                if stage.max_queue_depth:
+                    line += f", очередь до {stage.max_queue_depth}"
+                lines.append(line)
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        with self.lock:
+            stages = {stage_name: stage.to_dict() for stage_name, stage in self.stages.items()}
+        return {
+            'version': METRICS_FORMAT_VERSION,
+            'run': self.run_name,
+            'created': self.created,
+            'elapsed_seconds': round(self.elapsed_seconds, 6),
+            'expected_total': self.expected_total,
+            'stages': stages
+        }
+
+    def write_json(self, metrics_path):
+        temporary_path = metrics_path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as metrics_file:
+            json.dump(self.to_dict(), metrics_file, ensure_ascii=False, indent=2)
+        os.replace(temporary_path, metrics_path)
+
+    def write_prometheus(self, metrics_path):
+        # Формат textfile-коллектора node_exporter; файл заменяется атомарно
+        lines = [
+            "# HELP sort_photos_run_duration_seconds Длительность прогона",
+            "# TYPE sort_photos_run_duration_seconds gauge",
+            f'sort_photos_run_duration_seconds{{run="{self.run_name}"}} {self.elapsed_seconds:.6f}',
+            "# HELP sort_photos_run_timestamp_seconds Время окончания прогона",
+            "# TYPE sort_photos_run_timestamp_seconds gauge",
+            f'sort_photos_run_timestamp_seconds{{run="{self.run_name}"}} {time.time():.0f}'
+        ]
+        with self.lock:
+            for metric_name, field_name, metric_type, description in PROMETHEUS_STAGE_METRICS:
+                lines.append(f"# HELP {metric_name} {description}")
+                lines.append(f"# TYPE {metric_name} {metric_type}")
+                for stage_name, stage in self.stages.items():
+                    lines.append(
+                        f'{metric_name}{{run="{self.run_name}",stage="{stage_name}"}} {getattr(stage, field_name)}'
+                    )
+        temporary_path = metrics_path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(temporary_path, metrics_path)
+
+    def save(self, metrics_directory=DEFAULT_METRICS_DIRECTORY):
+        # Файлы последнего прогона каждого вида: <прогон>.json и <прогон>.prom
+        os.makedirs(metrics_directory, exist_ok=True)
+        json_path = os.path.join(metrics_directory, f"{self.run_name}.json")
+        prometheus_path = os.path.join(metrics_directory, f"{self.run_name}.prom")
+        self.write_json(json_path)
+        self.write_prometheus(prometheus_path)
+        return json_path, prometheus_path
+
+
+class CProfileProfiler:
+    # cProfile видит только поток, в котором запущен прогон (обход и разбор результатов)
+    file_extension = "prof"
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, output_path):
+        self.profile.disable()
+        self.profile.dump_stats(output_path)
+        statistics = pstats.Stats(self.profile).sort_stats('cumulative')
+        return [
+            f"{function_name[2]} ({os.path.basename(function_name[0])}:{function_name[1]}): "
+            f"{cumulative_seconds:.3f} с, вызовов {call_count}"
+            for function_name, (_, call_count, _, cumulative_seconds, _) in sorted(
+                statistics.stats.items(), key=lambda item: item[1][3], reverse=True
+            )[:PROFILE_SUMMARY_LINES]
+        ]
+
+
+class SamplingProfiler:
+    # Раз в несколько миллисекунд снимает стеки всех потоков, включая рабочие;
+    # результат - свернутые стеки для flamegraph.pl или speedscope
+    file_extension = "folded"
+
+    def __init__(self, interval_seconds=SAMPLING_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.stack_counts = collections.Counter()
+        self.stop_event = threading.Event()
+        self.sampling_thread = None
+
+    def start(self):
+        self.sampling_thread = threading.Thread(target=self.collect_samples, daemon=True)
+        self.sampling_thread.start()
+
+    def collect_samples(self):
+        own_thread_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval_seconds):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                    frame = frame.f_back
+                self.stack_counts[';'.join(reversed(stack))] += 1
+
+    def stop(self, output_path):
+        self.stop_event.set()
+        self.sampling_thread.join()
+        with open(output_path, 'w', encoding='utf-8') as profile_file:
+            for stack, sample_count in self.stack_counts.most_common():
+                profile_file.write(f"{stack} {sample_count}\n")
+        # Сводка по верхним кадрам: где потоки проводили время (включая ожидание)
+        leaf_counts = collections.Counter()
+        for stack, sample_count in self.stack_counts.items():
+            leaf_counts[stack.rsplit(';', 1)[-1]] += sample_count
+        total_samples = sum(leaf_counts.values()) or 1
+        return [
+            f"{leaf_frame}: {sample_count * 100 / total_samples:.1f}%"
+            for leaf_frame, sample_count in leaf_counts.most_common(PROFILE_SUMMARY_LINES)
+        ]
+
+
+def create_profiler(profile_mode):
+    if profile_mode == 'cprofile':
+        return CProfileProfiler()
+    if profile_mode == 'sampling':
+        return SamplingProfiler()
+    return None
@@ -0,0 +1,687 @@
+import sys
+import os
+import json
+import math
+import time
+import shutil
+import random
+import struct
+import tarfile
+import zipfile
+import argparse
+import platform
+import tempfile
+import datetime
+import threading
+
+from exif_reader import (
+    EXIF_TAG_MAKE, EXIF_TAG_MODEL, EXIF_TAG_EXIF_IFD_POINTER, EXIF_TAG_DATE_TIME_ORIGINAL, EXIF_TAG_CREATE_DATE,
+    read_exif_tags_from_file, extract_camera_model, get_header_bytes_read
+)
+from photo_index import PhotoMetadataIndex
+from photo_engine import PhotoEngine, iterate_image_files
+from date_sorter import DateSorter
+from exiftool_driver import ExifToolBatchSorter
+from result_store import AnalysisResultStore
+from tree_walker import TreeWalker
+from extraction_pool import ExtractionPool, extract_walked_file_metadata
+from adaptive_concurrency import AdaptiveConcurrencyController
+from disk_order import DiskOrderScheduler
+
+BENCHMARK_FORMAT_VERSION = 1
+
+DEFAULT_CAMERA_MIX = "SONY:ILCE-7M3:5,Canon:Canon EOS R5:3,NIKON CORPORATION:NIKON Z 6:2"
+# Расширение и признак TIFF-структуры (RAW-заменители - это TIFF с другим расширением)
+CORPUS_FORMATS = (('.jpg', False), ('.jpg', False), ('.jpg', False), ('.tiff', True),
+                  ('.nef', True), ('.arw', True), ('.cr2', True))
+DEFAULT_FILE_COUNT = 2000
+DEFAULT_DEPTH = 3
+DEFAULT_DIRECTORY_FANOUT = 4
+DEFAULT_PAYLOAD_SIZE = 256 * 1024
+DEFAULT_NO_EXIF_RATIO = 0.05
+DEFAULT_RESULT_STORE_ROWS = 1000000
+DEFAULT_SHARE_SERVICE_MS = 2.0
+DEFAULT_SHARE_CAPACITY = 8
+# Имитация HDD 7200 об/мин: перемещение головки через весь диск и полный оборот
+DEFAULT_FULL_SEEK_MS = 15.0
+DEFAULT_ROTATION_MS = 8.3
+HEAD_SETTLE_MS = 0.5
+
+TIFF_TYPE_ASCII = 2
+TIFF_TYPE_LONG = 4
+
+
+def parse_camera_mix(camera_mix):
+    # "Make:Model:вес,..." -> [((make, model), вес), ...]
+    cameras = []
+    for camera_spec in camera_mix.split(','):
+        make, model, weight = camera_spec.rsplit(':', 2)
+        cameras.append(((make.strip(), model.strip()), float(weight)))
+    return cameras
+
+
+def build_ifd(byte_order, entries, ifd_offset, next_ifd_offset=0):
+    # entries: [(tag_id, field_type, value_count, value_bytes)]; значения длиннее 4 байт
+    # размещаются сразу за каталогом, возвращается каталог вместе с этими данными
+    entries = sorted(entries)
+    data_offset = ifd_offset + 2 + len(entries) * 12 + 4
+    directory_bytes = struct.pack(byte_order + 'H', len(entries))
+    data_bytes = b''
+    for tag_id, field_type, value_count, value_bytes in entries:
+        if len(value_bytes) <= 4:
+            inline_value = value_bytes.ljust(4, b'\x00')
+        else:
+            inline_value = struct.pack(byte_order + 'I', data_offset + len(data_bytes))
+            data_bytes += value_bytes + (b'\x00' if len(value_bytes) % 2 else b'')
+        directory_bytes += struct.pack(byte_order + 'HHI', tag_id, field_type, value_count) + inline_value
+    directory_bytes += struct.pack(byte_order + 'I', next_ifd_offset)
+    return directory_bytes + data_bytes
+
+
+def ascii_entry(tag_id, text):
+    value_bytes = text.encode('ascii') + b'\x00'
+    return tag_id, TIFF_TYPE_ASCII, len(value_bytes), value_bytes
+
+
+def build_tiff_header(make, model, date_time, byte_order='<'):
+    exif_entries = [ascii_entry(EXIF_TAG_DATE_TIME_ORIGINAL, date_time), ascii_entry(EXIF_TAG_CREATE_DATE, date_time)]
+    ifd0_entries = [ascii_entry(EXIF_TAG_MAKE, make), ascii_entry(EXIF_TAG_MODEL, model)]
+    # Размер IFD0 нужен заранее, чтобы записать указатель на Exif IFD
+    ifd0_size = len(build_ifd(byte_order, ifd0_entries + [(EXIF_TAG_EXIF_IFD_POINTER, TIFF_TYPE_LONG, 1, b'\x00' * 4)], 8))
+    exif_ifd_offset = 8 + ifd0_size
+    ifd0_entries.append(
+        (EXIF_TAG_EXIF_IFD_POINTER, TIFF_TYPE_LONG, 1, struct.pack(byte_order + 'I', exif_ifd_offset))
+    )
+    byte_order_mark = b'II' if byte_order == '<' else b'MM'
+    return (byte_order_mark + struct.pack(byte_order + 'HI', 42, 8)
+            + build_ifd(byte_order, ifd0_entries, 8) + build_ifd(byte_order, exif_entries, exif_ifd_offset))
+
+
+def build_jpeg_file(tiff_header, payload):
+    # Только структура, нужная парсеру заголовков: SOI, APP1 с EXIF, SOS и "сжатые данные"
+    segments = b'\xff\xd8'
+    if tiff_header is not None:
+        app1_data = b'Exif\x00\x00' + tiff_header
+        segments += b'\xff\xe1' + struct.pack('>H', len(app1_data) + 2) + app1_data
+    return segments + b'\xff\xda\x00\x02' + payload + b'\xff\xd9'
+
+
+def build_tiff_file(tiff_header, payload):
+    if tiff_header is None:
+        tiff_header = b'II' + struct.pack('<HI', 42, 8) + struct.pack('<HI', 0, 0)
+    return tiff_header + payload
+
+
+def generate_corpus(corpus_directory, file_count=DEFAULT_FILE_COUNT, depth=DEFAULT_DEPTH,
+                    fanout=DEFAULT_DIRECTORY_FANOUT, camera_mix=DEFAULT_CAMERA_MIX,
+                    payload_size=DEFAULT_PAYLOAD_SIZE, no_exif_ratio=DEFAULT_NO_EXIF_RATIO, seed=0):
+    # Одинаковые параметры и seed дают побайтно одинаковое дерево
+    generator = random.Random(seed)
+    cameras = parse_camera_mix(camera_mix)
+    camera_choices = [camera for camera, _ in cameras]
+    camera_weights = [weight for _, weight in cameras]
+    payload = generator.randbytes(payload_size)
+    first_date = datetime.datetime(2015, 1, 1)
+    expected_models = {}
+    total_bytes = 0
+
+    for file_number in range(file_count):
+        directory_parts = [f"dir_{generator.randrange(fanout):02d}" for _ in range(generator.randint(0, depth))]
+        extension, is_tiff = generator.choice(CORPUS_FORMATS)
+        relative_path = os.path.join(*directory_parts, f"IMG_{file_number:07d}{extension}")
+
+        if generator.random() < no_exif_ratio:
+            make, model, tiff_header = None, None, None
+        else:
+            make, model = generator.choices(camera_choices, camera_weights)[0]
+            photo_date = first_date + datetime.timedelta(seconds=generator.randrange(10 * 365 * 24 * 3600))
+            byte_order = generator.choice('<>')
+            tiff_header = build_tiff_header(make, model, photo_date.strftime("%Y:%m:%d %H:%M:%S"), byte_order)
+
+        file_bytes = build_tiff_file(tiff_header, payload) if is_tiff else build_jpeg_file(tiff_header, payload)
+        full_file_path = os.path.join(corpus_directory, relative_path)
+        os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
+        with open(full_file_path, 'wb') as output_file:
+            output_file.write(file_bytes)
+        expected_models[relative_path] = model
+        total_bytes += len(file_bytes)
+
+    return {
+        'file_count': file_count,
+        'depth': depth,
+        'fanout': fanout,
+        'camera_mix': camera_mix,
+        'payload_size': payload_size,
+        'no_exif_ratio': no_exif_ratio,
+        'seed': seed,
+        'total_bytes': total_bytes,
+        'expected_models': expected_models
+    }
+
+
+def stage_result(file_count, elapsed_seconds, bytes_read=None, error_count=0):
+    result = {
+        'files': file_count,
+        'seconds': round(elapsed_seconds, 6),
+        'files_per_second': round(file_count / elapsed_seconds, 1) if elapsed_seconds > 0 else None,
+        'errors': error_count
+    }
+    if bytes_read is not None:
+        result['bytes_read'] = bytes_read
+        result['bytes_per_file'] = round(bytes_read / file_count, 1) if file_count else 0
+    return result
+
+
+def benchmark_walk(corpus_directory):
+    started_at = time.perf_counter()
+    file_count = sum(1 for _ in iterate_image_files(corpus_directory))
+    return stage_result(file_count, time.perf_counter() - started_at)
+
+
+def benchmark_header_reads(corpus_directory):
+    image_paths = list(iterate_image_files(corpus_directory))
+    wanted_tags = frozenset((EXIF_TAG_MODEL,))
+    bytes_read = 0
+    error_count = 0
+    started_at = time.perf_counter()
+    for image_path in image_paths:
+        try:
+            with open(image_path, 'rb') as image_file:
+                bytes_read += read_exif_tags_from_file(image_file, wanted_tags)[1]
+        except Exception:
+            error_count += 1
+    return stage_result(len(image_paths), time.perf_counter() - started_at, bytes_read, error_count)
+
+
+def benchmark_extract_camera_model(corpus_directory, expected_models):
+    image_paths = list(iterate_image_files(corpus_directory))
+    mismatch_count = 0
+    started_at = time.perf_counter()
+    for image_path in image_paths:
+        camera_model = extract_camera_model(image_path)
+        if camera_model != expected_models.get(os.path.relpath(image_path, corpus_directory)):
+            mismatch_count += 1
+    return stage_result(len(image_paths), time.perf_counter() - started_at, error_count=mismatch_count)
+
+
+def benchmark_result_store(row_count, camera_mix, depth, fanout, seed):
+    # Хранилище результатов без диска: синтетические пути в дереве как у корпуса
+    random_generator = random.Random(seed)
+    cameras = parse_camera_mix(camera_mix)
+    camera_models = [model for (_, model), _ in cameras] + [None]
+    camera_weights = [weight for _, weight in cameras] + [sum(weight for _, weight in cameras) * DEFAULT_NO_EXIF_RATIO]
+    directory_paths = [""]
+    level_paths = [""]
+    for _ in range(depth):
+        level_paths = [
+            os.path.join(directory_path, f"dir_{index:02d}") for directory_path in level_paths for index in range(fanout)
+        ]
+        directory_paths.extend(level_paths)
+    row_models = random_generator.choices(camera_models, camera_weights, k=row_count)
+    result_store = AnalysisResultStore()
+    started_at = time.perf_counter()
+    for row, camera_model in enumerate(row_models):
+        result_store.add(
+            os.path.join(directory_paths[row % len(directory_paths)], f"IMG_{row:07d}.jpg"),
+            camera_model, camera_model == camera_models[0]
+        )
+    result = stage_result(row_count, time.perf_counter() - started_at)
+    result['store_bytes'] = result_store.memory_usage()
+    result['store_bytes_per_file'] = round(result['store_bytes'] / row_count, 1) if row_count else 0
+    filter_seconds = {}
+    for filter_name, filter_arguments in (('model', {'camera_model': camera_models[0]}),
+                                          ('path', {'text': "IMG_00001"}),
+                                          ('matched', {'matched_only': True})):
+        filter_started_at = time.perf_counter()
+        result_store.filter_rows(**filter_arguments)
+        filter_seconds[filter_name] = round(time.perf_counter() - filter_started_at, 6)
+    result['filter_seconds'] = filter_seconds
+    return result
+
+
+class SimulatedNetworkShare:
+    # Локальная замена сетевого диска для проверки подбора параллелизма: каждая операция
+    # ждет round_trip_seconds (сеть, сервер не занят) и service_seconds в одном из capacity
+    # слотов сервера. Наибольшая скорость - capacity / service_seconds, она достигается
+    # примерно при capacity * (round_trip_seconds + service_seconds) / service_seconds операций
+    def __init__(self, round_trip_seconds, service_seconds=DEFAULT_SHARE_SERVICE_MS / 1000,
+                 capacity=DEFAULT_SHARE_CAPACITY):
+        self.round_trip_seconds = round_trip_seconds
+        self.service_seconds = service_seconds
+        self.server_slots = threading.Semaphore(capacity)
+
+    def wrap(self, worker_function):
+        def call_through_share(item):
+            time.sleep(self.round_trip_seconds)
+            with self.server_slots:
+                time.sleep(self.service_seconds)
+            return worker_function(item)
+        return call_through_share
+
+
+def benchmark_network_share(corpus_directory, worker_count, round_trip_ms, service_ms, capacity):
+    # Чтение метаданных через имитацию сетевого диска: постоянное число потоков и подбор по задержкам
+    walked_files = list(TreeWalker().walk(corpus_directory))
+    simulated_share = SimulatedNetworkShare(round_trip_ms / 1000, service_ms / 1000, capacity)
+    results = {}
+    for stage_name, concurrency_controller in (
+            ('network_share_fixed', None),
+            ('network_share_adaptive', AdaptiveConcurrencyController(initial_limit=worker_count))):
+        extraction_pool = ExtractionPool(worker_count, concurrency_controller=concurrency_controller)
+        error_count = 0
+        started_at = time.perf_counter()
+        for pool_result in extraction_pool.map_ordered(simulated_share.wrap(extract_walked_file_metadata),
+                                                        walked_files):
+            if pool_result.error is not None:
+                error_count += 1
+        result = stage_result(len(walked_files), time.perf_counter() - started_at, error_count=error_count)
+        result['concurrency'] = concurrency_controller.current_limit() if concurrency_controller else worker_count
+        results[stage_name] = result
+    # Верхняя граница скорости для этих параметров имитации
+    results['network_share_adaptive']['best_files_per_second'] = round(capacity / (service_ms / 1000), 1)
+    return results
+
+
+class SimulatedRotatingDisk:
+    # Диск с одной головкой поверх локальных файлов: место файла - его номер в порядке
+    # расположения на настоящем носителе (FIEMAP или inode). Следующий по месту файл читается
+    # без позиционирования, иначе - успокоение головки, перемещение пропорционально корню из
+    # пройденной доли диска и в среднем пол-оборота. Запросы обслуживаются по одному; из
+    # ожидающих выбирается ближайший впереди головки (C-SCAN), как делает очередь NCQ диска
+    def __init__(self, walked_files, full_seek_seconds=DEFAULT_FULL_SEEK_MS / 1000,
+                 rotation_seconds=DEFAULT_ROTATION_MS / 1000):
+        read_order = DiskOrderScheduler(None).plan_read_order(walked_files, range(len(walked_files)))
+        self.file_ranks = {walked_files[position].path: rank for rank, position in enumerate(read_order)}
+        self.full_seek_seconds = full_seek_seconds
+        self.rotation_seconds = rotation_seconds
+        self.head_rank = -1
+        self.pending_ranks = set()
+        self.serving_rank = None
+        self.head_condition = threading.Condition()
+        self.positioning_count = 0
+
+    def positioning_seconds(self, distance):
+        return (HEAD_SETTLE_MS / 1000 + self.full_seek_seconds * math.sqrt(distance / len(self.file_ranks))
+                + self.rotation_seconds / 2)
+
+    def choose_next_request(self):
+        if self.serving_rank is None and self.pending_ranks:
+            self.serving_rank = min(
+                self.pending_ranks, key=lambda rank: (rank - self.head_rank - 1) % len(self.file_ranks)
+            )
+            self.head_condition.notify_all()
+
+    def wrap(self, worker_function):
+        def call_through_disk(walked_file):
+            file_rank = self.file_ranks[walked_file.path]
+            with self.head_condition:
+                self.pending_ranks.add(file_rank)
+                self.choose_next_request()
+                while self.serving_rank != file_rank:
+                    self.head_condition.wait()
+                self.pending_ranks.discard(file_rank)
+                distance = abs(file_rank - self.head_rank)
+            try:
+                if distance != 1:
+                    self.positioning_count += 1
+                    time.sleep(self.positioning_seconds(distance))
+                return worker_function(walked_file)
+            finally:
+                with self.head_condition:
+                    self.head_rank = file_rank
+                    self.serving_rank = None
+                    self.choose_next_request()
+        return call_through_disk
+
+
+def evict_page_cache(walked_files):
+    # Без прав root весь кэш не сбросить, но чистые страницы своих файлов можно выгрузить -
+    # иначе второй прогон читал бы из памяти, а не с диска
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    for walked_file in walked_files:
+        try:
+            file_descriptor = os.open(walked_file.path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(file_descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(file_descriptor)
+    return True
+
+
+def benchmark_disk_order(corpus_directory, worker_count, full_seek_ms):
+    # Чтение метаданных в порядке имен и в порядке диска. Корпус записывается по номерам
+    # файлов вразброс по папкам, поэтому порядок обхода не совпадает с порядком записи.
+    # На SSD и tmpfs разницы почти нет - настоящий замер нужен на HDD или кардридере
+    # (--work-directory на нем), имитация вращающегося диска включается --simulated-seek-ms
+    walked_files = list(TreeWalker().walk(corpus_directory))
+    # Выгрузка заодно записывает только что созданный корпус: до этого блоки еще не выделены
+    # (отложенное выделение), и FIEMAP не знает их места. Запись в порядке создания (inode) -
+    # иначе файловая система разместила бы данные в порядке обхода, как будто их так и писали
+    evict_page_cache(sorted(walked_files, key=lambda walked_file: walked_file.inode))
+    logical_paths = [walked_file.path for walked_file in walked_files]
+    devices = [('', None)]
+    if full_seek_ms:
+        devices.append(('simulated_', lambda: SimulatedRotatingDisk(walked_files, full_seek_ms / 1000)))
+    results = {}
+    for device_prefix, create_simulated_disk in devices:
+        for order_name in ('name_order', 'disk_order'):
+            simulated_disk = create_simulated_disk() if create_simulated_disk else None
+            worker_function = simulated_disk.wrap(extract_walked_file_metadata) if simulated_disk else \
+                extract_walked_file_metadata
+            cache_evicted = evict_page_cache(walked_files)
+            extraction_pool = ExtractionPool(worker_count)
+            disk_order_scheduler = DiskOrderScheduler(extraction_pool) if order_name == 'disk_order' else None
+            result_paths = []
+            error_count = 0
+            started_at = time.perf_counter()
+            for pool_result in (disk_order_scheduler or extraction_pool).map_ordered(worker_function, walked_files):
+                result_paths.append(pool_result.item.path)
+                if pool_result.error is not None:
+                    error_count += 1
+            result = stage_result(len(walked_files), time.perf_counter() - started_at, error_count=error_count)
+            result['cache_evicted'] = cache_evicted
+            # Порядок результатов должен остаться логическим в обоих режимах
+            result['logical_order'] = result_paths == logical_paths
+            if simulated_disk is not None:
+                result['positionings'] = simulated_disk.positioning_count
+            if disk_order_scheduler is not None:
+                result['fiemap_files'] = disk_order_scheduler.physical_count
+            results[f"{device_prefix}{order_name}"] = result
+    return results
+
+
+def pack_corpus_archive(corpus_directory, archive_path):
+    # Снимки без сжатия, как их обычно пакуют с карт: ZIP_STORED и обычный TAR
+    if archive_path.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zip_file:
+            for walked_file in TreeWalker().walk(corpus_directory):
+                zip_file.write(walked_file.path, os.path.relpath(walked_file.path, corpus_directory))
+    else:
+        with tarfile.open(archive_path, 'w') as tar_file:
+            tar_file.add(corpus_directory, arcname='.')
+
+
+def benchmark_archives(corpus_directory, work_directory, worker_count, expected_models):
+    # Анализ снимков внутри архивов без распаковки: сколько байт архива прочитано ради метаданных.
+    # Каталог ZIP (центральный каталог) и цепочка заголовков TAR в bytes_read не входят
+    archive_directory = os.path.join(work_directory, "archives")
+    os.makedirs(archive_directory, exist_ok=True)
+    results = {}
+    for archive_name in ('corpus.zip', 'corpus.tar'):
+        archive_path = os.path.join(archive_directory, archive_name)
+        pack_corpus_archive(corpus_directory, archive_path)
+        header_bytes_before = get_header_bytes_read()
+        mismatch_count = 0
+        started_at = time.perf_counter()
+        walked_files = TreeWalker(scan_archives=True).walk(archive_path)
+        pool_results = list(ExtractionPool(worker_count).map_ordered(extract_walked_file_metadata, walked_files))
+        elapsed_seconds = time.perf_counter() - started_at
+        for pool_result in pool_results:
+            relative_path = os.path.relpath(pool_result.item.path, archive_path)
+            camera_model = pool_result.value[0].camera_model if pool_result.error is None else None
+            if pool_result.error is not None or camera_model != expected_models.get(relative_path):
+                mismatch_count += 1
+        bytes_read = get_header_bytes_read() - header_bytes_before
+        result = stage_result(len(pool_results), elapsed_seconds, bytes_read, mismatch_count)
+        result['archive_bytes'] = os.path.getsize(archive_path)
+        result['read_fraction'] = round(bytes_read / result['archive_bytes'], 6) if result['archive_bytes'] else 0
+        results[f"archive_{archive_name.split('.')[-1]}"] = result
+        os.remove(archive_path)
+    return results
+
+
+def create_benchmark_engine(work_directory, worker_count, index_name="index.sqlite3"):
+    return PhotoEngine(
+        PhotoMetadataIndex(os.path.join(work_directory, index_name)),
+        worker_count=worker_count,
+        save_manifest=False,
+        journal_path=os.path.join(work_directory, "move_journal.jsonl")
+    )
+
+
+def benchmark_analysis(corpus_directory, work_directory, worker_count, camera_name):
+    # Холодный прогон с пустым индексом и повторный, отвечающий из индекса
+    photo_engine = create_benchmark_engine(work_directory, worker_count)
+    results = {}
+    try:
+        for stage_name in ('analysis_cold', 'analysis_warm'):
+            file_count = 0
+            error_count = 0
+            started_at = time.perf_counter()
+            for analysis_result in photo_engine.analyze(corpus_directory, camera_name):
+                file_count += 1
+                if analysis_result.error is not None:
+                    error_count += 1
+            results[stage_name] = stage_result(file_count, time.perf_counter() - started_at, error_count=error_count)
+    finally:
+        photo_engine.close()
+    return results
+
+
+def benchmark_move(corpus_directory, target_directory, work_directory, worker_count, camera_name):
+    photo_engine = create_benchmark_engine(work_directory, worker_count, "move_index.sqlite3")
+    file_count = 0
+    error_count = 0
+    bytes_moved = 0
+    started_at = time.perf_counter()
+    try:
+        for move_result in photo_engine.move(corpus_directory, target_directory, camera_name):
+            file_count += 1
+            if move_result.error is not None:
+                error_count += 1
+            else:
+                bytes_moved += os.path.getsize(move_result.target_path)
+    finally:
+        photo_engine.close()
+    result = stage_result(file_count, time.perf_counter() - started_at, error_count=error_count)
+    result['bytes_moved'] = bytes_moved
+    return result
+
+
+def count_sort_results(sort_results, started_at):
+    status_counts = {}
+    for file_result in sort_results:
+        status_counts[file_result.status] = status_counts.get(file_result.status, 0) + 1
+    result = stage_result(
+        sum(status_counts.values()), time.perf_counter() - started_at,
+        error_count=status_counts.get('error', 0) + status_counts.get('pending', 0)
+    )
+    result['moved'] = status_counts.get('moved', 0)
+    return result
+
+
+def benchmark_date_sort_builtin(source_directory, target_directory, work_directory, worker_count):
+    date_sorter = DateSorter(
+        target_directory, worker_count=worker_count,
+        journal_path=os.path.join(work_directory, "date_sort_journal.jsonl")
+    )
+    started_at = time.perf_counter()
+    return count_sort_results(date_sorter.sort(source_directory), started_at)
+
+
+def benchmark_date_sort_exiftool(source_directory, target_directory, work_directory, exiftool_path, process_count):
+    # Состояние пакетов в рабочей папке: прерванный прогон бенчмарка не продолжается, а сбрасывается
+    state_path = os.path.join(work_directory, "exiftool_sort_state.jsonl")
+    if os.path.isfile(state_path):
+        os.remove(state_path)
+    batch_sorter = ExifToolBatchSorter(exiftool_path, target_directory, process_count=process_count, state_path=state_path)
+    started_at = time.perf_counter()
+    chunks, _ = batch_sorter.prepare_chunks(source_directory, resume=False)
+    return count_sort_results(batch_sorter.sort(chunks), started_at)
+
+
+def run_benchmark(arguments):
+    work_directory = arguments.work_directory or tempfile.mkdtemp(prefix="sort_photos_benchmark_")
+    corpus_directory = os.path.join(work_directory, "corpus")
+    move_source_directory = os.path.join(work_directory, "move_source")
+    move_target_directory = arguments.move_target or os.path.join(work_directory, "move_target")
+    corpus_parameters = {
+        'file_count': arguments.files,
+        'depth': arguments.depth,
+        'fanout': arguments.fanout,
+        'camera_mix': arguments.camera_mix,
+        'payload_size': arguments.payload_size,
+        'no_exif_ratio': arguments.no_exif_ratio,
+        'seed': arguments.seed
+    }
+    try:
+        print(f"Генерация корпуса в {work_directory}...", file=sys.stderr)
+        corpus_description = generate_corpus(corpus_directory, **corpus_parameters)
+        expected_models = corpus_description.pop('expected_models')
+
+        results = {}
+        print("Обход дерева...", file=sys.stderr)
+        results['walk'] = benchmark_walk(corpus_directory)
+        print("Чтение заголовков...", file=sys.stderr)
+        results['header_read'] = benchmark_header_reads(corpus_directory)
+        results['extract_camera_model'] = benchmark_extract_camera_model(corpus_directory, expected_models)
+        print("Анализ...", file=sys.stderr)
+        results.update(benchmark_analysis(corpus_directory, work_directory, arguments.workers, arguments.camera))
+        if arguments.simulated_latency_ms:
+            print("Чтение через имитацию сетевого диска...", file=sys.stderr)
+            results.update(benchmark_network_share(
+                corpus_directory, arguments.workers, arguments.simulated_latency_ms,
+                arguments.simulated_service_ms, arguments.simulated_capacity
+            ))
+        if arguments.archives:
+            print("Чтение снимков внутри ZIP и TAR...", file=sys.stderr)
+            results.update(benchmark_archives(corpus_directory, work_directory, arguments.workers, expected_models))
+        if arguments.disk_order or arguments.simulated_seek_ms:
+            print("Чтение в порядке имен и в порядке диска...", file=sys.stderr)
+            results.update(benchmark_disk_order(corpus_directory, arguments.workers, arguments.simulated_seek_ms))
+        if arguments.result_store_rows:
+            print("Хранилище результатов...", file=sys.stderr)
+            results['result_store'] = benchmark_result_store(
+                arguments.result_store_rows, arguments.camera_mix, arguments.depth, arguments.fanout, arguments.seed
+            )
+        if not arguments.skip_move:
+            print("Перемещение...", file=sys.stderr)
+            generate_corpus(move_source_directory, **corpus_parameters)
+            os.makedirs(move_target_directory, exist_ok=True)
+            results['move'] = benchmark_move(
+                move_source_directory, os.path.join(move_target_directory, arguments.camera),
+                work_directory, arguments.workers, arguments.camera
+            )
+            # Сортировка по дате: встроенный сортировщик и, если указан, exiftool на одинаковых копиях корпуса
+            print("Сортировка по дате (встроенная)...", file=sys.stderr)
+            date_sort_source_directory = os.path.join(work_directory, "date_sort_source")
+            generate_corpus(date_sort_source_directory, **corpus_parameters)
+            results['date_sort_builtin'] = benchmark_date_sort_builtin(
+                date_sort_source_directory, os.path.join(work_directory, "date_sort_builtin"),
+                work_directory, arguments.workers
+            )
+            if arguments.exiftool:
+                print("Сортировка по дате (exiftool)...", file=sys.stderr)
+                shutil.rmtree(date_sort_source_directory, ignore_errors=True)
+                generate_corpus(date_sort_source_directory, **corpus_parameters)
+                results['date_sort_exiftool'] = benchmark_date_sort_exiftool(
+                    date_sort_source_directory, os.path.join(work_directory, "date_sort_exiftool"),
+                    work_directory, arguments.exiftool, arguments.workers
+                )
+    finally:
+        if not arguments.keep_files:
+            shutil.rmtree(work_directory, ignore_errors=True)
+            if arguments.move_target:
+                shutil.rmtree(os.path.join(move_target_directory, arguments.camera), ignore_errors=True)
+
+    return {
+        'version': BENCHMARK_FORMAT_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count()
+        },
+        'workers': arguments.workers,
+        'corpus': corpus_description,
+        'results': results
+    }
+
+
+def compare_benchmarks(current_report, previous_report):
+    # Отношение скоростей > 1 - стало быстрее
+    lines = []
+    for stage_name, current_stage in current_report['results'].items():
+        previous_stage = previous_report.get('results', {}).get(stage_name)
+        if not previous_stage or not previous_stage.get('files_per_second') or not current_stage.get('files_per_second'):
+            continue
+        speed_ratio = current_stage['files_per_second'] / previous_stage['files_per_second']
+        lines.append(
+            f"{stage_name:22} {previous_stage['files_per_second']:>12.1f} → "
+            f"{current_stage['files_per_second']:>12.1f} файл/с  x{speed_ratio:.2f}"
+        )
+    return lines
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(description="Воспроизводимый бенчмарк анализа и перемещения фотографий")
+    parser.add_argument("--files", type=int, default=DEFAULT_FILE_COUNT, help="число файлов в корпусе")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="максимальная глубина вложенности")
+    parser.add_argument("--fanout", type=int, default=DEFAULT_DIRECTORY_FANOUT, help="подпапок на уровне")
+    parser.add_argument("--camera-mix", default=DEFAULT_CAMERA_MIX, help="Make:Model:вес через запятую")
+    parser.add_argument("--payload-size", type=int, default=DEFAULT_PAYLOAD_SIZE, help="байт данных изображения")
+    parser.add_argument("--no-exif-ratio", type=float, default=DEFAULT_NO_EXIF_RATIO, help="доля файлов без EXIF")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=4, help="число потоков анализа и перемещения")
+    parser.add_argument("--camera", default="ILCE", help="подстрока модели для анализа и перемещения")
+    parser.add_argument("--work-directory", default=None, help="папка для корпуса (по умолчанию временная)")
+    parser.add_argument("--move-target", default=None, help="целевая папка, например на другом диске")
+    parser.add_argument(
+        "--result-store-rows", type=int, default=DEFAULT_RESULT_STORE_ROWS,
+        help="строк для замера хранилища результатов (0 - не замерять)"
+    )
+    parser.add_argument(
+        "--simulated-latency-ms", type=float, default=0,
+        help="задержка сети для замера подбора параллелизма на имитации сетевого диска (0 - не замерять)"
+    )
+    parser.add_argument(
+        "--simulated-service-ms", type=float, default=DEFAULT_SHARE_SERVICE_MS,
+        help="время обслуживания одной операции сервером имитации"
+    )
+    parser.add_argument(
+        "--simulated-capacity", type=int, default=DEFAULT_SHARE_CAPACITY,
+        help="операций, которые сервер имитации обслуживает одновременно"
+    )
+    parser.add_argument(
+        "--archives", action="store_true", help="замерить анализ корпуса, упакованного в ZIP и TAR"
+    )
+    parser.add_argument(
+        "--disk-order", action="store_true",
+        help="сравнить чтение в порядке имен и в порядке диска на носителе рабочей папки"
+    )
+    parser.add_argument(
+        "--simulated-seek-ms", type=float, default=0,
+        help=f"время перемещения головки через весь диск для имитации HDD (0 - без имитации, обычно {DEFAULT_FULL_SEEK_MS:g})"
+    )
+    parser.add_argument("--skip-move", action="store_true", help="не измерять перемещение и сортировку по дате")
+    parser.add_argument("--exiftool", default=None, help="путь к exiftool для сравнения с встроенной сортировкой")
+    parser.add_argument("--keep-files", action="store_true", help="не удалять корпус после прогона")
+    parser.add_argument("--output", default=None, help="сохранить результаты в JSON")
+    parser.add_argument("--compare", default=None, help="сравнить с сохраненным JSON предыдущего прогона")
+    return parser
+
+
+def main(argument_list=None):
+    arguments = build_argument_parser().parse_args(argument_list)
+    report = run_benchmark(arguments)
+    report_text = json.dumps(report, ensure_ascii=False, indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(report_text + '\n')
+    else:
+        print(report_text)
+    if arguments.compare:
+        with open(arguments.compare, encoding='utf-8') as previous_file:
+            previous_report = json.load(previous_file)
+        if previous_report.get('corpus') != report['corpus']:
+            print("Внимание: параметры корпуса отличаются от сравниваемого прогона", file=sys.stderr)
+        for line in compare_benchmarks(report, previous_report):
+            print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,508 @@
+import sys
+import os
+import json
+import time
+import argparse
+import itertools
+import threading
+
+from photo_index import PhotoMetadataIndex
+from extraction_pool import suggest_worker_count
+from move_engine import MoveJournal, DEFAULT_JOURNAL_PATH
+from tree_walker import DEFAULT_SCAN_WORKER_COUNT
+from incremental_scan import DEFAULT_POLL_INTERVAL_SECONDS
+from partition_rules import PartitionRuleSet
+from duplicate_finder import DuplicateFinder, DUPLICATE_ACTIONS
+from similar_images import DEFAULT_MAX_DISTANCE, HASH_BITS, write_similar_groups_csv
+from performance_metrics import PROFILE_MODES
+from photo_query import PhotoQuery, FACET_EXPRESSIONS, count_facet, find_photos
+from photo_engine import PhotoEngine, resolve_move_target_directory, find_unfinished_move_target, ignore_message
+
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+
+class ProgressReporter:
+    # Прогресс печатается в stderr не чаще раза в секунду, чтобы stdout оставался чистым JSON Lines
+    def __init__(self, operation_name, quiet=False, photo_engine=None):
+        self.operation_name = operation_name
+        self.quiet = quiet
+        # Если задан движок, промежуточный прогресс берется из его статистики прогона (с оценкой ETA)
+        self.photo_engine = photo_engine
+        self.processed_count = 0
+        self.error_count = 0
+        self.started_at = time.monotonic()
+        self.last_report_at = 0.0
+
+    def update(self, error=None):
+        self.processed_count += 1
+        if error is not None:
+            self.error_count += 1
+        current_time = time.monotonic()
+        if current_time - self.last_report_at >= PROGRESS_INTERVAL_SECONDS:
+            self.last_report_at = current_time
+            self.report()
+
+    def report(self, final=False):
+        if self.quiet:
+            return
+        if self.photo_engine is not None and not final:
+            print(
+                f"{self.photo_engine.metrics.describe_progress()}, ошибок {self.error_count}",
+                file=sys.stderr,
+                flush=True
+            )
+            return
+        elapsed_seconds = max(time.monotonic() - self.started_at, 1e-9)
+        print(
+            f"{self.operation_name}: {self.processed_count} файлов, ошибок {self.error_count}, "
+            f"{self.processed_count / elapsed_seconds:.1f} файл/с" + (" - готово" if final else ""),
+            file=sys.stderr,
+            flush=True
+        )
+
+
+def print_message(message, tag='normal_text'):
+    print(message.strip(), file=sys.stderr, flush=True)
+
+
+def write_json_line(record):
+    sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def create_engine(arguments, source_directory=None):
+    worker_count = arguments.workers or suggest_worker_count(source_directory or os.getcwd())
+    return PhotoEngine(
+        PhotoMetadataIndex(arguments.index) if arguments.index else None,
+        worker_count=worker_count,
+        use_processes=arguments.processes,
+        scan_worker_count=arguments.scan_workers,
+        verify_copies=getattr(arguments, 'verify', False),
+        save_manifest=not arguments.no_manifest,
+        message_callback=ignore_message if arguments.quiet else print_message,
+        duplicate_action=getattr(arguments, 'duplicates', None),
+        metrics_directory=arguments.metrics_dir,
+        profile_mode=arguments.profile,
+        adaptive_concurrency=arguments.adaptive_workers,
+        group_shots=not arguments.no_grouping,
+        disk_order=arguments.disk_order,
+        scan_archives=arguments.archives
+    )
+
+
+def run_analyze(arguments):
+    if not os.path.isdir(arguments.source):
+        print_message(f"ОШИБКА: Исходная папка не существует: {arguments.source}")
+        return 2
+    photo_engine = create_engine(arguments, arguments.source)
+    progress_reporter = ProgressReporter("Анализ", arguments.quiet, photo_engine)
+    analyze = photo_engine.analyze_incremental if arguments.incremental else photo_engine.analyze
+    try:
+        for analysis_result in analyze(arguments.source, arguments.camera or ''):
+            progress_reporter.update(analysis_result.error)
+            if arguments.matches_only and not analysis_result.matched:
+                continue
+            write_analysis_result(analysis_result, arguments.camera)
+    finally:
+        photo_engine.close()
+    progress_reporter.report(final=True)
+    return 1 if progress_reporter.error_count else 0
+
+
+def run_move(arguments):
+    for directory_path in (arguments.source, arguments.target):
+        if not os.path.isdir(directory_path):
+            print_message(f"ОШИБКА: Папка не существует: {directory_path}")
+            return 2
+    # Повторный запуск прерванного перемещения той же камеры сначала доделывает его
+    # и продолжает в ту же папку; чужое незавершенное перемещение ничего не дает начать
+    target_directory = find_unfinished_move_target(
+        arguments.target, arguments.camera, DEFAULT_JOURNAL_PATH, arguments.source
+    )
+    resume_unfinished = target_directory is not None
+    if not resume_unfinished:
+        if MoveJournal.exists():
+            print_message("ОШИБКА: есть незавершенное перемещение, выполните resume или rollback")
+            return 2
+        target_directory = resolve_move_target_directory(arguments.target, arguments.camera)
+    photo_engine = create_engine(arguments, arguments.source)
+    progress_reporter = ProgressReporter("Перемещение", arguments.quiet, photo_engine)
+    try:
+        if resume_unfinished:
+            print_message(f"Продолжение прерванного перемещения в {target_directory}")
+            for move_result in photo_engine.process_move_journal(resume=True):
+                progress_reporter.update(move_result.error)
+                write_move_result(move_result)
+            if MoveJournal.exists():
+                print_message("ОШИБКА: прерванное перемещение не завершено, выполните resume или rollback")
+                progress_reporter.report(final=True)
+                return 1
+        for move_result in photo_engine.move(arguments.source, target_directory, arguments.camera):
+            progress_reporter.update(move_result.error)
+            write_move_result(move_result)
+    finally:
+        photo_engine.close()
+    progress_reporter.report(final=True)
+    return 1 if progress_reporter.error_count else 0
+
+
+def run_partition(arguments):
+    for directory_path in (arguments.source, arguments.target):
+        if not os.path.isdir(directory_path):
+            print_message(f"ОШИБКА: Папка не существует: {directory_path}")
+            return 2
+    if MoveJournal.exists():
+        print_message("ОШИБКА: есть незавершенное перемещение, выполните resume или rollback")
+        return 2
+    try:
+        rule_set = PartitionRuleSet.load(arguments.rules) if arguments.rules else PartitionRuleSet()
+    except (OSError, ValueError) as error:
+        print_message(f"ОШИБКА: не удалось загрузить правила - {str(error)}")
+        return 2
+    photo_engine = create_engine(arguments, arguments.source)
+    progress_reporter = ProgressReporter("Раскладка", arguments.quiet, photo_engine)
+    try:
+        for move_result in photo_engine.partition(arguments.source, arguments.target, rule_set):
+            progress_reporter.update(move_result.error)
+            write_move_result(move_result)
+    except ValueError as error:
+        print_message(f"ОШИБКА: {str(error)}")
+        return 2
+    finally:
+        photo_engine.close()
+    progress_reporter.report(final=True)
+    return 1 if progress_reporter.error_count else 0
+
+
+def run_watch(arguments):
+    if not os.path.isdir(arguments.source):
+        print_message(f"ОШИБКА: Исходная папка не существует: {arguments.source}")
+        return 2
+    target_directory = None
+    if arguments.move_to:
+        if not arguments.camera:
+            print_message("ОШИБКА: для перемещения укажите --camera")
+            return 2
+        if not os.path.isdir(arguments.move_to):
+            print_message(f"ОШИБКА: Целевая папка не существует: {arguments.move_to}")
+            return 2
+        if MoveJournal.exists():
+            print_message("ОШИБКА: есть незавершенное перемещение, выполните resume или rollback")
+            return 2
+        target_directory = os.path.join(arguments.move_to, arguments.camera)
+    photo_engine = create_engine(arguments, arguments.source)
+    stop_event = threading.Event()
+    try:
+        watch_events = photo_engine.watch(
+            arguments.source, arguments.camera or '', stop_event, target_directory, arguments.poll_interval
+        )
+        for watch_event in watch_events:
+            if watch_event.kind == 'move':
+                write_move_result(watch_event.result)
+            elif not arguments.matches_only or watch_event.result.matched:
+                write_analysis_result(watch_event.result, arguments.camera)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        photo_engine.close()
+    return 0
+
+
+def run_query(arguments):
+    # Отвечает по индексу, исходные файлы читаются только при перемещении (--move-to)
+    if not os.path.isdir(arguments.source):
+        print_message(f"ОШИБКА: Исходная папка не существует: {arguments.source}")
+        return 2
+    photo_query = PhotoQuery(
+        arguments.source,
+        model=arguments.model,
+        make=arguments.make,
+        lens=arguments.lens,
+        date_from=arguments.date_from,
+        date_to=arguments.date_to,
+        extensions=arguments.ext,
+        min_width=arguments.min_width,
+        min_height=arguments.min_height
+    )
+    if arguments.move_to:
+        return run_query_move(arguments, photo_query)
+    photo_engine = create_engine(arguments, arguments.source)
+    started_at = time.perf_counter()
+    try:
+        if arguments.facet:
+            for facet_name in arguments.facet:
+                for facet_count in count_facet(photo_engine.metadata_index, facet_name, photo_query):
+                    write_json_line({'facet': facet_name, 'value': facet_count.value, 'count': facet_count.count})
+        else:
+            for indexed_photo in find_photos(photo_engine.metadata_index, photo_query):
+                write_indexed_photo(indexed_photo)
+    finally:
+        photo_engine.close()
+    if not arguments.quiet:
+        print_message(f"Запрос ({photo_query.describe()}) выполнен за {(time.perf_counter() - started_at) * 1000:.1f} мс")
+    return 0
+
+
+def run_query_move(arguments, photo_query):
+    if not os.path.isdir(arguments.move_to):
+        print_message(f"ОШИБКА: Целевая папка не существует: {arguments.move_to}")
+        return 2
+    if MoveJournal.exists():
+        print_message("ОШИБКА: есть незавершенное перемещение, выполните resume или rollback")
+        return 2
+    photo_engine = create_engine(arguments, arguments.source)
+    progress_reporter = ProgressReporter("Перемещение", arguments.quiet, photo_engine)
+    try:
+        for move_result in photo_engine.move_query(arguments.source, arguments.move_to, photo_query):
+            progress_reporter.update(move_result.error)
+            write_move_result(move_result)
+    except ValueError as error:
+        print_message(f"ОШИБКА: {str(error)}")
+        return 2
+    finally:
+        photo_engine.close()
+    progress_reporter.report(final=True)
+    return 1 if progress_reporter.error_count else 0
+
+
+def run_duplicates(arguments):
+    for directory_path in [arguments.source] + arguments.against:
+        if not os.path.isdir(directory_path):
+            print_message(f"ОШИБКА: Папка не существует: {directory_path}")
+            return 2
+    photo_engine = create_engine(arguments, arguments.source)
+    try:
+        walked_files = itertools.chain.from_iterable(
+            photo_engine.walk_image_files(directory_path) for directory_path in [arguments.source] + arguments.against
+        )
+        duplicate_finder = DuplicateFinder(photo_engine.metadata_index, photo_engine.worker_count)
+        duplicate_groups = duplicate_finder.find_duplicate_groups(walked_files)
+    finally:
+        photo_engine.close()
+    for duplicate_group in duplicate_groups:
+        write_json_line({
+            'size': duplicate_group.file_size,
+            'hash': duplicate_group.digest,
+            'paths': [walked_file.path for walked_file in duplicate_group.walked_files]
+        })
+    for file_path, error in duplicate_finder.errors:
+        print_message(f"ОШИБКА: не удалось прочитать {file_path} - {str(error)}")
+    if not arguments.quiet:
+        print_message(duplicate_finder.describe_statistics())
+    return 1 if duplicate_finder.errors else 0
+
+
+def run_similar(arguments):
+    if not os.path.isdir(arguments.source):
+        print_message(f"ОШИБКА: Исходная папка не существует: {arguments.source}")
+        return 2
+    if not 0 <= arguments.max_distance < HASH_BITS:
+        print_message(f"ОШИБКА: порог должен быть от 0 до {HASH_BITS - 1}")
+        return 2
+    photo_engine = create_engine(arguments, arguments.source)
+    try:
+        similar_groups, errors = photo_engine.find_similar_images(arguments.source, arguments.max_distance)
+    finally:
+        photo_engine.close()
+    for group_number, similar_group in enumerate(similar_groups, 1):
+        write_json_line({
+            'group': group_number,
+            'max_distance': similar_group.max_distance,
+            'paths': similar_group.file_paths
+        })
+    if arguments.csv:
+        write_similar_groups_csv(similar_groups, arguments.csv)
+    return 1 if errors else 0
+
+
+def run_move_journal(arguments):
+    if not MoveJournal.exists():
+        print_message("Незавершенных перемещений нет.")
+        return 0
+    resume = arguments.command == 'resume'
+    photo_engine = create_engine(arguments)
+    progress_reporter = ProgressReporter("Продолжение" if resume else "Откат", arguments.quiet, photo_engine)
+    try:
+        for move_result in photo_engine.process_move_journal(resume):
+            progress_reporter.update(move_result.error)
+            write_move_result(move_result)
+    finally:
+        photo_engine.close()
+    progress_reporter.report(final=True)
+    return 1 if progress_reporter.error_count else 0
+
+
+def write_analysis_result(analysis_result, camera_name):
+    write_json_line({
+        'path': analysis_result.relative_path,
+        'model': analysis_result.camera_model,
+        'size': analysis_result.file_size,
+        'mtime_ns': analysis_result.modification_time,
+        'match': analysis_result.matched if camera_name else None,
+        'error': str(analysis_result.error) if analysis_result.error is not None else None
+    })
+
+
+def write_indexed_photo(indexed_photo):
+    write_json_line({
+        'path': indexed_photo.file_path,
+        'make': indexed_photo.metadata.camera_make,
+        'model': indexed_photo.metadata.camera_model,
+        'lens': indexed_photo.metadata.lens_model,
+        'date': indexed_photo.metadata.date_time,
+        'width': indexed_photo.metadata.image_width,
+        'height': indexed_photo.metadata.image_height,
+        'size': indexed_photo.file_size
+    })
+
+
+def write_move_result(move_result):
+    write_json_line({
+        'source': move_result.source_path,
+        'target': move_result.target_path,
+        'method': move_result.method,
+        'error': str(move_result.error) if move_result.error is not None else None
+    })
+
+
+def build_argument_parser():
+    common_parser = argparse.ArgumentParser(add_help=False)
+    common_parser.add_argument("--workers", type=int, default=None, help="число потоков (по умолчанию по типу диска)")
+    common_parser.add_argument("--processes", action="store_true", help="использовать процессы вместо потоков")
+    common_parser.add_argument(
+        "--adaptive-workers", action="store_true",
+        help="подбирать число одновременных чтений по задержкам (сетевые диски); --workers - начальное"
+    )
+    common_parser.add_argument(
+        "--scan-workers", type=int, default=DEFAULT_SCAN_WORKER_COUNT, help="потоков для чтения списков папок"
+    )
+    common_parser.add_argument(
+        "--no-grouping", action="store_true",
+        help="читать и перемещать RAW, JPEG и XMP одного снимка по отдельности"
+    )
+    common_parser.add_argument(
+        "--disk-order", action="store_true",
+        help="читать файлы в порядке расположения на диске (HDD, кардридеры); результаты - в порядке путей"
+    )
+    common_parser.add_argument(
+        "--archives", action="store_true",
+        help="искать снимки внутри ZIP и TAR без распаковки; при перемещении они извлекаются в цель"
+    )
+    common_parser.add_argument("--index", default=None, help="путь к базе индекса метаданных")
+    common_parser.add_argument("--no-manifest", action="store_true", help="не сохранять манифест анализа")
+    common_parser.add_argument("--quiet", action="store_true", help="не выводить прогресс в stderr")
+    common_parser.add_argument(
+        "--metrics-dir", default=None, help="сохранять статистику этапов в <папка>/<прогон>.json и .prom"
+    )
+    common_parser.add_argument(
+        "--profile", choices=PROFILE_MODES, default=None,
+        help="профилировать прогон (файл профиля - в папке статистики или текущей)"
+    )
+
+    parser = argparse.ArgumentParser(description="Анализ и сортировка фотографий по модели камеры без GUI")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    analyze_parser = subparsers.add_parser('analyze', parents=[common_parser], help="определить модели камер")
+    analyze_parser.add_argument("source", help="исходная папка")
+    analyze_parser.add_argument("--camera", default=None, help="название камеры для отметки совпадений")
+    analyze_parser.add_argument("--matches-only", action="store_true", help="выводить только совпадения")
+    analyze_parser.add_argument(
+        "--incremental", action="store_true", help="только новые и измененные файлы с прошлого анализа"
+    )
+    analyze_parser.set_defaults(handler=run_analyze)
+
+    move_parser = subparsers.add_parser('move', parents=[common_parser], help="переместить фотографии камеры")
+    move_parser.add_argument("source", help="исходная папка")
+    move_parser.add_argument("target", help="целевая папка")
+    move_parser.add_argument("--camera", required=True, help="название камеры")
+    move_parser.add_argument("--verify", action="store_true", help="сверять контрольные суммы копий")
+    move_parser.add_argument(
+        "--duplicates", choices=DUPLICATE_ACTIONS, default=None,
+        help="файлы, уже имеющиеся в целевой папке: пропустить, заменить жесткой ссылкой или только сообщить"
+    )
+    move_parser.set_defaults(handler=run_move)
+
+    partition_parser = subparsers.add_parser(
+        'partition', parents=[common_parser], help="разложить все камеры по папкам за один проход"
+    )
+    partition_parser.add_argument("source", help="исходная папка")
+    partition_parser.add_argument("target", help="целевая папка")
+    partition_parser.add_argument("--rules", default=None, help="JSON с правилами (по умолчанию <модель>/)")
+    partition_parser.add_argument("--verify", action="store_true", help="сверять контрольные суммы копий")
+    partition_parser.add_argument(
+        "--duplicates", choices=DUPLICATE_ACTIONS, default=None,
+        help="файлы, уже имеющиеся в целевой папке: пропустить, заменить жесткой ссылкой или только сообщить"
+    )
+    partition_parser.set_defaults(handler=run_partition)
+
+    query_parser = subparsers.add_parser(
+        'query', parents=[common_parser], help="фасеты и выборки по индексу метаданных без чтения файлов"
+    )
+    query_parser.add_argument("source", help="исходная папка (должна быть проанализирована)")
+    query_parser.add_argument("--model", default=None, help="модель содержит")
+    query_parser.add_argument("--make", default=None, help="производитель содержит")
+    query_parser.add_argument("--lens", default=None, help="объектив содержит")
+    query_parser.add_argument("--date-from", default=None, help="дата съемки не раньше (ГГГГ[-ММ[-ДД]])")
+    query_parser.add_argument("--date-to", default=None, help="дата съемки не позже (ГГГГ[-ММ[-ДД]])")
+    query_parser.add_argument("--ext", action="append", default=None, help="расширение (можно несколько раз)")
+    query_parser.add_argument("--min-width", type=int, default=None, help="ширина не меньше")
+    query_parser.add_argument("--min-height", type=int, default=None, help="высота не меньше")
+    query_parser.add_argument(
+        "--facet", action="append", choices=sorted(FACET_EXPRESSIONS), default=None,
+        help="посчитать файлы по значениям поля вместо вывода списка (можно несколько раз)"
+    )
+    query_parser.add_argument("--move-to", default=None, help="переместить найденные файлы в эту папку")
+    query_parser.add_argument("--verify", action="store_true", help="сверять контрольные суммы копий")
+    query_parser.add_argument(
+        "--duplicates", choices=DUPLICATE_ACTIONS, default=None,
+        help="файлы, уже имеющиеся в целевой папке: пропустить, заменить жесткой ссылкой или только сообщить"
+    )
+    query_parser.set_defaults(handler=run_query)
+
+    duplicates_parser = subparsers.add_parser(
+        'duplicates', parents=[common_parser], help="найти одинаковые файлы (размер, частичный и полный хэш)"
+    )
+    duplicates_parser.add_argument("source", help="исходная папка")
+    duplicates_parser.add_argument(
+        "--against", action="append", default=[], help="искать совпадения и в этой папке (можно несколько раз)"
+    )
+    duplicates_parser.set_defaults(handler=run_duplicates)
+
+    similar_parser = subparsers.add_parser(
+        'similar', parents=[common_parser], help="найти похожие снимки (серии, повторные экспорты) по dHash"
+    )
+    similar_parser.add_argument("source", help="исходная папка")
+    similar_parser.add_argument(
+        "--max-distance", type=int, default=DEFAULT_MAX_DISTANCE,
+        help="наибольшее число различающихся бит из 64 (больше порог - дольше поиск)"
+    )
+    similar_parser.add_argument("--csv", default=None, help="сохранить группы в CSV: группа, расстояние, путь")
+    similar_parser.set_defaults(handler=run_similar)
+
+    watch_parser = subparsers.add_parser('watch', parents=[common_parser], help="следить за новыми фотографиями")
+    watch_parser.add_argument("source", help="исходная папка")
+    watch_parser.add_argument("--camera", default=None, help="название камеры")
+    watch_parser.add_argument("--matches-only", action="store_true", help="выводить только совпадения")
+    watch_parser.add_argument("--move-to", default=None, help="сразу перемещать совпадения в <папка>/<камера>")
+    watch_parser.add_argument(
+        "--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL_SECONDS, help="период контрольного прохода, с"
+    )
+    watch_parser.add_argument("--verify", action="store_true", help="сверять контрольные суммы копий")
+    watch_parser.set_defaults(handler=run_watch)
+
+    for command_name, command_help in (('resume', "продолжить прерванное перемещение"),
+                                       ('rollback', "откатить прерванное перемещение")):
+        journal_parser = subparsers.add_parser(command_name, parents=[common_parser], help=command_help)
+        journal_parser.add_argument("--verify", action="store_true", help="сверять контрольные суммы копий")
+        journal_parser.set_defaults(handler=run_move_journal)
+
+    return parser
+
+
+def main(argument_list=None):
+    arguments = build_argument_parser().parse_args(argument_list)
+    return arguments.handler(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
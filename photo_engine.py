@@ -0,0 +1,711 @@
+import os
+import re
+import copy
+import collections
+
+from photo_index import PhotoMetadataIndex, NOT_INDEXED, normalize_index_path
+from extraction_pool import (
+    ExtractionPool, PoolResult, NO_CACHED_RESULT, extract_photo_metadata_with_stat, UNKNOWN_DEVICE_WORKER_COUNT
+)
+from photo_manifest import PhotoManifest, ManifestEntry
+from move_engine import MoveEngine, MoveJournal, MoveTask, MoveResult, DEFAULT_JOURNAL_PATH
+from tree_walker import TreeWalker, IMAGE_EXTENSIONS, DEFAULT_SCAN_WORKER_COUNT, has_image_extension
+from incremental_scan import DirectorySnapshot, IncrementalScanner, ChangeWatcher, DEFAULT_POLL_INTERVAL_SECONDS
+from duplicate_finder import DuplicateFinder, stat_walked_file
+from performance_metrics import PerformanceMetrics, create_profiler
+from exif_reader import get_header_bytes_read
+from photo_query import find_photos
+from adaptive_concurrency import AdaptiveConcurrencyController
+from shot_grouping import group_shot_files, extract_shot_group_metadata, read_priority, ShotGroupExpander
+from similar_images import SimilarImageFinder, DEFAULT_MAX_DISTANCE
+from disk_order import DiskOrderScheduler
+from archive_reader import stat_path
+
+AnalysisResult = collections.namedtuple(
+    'AnalysisResult', 'file_path relative_path camera_model file_size modification_time matched error'
+)
+WatchEvent = collections.namedtuple('WatchEvent', 'kind result')
+
+
+def is_valid_image_file(filename):
+    return has_image_extension(filename, IMAGE_EXTENSIONS)
+
+
+def iterate_image_files(source_directory, scan_worker_count=DEFAULT_SCAN_WORKER_COUNT):
+    for walked_file in TreeWalker(scan_worker_count=scan_worker_count).walk(source_directory):
+        yield walked_file.path
+
+
+def camera_model_matches(camera_model, camera_name):
+    return bool(camera_model) and camera_name.lower() in camera_model.lower()
+
+
+def resolve_move_target_directory(base_target_directory, camera_name):
+    # Не смешиваем с уже существующей папкой: добавляем _1, _2, ...
+    target_directory = os.path.join(base_target_directory, camera_name)
+    counter = 1
+    while os.path.exists(target_directory):
+        target_directory = os.path.join(base_target_directory, f"{camera_name}_{counter}")
+        counter += 1
+    return target_directory
+
+
+def find_unfinished_move_target(base_target_directory, camera_name, journal_path=None, source_directory=None):
+    # Папка незавершенного перемещения этой камеры в base_target_directory: повторный запуск
+    # продолжает в нее, чтобы снимки одной камеры не разошлись по двум папкам.
+    # С source_directory - только перемещение из той же исходной папки
+    if journal_path is None or not MoveJournal.exists(journal_path):
+        return None
+    journal_header = MoveJournal.read_header(journal_path)
+    if journal_header is None or not journal_header.get('target'):
+        return None
+    if source_directory is not None and (
+            normalize_index_path(journal_header.get('source') or '') != normalize_index_path(source_directory)):
+        return None
+    target_directory = journal_header['target']
+    if normalize_index_path(os.path.dirname(target_directory)) != normalize_index_path(base_target_directory):
+        return None
+    if not re.fullmatch(re.escape(camera_name) + r'(_\d+)?', os.path.basename(target_directory)):
+        return None
+    return target_directory
+
+
+def is_inside_directory(path, directory_path):
+    directory_prefix = os.path.join(normalize_index_path(directory_path), '')
+    return os.path.join(normalize_index_path(path), '').startswith(directory_prefix)
+
+
+def ignore_message(message, tag='normal_text'):
+    pass
+
+
+class PhotoEngine:
+    # Ядро анализа и перемещения без зависимостей от Tk: методы-генераторы
+    # отдают результат по каждому файлу, служебные сообщения уходят в message_callback
+    def __init__(self, metadata_index=None, worker_count=UNKNOWN_DEVICE_WORKER_COUNT, use_processes=False,
+                 verify_copies=False, save_manifest=True, message_callback=None, journal_path=DEFAULT_JOURNAL_PATH,
+                 scan_worker_count=DEFAULT_SCAN_WORKER_COUNT, duplicate_action=None, metrics_directory=None,
+                 profile_mode=None, adaptive_concurrency=False, group_shots=True, disk_order=False,
+                 scan_archives=False):
+        self.metadata_index = metadata_index if metadata_index is not None else PhotoMetadataIndex()
+        self.worker_count = worker_count
+        self.scan_worker_count = scan_worker_count
+        self.use_processes = use_processes
+        self.verify_copies = verify_copies
+        self.save_manifest = save_manifest
+        self.message_callback = message_callback or ignore_message
+        self.journal_path = journal_path
+        # None - дубликаты не ищутся, иначе одно из DUPLICATE_ACTIONS
+        self.duplicate_action = duplicate_action
+        # Куда сохранять статистику каждого прогона (None - не сохранять) и режим профилирования
+        self.metrics_directory = metrics_directory
+        self.profile_mode = profile_mode
+        # Подбирать число одновременных чтений и перемещений по задержкам (сетевые диски);
+        # worker_count тогда - начальное значение
+        self.adaptive_concurrency = adaptive_concurrency
+        # RAW+JPEG одного снимка читаются один раз и перемещаются вместе с XMP
+        self.group_shots = group_shots
+        # HDD и кардридеры: метаданные читаются в порядке расположения файлов на диске
+        self.disk_order = disk_order
+        # ZIP и TAR в исходной папке обходятся как подпапки; подходящие снимки извлекаются в цель
+        self.scan_archives = scan_archives
+        self.metrics = PerformanceMetrics()
+        self.run_profiler = None
+        self.run_header_bytes_read = 0
+        self.analysis_manifest = None
+        self.directory_snapshot = None
+
+    def lookup_indexed_shot_group(self, shot_group):
+        # Снимок берется из индекса, только если там есть все его файлы; метаданные - у первого
+        # по порядку чтения, туда же их записывает чтение снимка
+        read_order = sorted(shot_group.members, key=read_priority)
+        photo_metadata = self.metadata_index.get_photo_metadata(
+            read_order[0].path, read_order[0].file_size, read_order[0].modification_time
+        )
+        if photo_metadata is NOT_INDEXED:
+            return NO_CACHED_RESULT
+        for walked_file in read_order[1:]:
+            camera_model = self.metadata_index.get_camera_model(
+                walked_file.path, walked_file.file_size, walked_file.modification_time
+            )
+            if camera_model is NOT_INDEXED:
+                return NO_CACHED_RESULT
+        return photo_metadata, 0
+
+    def reindex_file(self, file_path):
+        # Перечитывает метаданные изменившегося файла; возвращает (модель, размер, время изменения)
+        photo_metadata, file_size, modification_time = extract_photo_metadata_with_stat(file_path)
+        self.metadata_index.store_photo_metadata(file_path, file_size, modification_time, photo_metadata)
+        return photo_metadata.camera_model, file_size, modification_time
+
+    def begin_run(self, run_name, progress_stage, expected_total=None):
+        self.metrics = PerformanceMetrics(run_name, progress_stage, expected_total)
+        self.run_header_bytes_read = get_header_bytes_read()
+        self.run_profiler = create_profiler(self.profile_mode)
+        if self.run_profiler is not None:
+            self.run_profiler.start()
+
+    def end_run(self):
+        self.metrics.finish()
+        header_bytes_read = get_header_bytes_read() - self.run_header_bytes_read
+        if header_bytes_read:
+            self.metrics.add_bytes('extract', header_bytes_read)
+        self.message_callback(self.metrics.describe_summary(), 'header_text')
+        metrics_directory = self.metrics_directory
+        if self.run_profiler is not None:
+            profile_directory = metrics_directory or os.getcwd()
+            profile_path = os.path.join(
+                profile_directory, f"{self.metrics.run_name}.{self.run_profiler.file_extension}"
+            )
+            try:
+                os.makedirs(profile_directory, exist_ok=True)
+                summary_lines = self.run_profiler.stop(profile_path)
+                self.message_callback(
+                    f"Профиль сохранен: {profile_path}\n" + '\n'.join(f"  {line}" for line in summary_lines),
+                    'header_text'
+                )
+            except OSError as error:
+                self.message_callback(f"ОШИБКА: не удалось сохранить профиль - {str(error)}", 'error_text')
+            self.run_profiler = None
+        if metrics_directory:
+            try:
+                self.metrics.save(metrics_directory)
+            except OSError as error:
+                self.message_callback(f"ОШИБКА: не удалось сохранить статистику - {str(error)}", 'error_text')
+
+    def walk_image_files(self, source_directory, should_stop=None, wait_while_paused=None, stage_name='walk'):
+        tree_walker = TreeWalker(
+            scan_worker_count=self.scan_worker_count,
+            should_stop=should_stop,
+            wait_while_paused=wait_while_paused,
+            scan_archives=self.scan_archives,
+            error_callback=lambda directory_path, error: self.message_callback(
+                f"ОШИБКА: не удалось прочитать папку {directory_path} - {str(error)}", 'error_text'
+            )
+        )
+        return self.metrics.timed_iterator(stage_name, tree_walker.walk(source_directory))
+
+    def extract_camera_models(self, source_directory, should_stop=None, wait_while_paused=None):
+        walked_files = self.walk_image_files(source_directory, should_stop, wait_while_paused)
+        return self.extract_walked_files(walked_files, should_stop, wait_while_paused)
+
+    def create_concurrency_controller(self):
+        if not self.adaptive_concurrency:
+            return None
+        return AdaptiveConcurrencyController(initial_limit=self.worker_count)
+
+    def report_concurrency(self, stage_title, concurrency_controller):
+        if concurrency_controller is not None:
+            self.message_callback(f"{stage_title}: {concurrency_controller.describe()}", 'header_text')
+
+    def extract_walked_shots(self, walked_files, should_stop=None, wait_while_paused=None):
+        # Отдает (WalkedFile, PhotoMetadata, из кэша, ошибка) по каждому файлу. При group_shots
+        # все файлы снимка получают метаданные одного чтения и сохраняются в индекс с ними
+        concurrency_controller = self.create_concurrency_controller()
+        extraction_pool = ExtractionPool(
+            self.worker_count, self.use_processes,
+            queue_depth_callback=lambda queue_depth: self.metrics.observe_queue_depth('extract', queue_depth),
+            concurrency_controller=concurrency_controller
+        )
+        disk_order_scheduler = None
+        if self.disk_order:
+            # Место снимка на диске - место файла, который читается первым
+            disk_order_scheduler = DiskOrderScheduler(
+                extraction_pool, location_file=lambda shot_group: min(shot_group.members, key=read_priority)
+            )
+        pool_results = (disk_order_scheduler or extraction_pool).map_ordered(
+            extract_shot_group_metadata,
+            group_shot_files(walked_files, self.group_shots),
+            cached_result_lookup=self.lookup_indexed_shot_group,
+            should_stop=should_stop,
+            wait_while_paused=wait_while_paused
+        )
+        file_count = 0
+        shot_count = 0
+        read_count = 0
+        for pool_result in pool_results:
+            shot_count += 1
+            photo_metadata = None
+            if pool_result.error is None:
+                photo_metadata, shot_read_count = pool_result.value
+                read_count += shot_read_count
+            for walked_file in pool_result.item.members:
+                file_count += 1
+                self.metrics.record('extract', error=pool_result.error is not None, cached=pool_result.from_cache)
+                if photo_metadata is not None and not pool_result.from_cache:
+                    self.metadata_index.store_photo_metadata(
+                        walked_file.path, walked_file.file_size, walked_file.modification_time, photo_metadata
+                    )
+                yield walked_file, photo_metadata, pool_result.from_cache, pool_result.error
+        self.report_concurrency("Чтение метаданных", concurrency_controller)
+        if disk_order_scheduler is not None:
+            self.message_callback(disk_order_scheduler.describe(), 'header_text')
+        if file_count != shot_count:
+            self.message_callback(
+                f"Снимков: {shot_count}, файлов в них: {file_count}, прочитано файлов: {read_count}", 'header_text'
+            )
+
+    def extract_walked_files(self, walked_files, should_stop=None, wait_while_paused=None):
+        # Наружу отдается (модель, размер, время изменения)
+        for walked_file, photo_metadata, from_cache, error in self.extract_walked_shots(
+                walked_files, should_stop, wait_while_paused):
+            if error is not None:
+                yield PoolResult(walked_file.path, None, error, from_cache)
+                continue
+            yield PoolResult(
+                walked_file.path, (photo_metadata.camera_model, walked_file.file_size, walked_file.modification_time),
+                None, from_cache
+            )
+
+    def analyze(self, source_directory, camera_name, should_stop=None, wait_while_paused=None):
+        # Для ETA число файлов берется из заголовка манифеста прошлого анализа
+        self.begin_run('analysis', 'extract', PhotoManifest.read_entry_count(source_directory))
+        analysis_manifest = PhotoManifest(source_directory)
+        walk_finished = False
+        try:
+            for pool_result in self.extract_camera_models(source_directory, should_stop, wait_while_paused):
+                relative_file_path = os.path.relpath(pool_result.item, source_directory)
+                if pool_result.error is not None:
+                    yield AnalysisResult(
+                        pool_result.item, relative_file_path, None, None, None, False, pool_result.error
+                    )
+                    continue
+                camera_model, file_size, modification_time = pool_result.value
+                analysis_manifest.add_entry(relative_file_path, camera_model, file_size, modification_time)
+                yield AnalysisResult(
+                    pool_result.item, relative_file_path, camera_model, file_size, modification_time,
+                    camera_model_matches(camera_model, camera_name), None
+                )
+            walk_finished = True
+        finally:
+            self.metadata_index.flush()
+            analysis_manifest.complete = walk_finished and not (should_stop and should_stop())
+            self.analysis_manifest = analysis_manifest
+            self.save_analysis_manifest()
+            self.end_run()
+
+    def load_complete_manifest(self, source_directory):
+        manifest = self.analysis_manifest
+        if manifest is None or not manifest.belongs_to(source_directory):
+            manifest = PhotoManifest.load_for_directory(source_directory)
+        return manifest if manifest is not None and manifest.complete else None
+
+    def load_directory_snapshot(self, source_directory):
+        snapshot = self.directory_snapshot
+        if snapshot is None or not snapshot.belongs_to(source_directory):
+            snapshot = DirectorySnapshot.load_for_directory(source_directory)
+        return snapshot
+
+    def analyze_incremental(self, source_directory, camera_name, should_stop=None, wait_while_paused=None):
+        # Отдает результаты только для новых и измененных файлов; манифест при этом
+        # остается полным: неизмененные записи берутся из прошлого анализа
+        previous_manifest = self.load_complete_manifest(source_directory)
+        previous_snapshot = self.load_directory_snapshot(source_directory) if previous_manifest else None
+        if previous_snapshot is None:
+            self.message_callback("Снимок прошлого анализа не найден, анализируются все файлы", 'warning_text')
+            previous_manifest = PhotoManifest(source_directory)
+            previous_snapshot = DirectorySnapshot(source_directory)
+
+        self.begin_run('incremental_analysis', 'extract')
+        incremental_scanner = IncrementalScanner(
+            previous_snapshot, should_stop=should_stop, wait_while_paused=wait_while_paused
+        )
+        changed_files = self.metrics.timed_iterator(
+            'walk', (changed_file.walked_file for changed_file in incremental_scanner.scan())
+        )
+        entries_by_path = {entry.relative_path: entry for entry in previous_manifest.entries}
+        scan_finished = False
+        try:
+            for pool_result in self.extract_walked_files(changed_files, should_stop, wait_while_paused):
+                relative_file_path = os.path.relpath(pool_result.item, source_directory)
+                entries_by_path.pop(relative_file_path, None)
+                if pool_result.error is not None:
+                    incremental_scanner.forget_file(relative_file_path)
+                    yield AnalysisResult(
+                        pool_result.item, relative_file_path, None, None, None, False, pool_result.error
+                    )
+                    continue
+                camera_model, file_size, modification_time = pool_result.value
+                entries_by_path[relative_file_path] = ManifestEntry(
+                    relative_file_path, camera_model, file_size, modification_time
+                )
+                yield AnalysisResult(
+                    pool_result.item, relative_file_path, camera_model, file_size, modification_time,
+                    camera_model_matches(camera_model, camera_name), None
+                )
+            scan_finished = not (should_stop and should_stop())
+        finally:
+            self.metadata_index.flush()
+            self.end_run()
+
+        if not scan_finished:
+            return
+        for relative_file_path in incremental_scanner.removed_paths:
+            entries_by_path.pop(relative_file_path, None)
+            self.metadata_index.invalidate(os.path.join(source_directory, relative_file_path))
+        self.message_callback(
+            f"Папок перечитано: {incremental_scanner.scanned_directory_count}, "
+            f"пропущено без изменений: {incremental_scanner.pruned_directory_count}, "
+            f"удалено файлов: {len(incremental_scanner.removed_paths)}",
+            'header_text'
+        )
+        self.analysis_manifest = PhotoManifest(source_directory, entries_by_path.values(), complete=True)
+        self.directory_snapshot = incremental_scanner.current_snapshot
+        self.save_analysis_manifest()
+        if self.save_manifest:
+            try:
+                self.directory_snapshot.save()
+            except OSError as error:
+                self.message_callback(f"ОШИБКА: не удалось сохранить снимок папок - {str(error)}", 'error_text')
+
+    def watch(self, source_directory, camera_name, stop_event, target_directory=None,
+              poll_interval=DEFAULT_POLL_INTERVAL_SECONDS):
+        # Бесконечный цикл инкрементального анализа; при заданной target_directory
+        # новые совпадения сразу перемещаются. Завершается по stop_event
+        change_watcher = ChangeWatcher(source_directory, poll_interval)
+        self.message_callback(
+            "Наблюдение через inotify" if change_watcher.uses_inotify
+            else f"Наблюдение опросом раз в {poll_interval:g} с",
+            'header_text'
+        )
+        try:
+            while not stop_event.is_set():
+                matching_count = 0
+                for analysis_result in self.analyze_incremental(source_directory, camera_name, stop_event.is_set):
+                    matching_count += analysis_result.matched
+                    yield WatchEvent('analysis', analysis_result)
+                if target_directory and matching_count and not stop_event.is_set():
+                    if MoveJournal.exists(self.journal_path):
+                        # Поверх незавершенного перемещения не переносим: наблюдение продолжается без него
+                        self.message_callback(
+                            "ОШИБКА: есть незавершенное перемещение, новые совпадения не перемещены - "
+                            "продолжите или откатите его", 'error_text'
+                        )
+                    else:
+                        for move_result in self.move(source_directory, target_directory, camera_name,
+                                                     should_stop=stop_event.is_set):
+                            yield WatchEvent('move', move_result)
+                if self.directory_snapshot is not None:
+                    change_watcher.update_watched_directories(self.directory_snapshot)
+                if not change_watcher.wait_for_changes(stop_event):
+                    break
+        finally:
+            change_watcher.close()
+
+    def save_analysis_manifest(self):
+        if not self.save_manifest or self.analysis_manifest is None:
+            return
+        try:
+            self.analysis_manifest.save()
+        except OSError as error:
+            self.message_callback(f"ОШИБКА: не удалось сохранить манифест - {str(error)}", 'error_text')
+
+    def iterate_move_candidates(self, source_directory, camera_name):
+        manifest = self.load_complete_manifest(source_directory)
+        if manifest is None:
+            self.message_callback("Манифест анализа не найден, выполняется полное сканирование", 'warning_text')
+            yield from self.extract_camera_models(source_directory)
+            return
+
+        self.analysis_manifest = manifest
+        self.message_callback(f"Используется манифест анализа ({len(manifest.entries)} файлов)", 'header_text')
+        matching_entries = list(manifest.matching_entries(camera_name))
+        self.metrics.expected_total = len(matching_entries)
+        for entry in matching_entries:
+            full_file_path = os.path.join(source_directory, entry.relative_path)
+            entry_state = manifest.is_entry_unchanged(entry)
+            if entry_state is None:
+                yield PoolResult(full_file_path, None, FileNotFoundError("Файл не найден"), True)
+            elif entry_state:
+                yield PoolResult(
+                    full_file_path, (entry.camera_model, entry.file_size, entry.modification_time), None, True
+                )
+            else:
+                # Файл изменился после анализа - перечитываем его метаданные
+                try:
+                    camera_model, file_size, modification_time = self.reindex_file(full_file_path)
+                except Exception as error:
+                    yield PoolResult(full_file_path, None, error, False)
+                    continue
+                yield PoolResult(full_file_path, (camera_model, file_size, modification_time), None, False)
+
+    def iterate_move_tasks(self, source_directory, target_directory, camera_name):
+        for pool_result in self.iterate_move_candidates(source_directory, camera_name):
+            full_file_path = pool_result.item
+            if pool_result.error is not None:
+                yield MoveTask(full_file_path, None, pool_result.error)
+                continue
+            if camera_model_matches(pool_result.value[0], camera_name):
+                # Сохраняем структуру подпапок внутри целевой папки
+                relative_file_path = os.path.relpath(full_file_path, source_directory)
+                yield MoveTask(full_file_path, os.path.join(target_directory, relative_file_path), None)
+
+    def move(self, source_directory, target_directory, camera_name, should_stop=None, wait_while_paused=None,
+             archive_directory=None):
+        # Дубликаты ищутся во всем архиве (по умолчанию - в родителе папки камеры), а не только в target_directory
+        move_tasks = self.iterate_move_tasks(source_directory, target_directory, camera_name)
+        return self.execute_move_tasks(
+            source_directory, target_directory, move_tasks, should_stop, wait_while_paused,
+            archive_directory or os.path.dirname(os.path.normpath(target_directory))
+        )
+
+    def iterate_query_move_tasks(self, source_directory, target_directory, photo_query):
+        # Файлы берутся из индекса; изменившиеся после анализа не трогаем - запрос о них уже не точен
+        indexed_photos = find_photos(self.metadata_index, photo_query)
+        self.metrics.expected_total = len(indexed_photos)
+        normalized_source_directory = normalize_index_path(source_directory)
+        for indexed_photo in indexed_photos:
+            file_path = indexed_photo.file_path
+            try:
+                # Снимки внутри ZIP/TAR из индекса тоже проверяются по размеру и времени члена
+                file_stat = stat_path(file_path)
+            except OSError as error:
+                yield MoveTask(file_path, None, error)
+                continue
+            if (file_stat.st_size, file_stat.st_mtime_ns) != (indexed_photo.file_size, indexed_photo.modification_time):
+                yield MoveTask(file_path, None, ValueError("Файл изменился после анализа, повторите анализ"))
+                continue
+            relative_file_path = os.path.relpath(file_path, normalized_source_directory)
+            yield MoveTask(file_path, os.path.join(target_directory, relative_file_path), None)
+
+    def move_query(self, source_directory, target_directory, photo_query, should_stop=None, wait_while_paused=None):
+        # Перемещает результат фасетного запроса по исходной папке с сохранением подпапок
+        if is_inside_directory(target_directory, source_directory):
+            raise ValueError("Целевая папка не может находиться внутри исходной")
+        photo_query = copy.copy(photo_query)
+        photo_query.source_directory = source_directory
+        move_tasks = self.iterate_query_move_tasks(source_directory, target_directory, photo_query)
+        return self.execute_move_tasks(source_directory, target_directory, move_tasks, should_stop, wait_while_paused)
+
+    def iterate_partition_candidates(self, source_directory, rule_set, should_stop=None, wait_while_paused=None):
+        # Отдает (путь, модель, дата или None, ошибка); каждый файл читается не больше одного раза
+        if not rule_set.needs_date:
+            manifest = self.load_complete_manifest(source_directory)
+            if manifest is not None:
+                self.analysis_manifest = manifest
+                self.message_callback(f"Используется манифест анализа ({len(manifest.entries)} файлов)", 'header_text')
+                self.metrics.expected_total = len(manifest.entries)
+                for entry in list(manifest.entries):
+                    full_file_path = os.path.join(source_directory, entry.relative_path)
+                    if manifest.is_entry_unchanged(entry):
+                        yield full_file_path, entry.camera_model, None, None
+                        continue
+                    try:
+                        camera_model, _, _ = self.reindex_file(full_file_path)
+                    except Exception as error:
+                        yield full_file_path, None, None, error
+                        continue
+                    yield full_file_path, camera_model, None, None
+                return
+            for pool_result in self.extract_camera_models(source_directory, should_stop, wait_while_paused):
+                camera_model = pool_result.value[0] if pool_result.error is None else None
+                yield pool_result.item, camera_model, None, pool_result.error
+            return
+
+        # Правилам нужна дата: она тоже есть в индексе, файлы читаются только при промахе
+        extracted_files = self.extract_walked_shots(
+            self.walk_image_files(source_directory, should_stop, wait_while_paused), should_stop, wait_while_paused
+        )
+        for walked_file, photo_metadata, _, error in extracted_files:
+            if error is not None:
+                yield walked_file.path, None, None, error
+                continue
+            yield walked_file.path, photo_metadata.camera_model, photo_metadata.date_time, None
+
+    def iterate_partition_tasks(self, source_directory, target_directory, rule_set,
+                                should_stop=None, wait_while_paused=None):
+        partition_candidates = self.iterate_partition_candidates(
+            source_directory, rule_set, should_stop, wait_while_paused
+        )
+        for full_file_path, camera_model, date_time, error in partition_candidates:
+            if error is not None:
+                yield MoveTask(full_file_path, None, error)
+                continue
+            destination = rule_set.route(camera_model, os.path.splitext(full_file_path)[1], date_time)
+            if destination is None:
+                continue
+            relative_file_path = os.path.relpath(full_file_path, source_directory)
+            yield MoveTask(full_file_path, os.path.join(target_directory, destination, relative_file_path), None)
+
+    def partition(self, source_directory, target_directory, rule_set, should_stop=None, wait_while_paused=None):
+        # Один проход по дереву раскладывает файлы всех камер по папкам из правил
+        if is_inside_directory(target_directory, source_directory):
+            raise ValueError("Целевая папка не может находиться внутри исходной")
+        move_tasks = self.iterate_partition_tasks(
+            source_directory, target_directory, rule_set, should_stop, wait_while_paused
+        )
+        return self.execute_move_tasks(source_directory, target_directory, move_tasks, should_stop, wait_while_paused)
+
+    def find_similar_images(self, source_directory, max_distance=DEFAULT_MAX_DISTANCE,
+                            should_stop=None, wait_while_paused=None):
+        # Группы похожих снимков (серии, повторные экспорты) по dHash; возвращает (группы, ошибки).
+        # RAW+JPEG одного снимка хэшируется один раз - по самому дешевому файлу
+        self.begin_run('similar', 'similar_hash')
+        similar_image_finder = SimilarImageFinder(
+            self.metadata_index, self.worker_count, should_stop, wait_while_paused,
+            progress_callback=lambda error, from_cache: self.metrics.record(
+                'similar_hash', error=error is not None, cached=from_cache
+            )
+        )
+        try:
+            shot_groups = group_shot_files(
+                self.walk_image_files(source_directory, should_stop, wait_while_paused), self.group_shots
+            )
+            hashed_files = similar_image_finder.calculate_hashes(
+                min(shot_group.members, key=read_priority) for shot_group in shot_groups
+            )
+            with self.metrics.measure('similar_grouping', len(hashed_files)):
+                similar_groups = similar_image_finder.group_hashed_files(hashed_files, max_distance)
+        finally:
+            self.end_run()
+        for file_path, error in similar_image_finder.errors:
+            self.message_callback(f"ОШИБКА: не удалось прочитать {file_path} - {str(error)}", 'error_text')
+        self.message_callback(similar_image_finder.describe_statistics(), 'header_text')
+        return similar_groups, similar_image_finder.errors
+
+    def plan_duplicate_handling(self, move_tasks, archive_directory, should_stop=None, wait_while_paused=None):
+        # Возвращает (задачи по проходам, результаты для пропущенных дубликатов).
+        # Ссылки создаются вторым проходом, когда оригиналы из источника уже на месте
+        move_tasks = list(move_tasks)
+        candidate_files = []
+        for move_task in move_tasks:
+            if move_task.error is None:
+                try:
+                    candidate_files.append(stat_walked_file(move_task.source_path))
+                except OSError:
+                    # Ошибку сообщит само перемещение
+                    continue
+        duplicate_finder = DuplicateFinder(self.metadata_index, self.worker_count, should_stop, wait_while_paused)
+        reference_files = ()
+        if archive_directory and os.path.isdir(archive_directory):
+            reference_files = self.walk_image_files(archive_directory, should_stop, wait_while_paused, 'archive_walk')
+        with self.metrics.measure('duplicates', len(candidate_files)):
+            duplicate_of = duplicate_finder.find_move_duplicates(candidate_files, reference_files)
+        self.message_callback(duplicate_finder.describe_statistics(), 'header_text')
+        for file_path, error in duplicate_finder.errors:
+            self.message_callback(f"ОШИБКА: не удалось прочитать {file_path} - {str(error)}", 'error_text')
+
+        target_paths = {move_task.source_path: move_task.target_path for move_task in move_tasks}
+        primary_tasks = []
+        link_tasks = []
+        skipped_results = []
+        for move_task in move_tasks:
+            original_path = duplicate_of.get(move_task.source_path)
+            if original_path is None:
+                primary_tasks.append(move_task)
+                continue
+            # Оригинал из источника к этому моменту будет лежать по своему целевому пути
+            original_path = target_paths.get(original_path, original_path)
+            if self.duplicate_action == 'skip':
+                skipped_results.append(MoveResult(move_task.source_path, original_path, 'duplicate', None))
+            elif self.duplicate_action == 'link':
+                link_tasks.append(move_task._replace(link_path=original_path))
+            else:
+                self.message_callback(f"Дубликат: {move_task.source_path} совпадает с {original_path}", 'warning_text')
+                primary_tasks.append(move_task)
+        return [primary_tasks, link_tasks], skipped_results
+
+    def execute_move_tasks(self, source_directory, target_directory, move_tasks,
+                           should_stop=None, wait_while_paused=None, archive_directory=None):
+        self.begin_run('move', 'move')
+        try:
+            yield from self.execute_move_run(
+                source_directory, target_directory, move_tasks, should_stop, wait_while_paused, archive_directory
+            )
+        finally:
+            self.end_run()
+
+    def execute_move_run(self, source_directory, target_directory, move_tasks,
+                         should_stop=None, wait_while_paused=None, archive_directory=None):
+        # Журнал создается до планирования: при незавершенном прошлом перемещении ничего не начинается
+        move_journal = MoveJournal.create(source_directory, target_directory, self.journal_path)
+        processed_relative_paths = []
+        try:
+            # Время подготовки задач включает чтение метаданных, если манифеста нет
+            move_tasks = self.metrics.timed_iterator('move_planning', move_tasks)
+            shot_group_expander = None
+            if self.group_shots:
+                shot_group_expander = ShotGroupExpander()
+                move_tasks = shot_group_expander.expand(move_tasks)
+            move_task_passes = [move_tasks]
+            skipped_results = []
+            if self.duplicate_action is not None:
+                move_task_passes, skipped_results = self.plan_duplicate_handling(
+                    move_tasks, archive_directory or target_directory, should_stop, wait_while_paused
+                )
+            # План всех проходов попадает в журнал до первого перемещения: прерванный прогон
+            # продолжается командой resume целиком, а не только с файлов, что были в работе
+            move_task_passes = [list(pass_move_tasks) for pass_move_tasks in move_task_passes]
+            for pass_move_tasks in move_task_passes:
+                move_journal.record_plan(pass_move_tasks)
+            # Пропущенные дубликаты остаются в источнике: индекс и манифест для них не меняются
+            for skipped_result in skipped_results:
+                self.record_move_result(skipped_result)
+                yield skipped_result
+            move_engine = MoveEngine(
+                self.worker_count, self.verify_copies, adaptive_concurrency=self.adaptive_concurrency
+            )
+            for pass_move_tasks in move_task_passes:
+                move_results = move_engine.move_files(pass_move_tasks, move_journal, should_stop, wait_while_paused)
+                for move_result in move_results:
+                    self.record_move_result(move_result)
+                    relative_file_path = os.path.relpath(move_result.source_path, source_directory)
+                    if move_result.error is None:
+                        # Извлеченный из архива снимок остается в архиве - запись индекса верна
+                        if move_result.method != 'extract':
+                            self.metadata_index.invalidate(move_result.source_path)
+                        processed_relative_paths.append(relative_file_path)
+                    elif isinstance(move_result.error, FileNotFoundError):
+                        processed_relative_paths.append(relative_file_path)
+                    yield move_result
+            if shot_group_expander is not None and (shot_group_expander.added_count or shot_group_expander.blocked_count):
+                self.message_callback(shot_group_expander.describe(), 'header_text')
+            if should_stop and should_stop():
+                # Остановленное перемещение можно продолжить: оставшиеся файлы есть в журнале
+                self.message_callback(
+                    "Перемещение остановлено: продолжите или откатите его, прежде чем начинать новое", 'warning_text'
+                )
+            else:
+                move_journal.finish()
+        finally:
+            # При сбое журнал остается на диске, чтобы перемещение можно было продолжить
+            move_journal.close()
+            self.metadata_index.flush()
+            if self.analysis_manifest is not None and self.analysis_manifest.belongs_to(source_directory):
+                self.analysis_manifest.remove_entries(processed_relative_paths)
+                self.save_analysis_manifest()
+
+    def record_move_result(self, move_result):
+        byte_count = 0
+        if move_result.error is None and move_result.method != 'duplicate':
+            try:
+                byte_count = os.path.getsize(move_result.target_path)
+            except OSError:
+                pass
+        self.metrics.record('move', error=move_result.error is not None, byte_count=byte_count)
+
+    def process_move_journal(self, resume, should_stop=None, wait_while_paused=None):
+        # Продолжает или откатывает прерванное перемещение; журнал удаляется, если ошибок не было
+        # и работа не была остановлена
+        move_engine = MoveEngine(self.worker_count, self.verify_copies, adaptive_concurrency=self.adaptive_concurrency)
+        self.begin_run('resume' if resume else 'rollback', 'move')
+        if resume:
+            move_results = move_engine.resume_journal(self.journal_path, should_stop, wait_while_paused)
+        else:
+            move_results = move_engine.rollback_journal(self.journal_path, should_stop, wait_while_paused)
+        error_count = 0
+        try:
+            for move_result in move_results:
+                self.record_move_result(move_result)
+                if move_result.error is not None:
+                    error_count += 1
+                else:
+                    self.metadata_index.invalidate(move_result.source_path)
+                yield move_result
+        finally:
+            self.end_run()
+        if error_count == 0 and not (should_stop and should_stop()):
+            MoveJournal.discard(self.journal_path)
+
+    def close(self):
+        self.metadata_index.close()
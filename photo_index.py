@@ -0,0 +1,224 @@
+import os
+import sqlite3
+import threading
+import collections
+
+from exif_reader import PhotoMetadata
+from archive_reader import split_archive_path, stat_path
+
+DEFAULT_INDEX_DIRECTORY = os.path.join(os.path.expanduser("~"), ".sort_photos_gui")
+DEFAULT_INDEX_FILENAME = "metadata_index.sqlite3"
+
+# Отличает "файла нет в индексе" от сохраненного отрицательного результата (None)
+NOT_INDEXED = object()
+
+# Записи с другой версией считаются непроиндексированными: версия 2 добавила поля для фасетных запросов
+METADATA_VERSION = 2
+METADATA_COLUMNS = (
+    ('camera_make', 'TEXT'), ('lens_model', 'TEXT'), ('date_time', 'TEXT'), ('image_width', 'INTEGER'),
+    ('image_height', 'INTEGER'), ('extension', 'TEXT'), ('metadata_version', 'INTEGER')
+)
+
+IndexedPhoto = collections.namedtuple('IndexedPhoto', 'file_path file_size modification_time metadata')
+
+
+def normalize_index_path(file_path):
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+def is_missing_file(path):
+    # Снимки внутри ZIP/TAR проверяются по каталогу архива: os.path.isfile для них всегда False
+    if split_archive_path(path) is None:
+        return not os.path.isfile(path)
+    try:
+        stat_path(path)
+    except OSError:
+        return True
+    return False
+
+
+class PhotoMetadataIndex:
+    def __init__(self, index_path=None, commit_batch_size=500):
+        if index_path is None:
+            os.makedirs(DEFAULT_INDEX_DIRECTORY, exist_ok=True)
+            index_path = os.path.join(DEFAULT_INDEX_DIRECTORY, DEFAULT_INDEX_FILENAME)
+        self.index_path = index_path
+        self.commit_batch_size = commit_batch_size
+        self.pending_writes = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(index_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS photo_metadata ("
+            " file_path TEXT PRIMARY KEY,"
+            " file_size INTEGER NOT NULL,"
+            " modification_time INTEGER NOT NULL,"
+            " camera_model TEXT"
+            ")"
+        )
+        # Базы прежних версий дополняются новыми столбцами на месте
+        existing_columns = {row[1] for row in self.connection.execute("PRAGMA table_info(photo_metadata)")}
+        for column_name, column_type in METADATA_COLUMNS:
+            if column_name not in existing_columns:
+                self.connection.execute(f"ALTER TABLE photo_metadata ADD COLUMN {column_name} {column_type}")
+        for column_name in ('camera_model', 'date_time'):
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS photo_metadata_{column_name} ON photo_metadata ({column_name})"
+            )
+        # Хэши для поиска дубликатов: hash_kind 'partial' (начало и конец файла) или 'full'
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            " file_path TEXT NOT NULL,"
+            " hash_kind TEXT NOT NULL,"
+            " file_size INTEGER NOT NULL,"
+            " modification_time INTEGER NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " PRIMARY KEY (file_path, hash_kind)"
+            ")"
+        )
+        self.connection.commit()
+
+    def get_camera_model(self, file_path, file_size, modification_time):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT file_size, modification_time, camera_model, metadata_version FROM photo_metadata"
+                " WHERE file_path = ?",
+                (normalize_index_path(file_path),)
+            ).fetchone()
+        if row is None or row[0] != file_size or row[1] != modification_time or row[3] != METADATA_VERSION:
+            return NOT_INDEXED
+        return row[2]
+
+    def get_photo_metadata(self, file_path, file_size, modification_time):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT file_size, modification_time, metadata_version, camera_make, camera_model, lens_model,"
+                " date_time, image_width, image_height FROM photo_metadata WHERE file_path = ?",
+                (normalize_index_path(file_path),)
+            ).fetchone()
+        if row is None or row[0] != file_size or row[1] != modification_time or row[2] != METADATA_VERSION:
+            return NOT_INDEXED
+        return PhotoMetadata(*row[3:])
+
+    def store_photo_metadata(self, file_path, file_size, modification_time, photo_metadata):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO photo_metadata (file_path, file_size, modification_time, camera_model,"
+                " camera_make, lens_model, date_time, image_width, image_height, extension, metadata_version)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    normalize_index_path(file_path), file_size, modification_time, photo_metadata.camera_model,
+                    photo_metadata.camera_make, photo_metadata.lens_model, photo_metadata.date_time,
+                    photo_metadata.image_width, photo_metadata.image_height,
+                    os.path.splitext(file_path)[1].lower(), METADATA_VERSION
+                )
+            )
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_batch_size:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def get_file_hash(self, file_path, file_size, modification_time, hash_kind):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT file_size, modification_time, digest FROM file_hashes WHERE file_path = ? AND hash_kind = ?",
+                (normalize_index_path(file_path), hash_kind)
+            ).fetchone()
+        if row is None or row[0] != file_size or row[1] != modification_time:
+            return NOT_INDEXED
+        return row[2]
+
+    def store_file_hash(self, file_path, file_size, modification_time, hash_kind, digest):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO file_hashes (file_path, hash_kind, file_size, modification_time, digest)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (normalize_index_path(file_path), hash_kind, file_size, modification_time, digest)
+            )
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_batch_size:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def count_by_facet(self, facet_expression, where_clause, parameters):
+        # Выражения и условия собирает photo_query; значения передаются только параметрами
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT {facet_expression} AS facet_value, COUNT(*) FROM photo_metadata"
+                f" WHERE metadata_version = ? AND ({where_clause})"
+                " GROUP BY facet_value ORDER BY COUNT(*) DESC, facet_value",
+                [METADATA_VERSION] + list(parameters)
+            ).fetchall()
+
+    def query_photos(self, where_clause, parameters):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT file_path, file_size, modification_time, camera_make, camera_model, lens_model, date_time,"
+                " image_width, image_height FROM photo_metadata"
+                f" WHERE metadata_version = ? AND ({where_clause}) ORDER BY file_path",
+                [METADATA_VERSION] + list(parameters)
+            ).fetchall()
+        return [IndexedPhoto(row[0], row[1], row[2], PhotoMetadata(*row[3:])) for row in rows]
+
+    def invalidate(self, file_path):
+        with self.lock:
+            for table_name in ('photo_metadata', 'file_hashes'):
+                self.connection.execute(
+                    f"DELETE FROM {table_name} WHERE file_path = ?",
+                    (normalize_index_path(file_path),)
+                )
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def invalidate_directory(self, directory_path):
+        directory_prefix = os.path.join(normalize_index_path(directory_path), "")
+        with self.lock:
+            deleted_count = self.connection.execute(
+                "DELETE FROM photo_metadata WHERE substr(file_path, 1, ?) = ?",
+                (len(directory_prefix), directory_prefix)
+            ).rowcount
+            self.connection.execute(
+                "DELETE FROM file_hashes WHERE substr(file_path, 1, ?) = ?",
+                (len(directory_prefix), directory_prefix)
+            )
+            self.connection.commit()
+            self.pending_writes = 0
+        return deleted_count
+
+    def flush(self):
+        with self.lock:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def compact(self):
+        # Удаляем записи об исчезнувших файлах и освобождаем место в базе
+        with self.lock:
+            indexed_paths = [row[0] for row in self.connection.execute(
+                "SELECT file_path FROM photo_metadata UNION SELECT file_path FROM file_hashes"
+            )]
+        missing_paths = [(path,) for path in indexed_paths if is_missing_file(path)]
+        with self.lock:
+            self.connection.executemany("DELETE FROM photo_metadata WHERE file_path = ?", missing_paths)
+            self.connection.executemany("DELETE FROM file_hashes WHERE file_path = ?", missing_paths)
+            self.connection.commit()
+            self.pending_writes = 0
+            self.connection.execute("VACUUM")
+        return len(missing_paths)
+
+    def rebuild(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM photo_metadata")
+            self.connection.execute("DELETE FROM file_hashes")
+            self.connection.commit()
+            self.pending_writes = 0
+            self.connection.execute("VACUUM")
+
+    def entry_count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM photo_metadata").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
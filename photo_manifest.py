@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+import collections
+
+from photo_index import DEFAULT_INDEX_DIRECTORY, normalize_index_path
+from archive_reader import stat_path
+
+MANIFEST_DIRECTORY = os.path.join(DEFAULT_INDEX_DIRECTORY, "manifests")
+MANIFEST_FORMAT_VERSION = 1
+
+ManifestEntry = collections.namedtuple('ManifestEntry', 'relative_path camera_model file_size modification_time')
+
+
+def default_manifest_path(source_directory):
+    source_key = hashlib.sha1(normalize_index_path(source_directory).encode('utf-8')).hexdigest()
+    return os.path.join(MANIFEST_DIRECTORY, f"{source_key}.jsonl")
+
+
+class PhotoManifest:
+    def __init__(self, source_directory, entries=None, complete=False):
+        self.source_directory = source_directory
+        self.entries = list(entries or [])
+        self.complete = complete
+
+    def add_entry(self, relative_path, camera_model, file_size, modification_time):
+        self.entries.append(ManifestEntry(relative_path, camera_model, file_size, modification_time))
+
+    def belongs_to(self, source_directory):
+        return normalize_index_path(self.source_directory) == normalize_index_path(source_directory)
+
+    def matching_entries(self, camera_name):
+        camera_name = camera_name.lower()
+        for entry in self.entries:
+            if entry.camera_model and camera_name in entry.camera_model.lower():
+                yield entry
+
+    def is_entry_unchanged(self, entry):
+        # None - файл исчез, False - размер или время изменения не совпадают
+        try:
+            file_stat = stat_path(os.path.join(self.source_directory, entry.relative_path))
+        except FileNotFoundError:
+            return None
+        return file_stat.st_size == entry.file_size and file_stat.st_mtime_ns == entry.modification_time
+
+    def remove_entries(self, relative_paths):
+        relative_paths = set(relative_paths)
+        self.entries = [entry for entry in self.entries if entry.relative_path not in relative_paths]
+
+    def save(self, manifest_path=None):
+        manifest_path = manifest_path or default_manifest_path(self.source_directory)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        temporary_path = manifest_path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as manifest_file:
+            manifest_file.write(json.dumps({
+                'version': MANIFEST_FORMAT_VERSION,
+                'source_directory': self.source_directory,
+                'complete': self.complete,
+                'entry_count': len(self.entries)
+            }, ensure_ascii=False) + '\n')
+            for entry in self.entries:
+                manifest_file.write(json.dumps(list(entry), ensure_ascii=False) + '\n')
+        os.replace(temporary_path, manifest_path)
+        return manifest_path
+
+    @classmethod
+    def load(cls, manifest_path):
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            header = json.loads(manifest_file.readline())
+            if header.get('version') != MANIFEST_FORMAT_VERSION:
+                raise ValueError(f"Неподдерживаемая версия манифеста: {header.get('version')}")
+            entries = [ManifestEntry(*json.loads(line)) for line in manifest_file if line.strip()]
+        return cls(header['source_directory'], entries, header.get('complete', False))
+
+    @staticmethod
+    def read_entry_count(source_directory):
+        # Число файлов прошлого анализа по заголовку, без чтения записей - для оценки ETA
+        try:
+            with open(default_manifest_path(source_directory), encoding='utf-8') as manifest_file:
+                return json.loads(manifest_file.readline()).get('entry_count')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @classmethod
+    def load_for_directory(cls, source_directory):
+        manifest_path = default_manifest_path(source_directory)
+        if not os.path.isfile(manifest_path):
+            return None
+        try:
+            manifest = cls.load(manifest_path)
+        except (OSError, ValueError, TypeError):
+            return None
+        return manifest if manifest.belongs_to(source_directory) else None
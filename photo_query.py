@@ -0,0 +1,109 @@
+import os
+import collections
+
+from photo_index import normalize_index_path
+from partition_rules import normalize_rule_date
+
+# Фасет -> выражение над таблицей photo_metadata
+FACET_EXPRESSIONS = {
+    'make': "camera_make",
+    'model': "camera_model",
+    'lens': "lens_model",
+    'year': "substr(date_time, 1, 4)",
+    'month': "substr(date_time, 1, 7)",
+    'extension': "extension",
+    'dimensions': "image_width || 'x' || image_height"
+}
+
+FacetCount = collections.namedtuple('FacetCount', 'value count')
+
+
+def escape_like_pattern(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def directory_path_range(directory_path):
+    # Пути внутри папки занимают диапазон [папка/, папка + следующий за разделителем символ):
+    # условие по диапазону использует первичный ключ, в отличие от substr или LIKE
+    directory_prefix = os.path.join(normalize_index_path(directory_path), '')
+    return directory_prefix, directory_prefix[:-1] + chr(ord(directory_prefix[-1]) + 1)
+
+
+def normalize_extension(extension):
+    extension = extension.strip().lower()
+    return extension if extension.startswith('.') else '.' + extension
+
+
+class PhotoQuery:
+    # Сочетание фильтров по индексу, без чтения исходных файлов. Текстовые поля
+    # ищутся по вхождению подстроки без учета регистра, как название камеры при анализе;
+    # дата - префикс "ГГГГ", "ГГГГ:ММ" или "ГГГГ:ММ:ДД", границы включаются
+    def __init__(self, source_directory=None, model=None, make=None, lens=None, date_from=None, date_to=None,
+                 extensions=None, min_width=None, min_height=None):
+        self.source_directory = source_directory
+        self.model = model or None
+        self.make = make or None
+        self.lens = lens or None
+        self.date_from = normalize_rule_date(date_from)
+        self.date_to = normalize_rule_date(date_to)
+        self.extensions = sorted({normalize_extension(extension) for extension in extensions if extension.strip()}) \
+            if extensions else None
+        self.min_width = min_width
+        self.min_height = min_height
+
+    def build_where_clause(self):
+        conditions = []
+        parameters = []
+        if self.source_directory:
+            conditions.append("file_path >= ? AND file_path < ?")
+            parameters.extend(directory_path_range(self.source_directory))
+        for column_name, text in (('camera_model', self.model), ('camera_make', self.make), ('lens_model', self.lens)):
+            if text:
+                conditions.append(f"{column_name} LIKE ? ESCAPE '\\'")
+                parameters.append(f"%{escape_like_pattern(text)}%")
+        if self.date_from:
+            conditions.append(f"substr(date_time, 1, {len(self.date_from)}) >= ?")
+            parameters.append(self.date_from)
+        if self.date_to:
+            conditions.append(f"substr(date_time, 1, {len(self.date_to)}) <= ?")
+            parameters.append(self.date_to)
+        if self.extensions:
+            conditions.append(f"extension IN ({', '.join('?' * len(self.extensions))})")
+            parameters.extend(self.extensions)
+        if self.min_width:
+            conditions.append("image_width >= ?")
+            parameters.append(self.min_width)
+        if self.min_height:
+            conditions.append("image_height >= ?")
+            parameters.append(self.min_height)
+        return ' AND '.join(conditions) or '1', parameters
+
+    def describe(self):
+        descriptions = []
+        for title, value in (("модель", self.model), ("производитель", self.make), ("объектив", self.lens)):
+            if value:
+                descriptions.append(f"{title} содержит '{value}'")
+        if self.date_from or self.date_to:
+            descriptions.append(f"дата {self.date_from or '...'} - {self.date_to or '...'}")
+        if self.extensions:
+            descriptions.append(f"расширения {', '.join(self.extensions)}")
+        if self.min_width or self.min_height:
+            descriptions.append(f"размер от {self.min_width or 0}x{self.min_height or 0}")
+        return '; '.join(descriptions) or "все файлы"
+
+
+def count_facet(metadata_index, facet_name, photo_query):
+    if facet_name not in FACET_EXPRESSIONS:
+        raise ValueError(f"Неизвестный фасет: {facet_name}")
+    where_clause, parameters = photo_query.build_where_clause()
+    return [
+        FacetCount(facet_value, photo_count)
+        for facet_value, photo_count in metadata_index.count_by_facet(
+            FACET_EXPRESSIONS[facet_name], where_clause, parameters
+        )
+    ]
+
+
+def find_photos(metadata_index, photo_query):
+    where_clause, parameters = photo_query.build_where_clause()
+    return metadata_index.query_photos(where_clause, parameters)
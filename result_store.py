@@ -0,0 +1,179 @@
+import os
+import sys
+import array
+import bisect
+import itertools
+import threading
+import collections
+
+RESULT_MATCHED = 1
+RESULT_ERROR = 2
+
+ResultRow = collections.namedtuple('ResultRow', 'relative_path camera_model matched error')
+
+
+def encode_name(name):
+    return name.encode('utf-8', 'surrogateescape')
+
+
+def decode_name(encoded_name):
+    return encoded_name.decode('utf-8', 'surrogateescape')
+
+
+class StringTable:
+    # Интернирование: каждая строка хранится один раз, строки результатов ссылаются на нее номером.
+    # Номер 0 - отсутствующее значение
+    def __init__(self):
+        self.values = [None]
+        self.identifiers = {None: 0}
+
+    def intern(self, value):
+        identifier = self.identifiers.get(value)
+        if identifier is None:
+            identifier = len(self.values)
+            self.values.append(value)
+            self.identifiers[value] = identifier
+        return identifier
+
+    def find_containing(self, text):
+        # Номера строк, содержащих text без учета регистра
+        text = text.lower()
+        return {
+            identifier for identifier, value in enumerate(self.values)
+            if value is not None and text in value.lower()
+        }
+
+    def memory_usage(self):
+        return (
+            sys.getsizeof(self.values) + sys.getsizeof(self.identifiers)
+            + sum(sys.getsizeof(value) for value in self.values if value is not None)
+        )
+
+
+class AnalysisResultStore:
+    # Результаты анализа по колонкам вместо строк журнала: номер папки, номер модели,
+    # признаки и имя файла в общем буфере UTF-8 - около 50 байт на файл.
+    # Пишет фоновое задание, читает интерфейс; generation меняется при очистке
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.reset_columns()
+
+    def reset_columns(self):
+        self.directories = StringTable()
+        self.camera_models = StringTable()
+        self.directory_ids = array.array('I')
+        self.camera_model_ids = array.array('I')
+        self.flags = bytearray()
+        # Имя строки row - name_buffer[name_offsets[row]:name_offsets[row + 1]]
+        self.name_offsets = array.array('Q', [0])
+        self.name_buffer = bytearray()
+        # Те же имена в нижнем регистре с теми же смещениями - для поиска без учета регистра
+        self.search_buffer = bytearray()
+        # Ошибки редки, поэтому хранятся словарем по номеру строки
+        self.errors = {}
+
+    def clear(self):
+        with self.lock:
+            self.reset_columns()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self.flags)
+
+    def add(self, relative_path, camera_model, matched, error=None):
+        directory_path, file_name = os.path.split(relative_path)
+        encoded_name = encode_name(file_name)
+        encoded_search_name = encode_name(file_name.lower())
+        if len(encoded_search_name) != len(encoded_name):
+            # Редкие буквы меняют длину при смене регистра; такое имя ищется с учетом регистра
+            encoded_search_name = encoded_name
+        with self.lock:
+            row = len(self.flags)
+            self.directory_ids.append(self.directories.intern(directory_path))
+            self.camera_model_ids.append(self.camera_models.intern(camera_model or None))
+            self.flags.append((RESULT_MATCHED if matched else 0) | (RESULT_ERROR if error is not None else 0))
+            self.name_buffer += encoded_name
+            self.search_buffer += encoded_search_name
+            self.name_offsets.append(len(self.name_buffer))
+            if error is not None:
+                self.errors[row] = str(error)
+        return row
+
+    def get_row(self, row):
+        with self.lock:
+            file_name = decode_name(bytes(self.name_buffer[self.name_offsets[row]:self.name_offsets[row + 1]]))
+            directory_path = self.directories.values[self.directory_ids[row]]
+            return ResultRow(
+                os.path.join(directory_path, file_name) if directory_path else file_name,
+                self.camera_models.values[self.camera_model_ids[row]],
+                bool(self.flags[row] & RESULT_MATCHED),
+                self.errors.get(row)
+            )
+
+    def find_name_rows(self, text, start_row, end_row):
+        # Поиск подстроки в буфере имен целиком (в C), номер строки - по смещению совпадения
+        pattern = encode_name(text.lower())
+        matching_rows = []
+        end_offset = self.name_offsets[end_row]
+        position = self.search_buffer.find(pattern, self.name_offsets[start_row], end_offset)
+        while position != -1:
+            row = bisect.bisect_right(self.name_offsets, position, start_row, end_row) - 1
+            next_name_offset = self.name_offsets[row + 1]
+            if position + len(pattern) <= next_name_offset:
+                matching_rows.append(row)
+                position = next_name_offset
+            else:
+                position += 1
+            position = self.search_buffer.find(pattern, position, end_offset)
+        return matching_rows
+
+    def select_rows(self, candidate_rows, column, predicate):
+        # Отбор через map/compress: цикл по миллиону строк идет в C, а не в байт-коде
+        if isinstance(candidate_rows, range):
+            column_values = column[candidate_rows.start:candidate_rows.stop]
+        else:
+            column_values = map(column.__getitem__, candidate_rows)
+        return list(itertools.compress(candidate_rows, map(predicate, column_values)))
+
+    def filter_rows(self, text=None, camera_model=None, matched_only=False, errors_only=False,
+                    start_row=0, end_row=None):
+        # Номера строк из [start_row, end_row), подходящих под все условия: text - подстрока
+        # пути, camera_model - подстрока модели (без учета регистра)
+        with self.lock:
+            end_row = len(self.flags) if end_row is None else min(end_row, len(self.flags))
+            candidate_rows = range(start_row, end_row)
+            if errors_only:
+                candidate_rows = sorted(row for row in self.errors if start_row <= row < end_row)
+            if text:
+                matching_rows = set(self.find_name_rows(text, start_row, end_row))
+                matching_directory_ids = self.directories.find_containing(text)
+                if matching_directory_ids:
+                    matching_rows.update(
+                        self.select_rows(candidate_rows, self.directory_ids, matching_directory_ids.__contains__)
+                    )
+                candidate_rows = sorted(matching_rows.intersection(candidate_rows))
+            if camera_model:
+                matching_model_ids = self.camera_models.find_containing(camera_model)
+                candidate_rows = self.select_rows(candidate_rows, self.camera_model_ids, matching_model_ids.__contains__)
+            if matched_only:
+                candidate_rows = self.select_rows(
+                    candidate_rows, self.flags, lambda row_flags: row_flags & RESULT_MATCHED
+                )
+            return array.array('I', candidate_rows)
+
+    def count_by_camera_model(self):
+        with self.lock:
+            model_counts = collections.Counter(self.camera_model_ids)
+            return {self.camera_models.values[model_id]: count for model_id, count in model_counts.items()}
+
+    def memory_usage(self):
+        # Примерный объем в байтах: колонки и таблицы строк
+        with self.lock:
+            return (
+                sum(column.buffer_info()[1] * column.itemsize
+                    for column in (self.directory_ids, self.camera_model_ids, self.name_offsets))
+                + len(self.flags) + len(self.name_buffer) + len(self.search_buffer)
+                + self.directories.memory_usage() + self.camera_models.memory_usage()
+                + sys.getsizeof(self.errors) + sum(sys.getsizeof(error) for error in self.errors.values())
+            )
@@ -0,0 +1,186 @@
+import tkinter as tk
+import tkinter.font as tkfont
+
+
+def format_result_row(result_row):
+    # Строка в том же виде, в каком анализ раньше писал ее в журнал
+    if result_row.error is not None:
+        return f"ОШИБКА: {result_row.relative_path} - {result_row.error}", 'error_text'
+    if result_row.camera_model:
+        return f"{result_row.relative_path} - {result_row.camera_model}", \
+            'match_text' if result_row.matched else 'normal_text'
+    return f"{result_row.relative_path} - Модель камеры не определена", 'normal_text'
+
+
+class VirtualResultList(tk.Frame):
+    # Список результатов, в котором рисуются только видимые строки: прокрутка и
+    # перерисовка не зависят от числа файлов. Строки берутся из AnalysisResultStore
+    # по номерам - все подряд или отобранные фильтром
+    def __init__(self, parent, result_store, font, color_scheme, row_activate_callback=None, row_select_callback=None):
+        super().__init__(parent)
+        self.result_store = result_store
+        self.font = tkfont.Font(font=font)
+        self.color_scheme = color_scheme
+        self.row_activate_callback = row_activate_callback
+        # row_select_callback(номер строки в списке, ResultRow) - при смене выделенной строки
+        self.row_select_callback = row_select_callback
+        self.row_height = self.font.metrics('linespace') + 2
+        self.first_row = 0
+        self.selected_row = None
+        self.follow_tail = True
+        self.filtered_rows = None
+        self.filter_arguments = None
+        # Строки хранилища до этого номера уже просмотрены фильтром
+        self.filtered_until_row = 0
+        self.known_generation = result_store.generation
+        self.drawn_state = None
+
+        self.canvas = tk.Canvas(self, bg="white", highlightthickness=0)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar = tk.Scrollbar(self, command=self.scroll_view)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.canvas.bind("<Configure>", lambda event: self.redraw(force=True))
+        self.canvas.bind("<MouseWheel>", lambda event: self.scroll_rows(-3 if event.delta > 0 else 3))
+        self.canvas.bind("<Button-4>", lambda event: self.scroll_rows(-3))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll_rows(3))
+        self.canvas.bind("<Button-1>", self.select_clicked_row)
+        self.canvas.bind("<Double-1>", self.activate_clicked_row)
+        self.canvas.bind("<Prior>", lambda event: self.scroll_rows(-self.visible_row_count()))
+        self.canvas.bind("<Next>", lambda event: self.scroll_rows(self.visible_row_count()))
+        self.canvas.bind("<Home>", lambda event: self.scroll_to(0))
+        self.canvas.bind("<End>", lambda event: self.scroll_to(self.row_count()))
+        self.canvas.bind("<Up>", lambda event: self.move_selection(-1))
+        self.canvas.bind("<Down>", lambda event: self.move_selection(1))
+
+    def row_count(self):
+        if self.filtered_rows is not None:
+            return len(self.filtered_rows)
+        return len(self.result_store)
+
+    def store_row(self, view_row):
+        if self.filtered_rows is not None:
+            return self.filtered_rows[view_row]
+        return view_row
+
+    def visible_row_count(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def set_filter(self, **filter_arguments):
+        # Пустые условия - показать все строки без копирования номеров
+        self.filter_arguments = {name: value for name, value in filter_arguments.items() if value} or None
+        self.filtered_rows = self.apply_filter(0) if self.filter_arguments else None
+        self.selected_row = None
+        self.scroll_to(0)
+
+    def apply_filter(self, start_row):
+        self.filtered_until_row = len(self.result_store)
+        return self.result_store.filter_rows(start_row=start_row, end_row=self.filtered_until_row,
+                                             **self.filter_arguments)
+
+    def refresh(self):
+        # Вызывается периодически из главного потока: подхватывает новые строки и очистку хранилища
+        if self.known_generation != self.result_store.generation:
+            self.known_generation = self.result_store.generation
+            self.selected_row = None
+            self.first_row = 0
+            self.follow_tail = True
+            if self.filter_arguments:
+                self.filtered_rows = self.apply_filter(0)
+        elif self.filter_arguments and self.filtered_until_row < len(self.result_store):
+            # К отобранным строкам добавляются подходящие из появившихся после фильтрации
+            self.filtered_rows.extend(self.apply_filter(self.filtered_until_row))
+        if self.follow_tail:
+            self.first_row = max(0, self.row_count() - self.visible_row_count())
+        self.redraw()
+
+    def scroll_view(self, *arguments):
+        if arguments[0] == 'moveto':
+            self.scroll_to(int(float(arguments[1]) * self.row_count()))
+        elif arguments[0] == 'scroll':
+            step = self.visible_row_count() if arguments[2] == 'pages' else 1
+            self.scroll_rows(int(arguments[1]) * step)
+
+    def scroll_rows(self, row_delta):
+        self.scroll_to(self.first_row + row_delta)
+
+    def scroll_to(self, first_row):
+        last_first_row = max(0, self.row_count() - self.visible_row_count())
+        self.first_row = min(max(0, first_row), last_first_row)
+        # Прокрутка до конца снова включает слежение за новыми строками
+        self.follow_tail = self.first_row >= last_first_row
+        self.redraw()
+
+    def redraw(self, force=False):
+        row_count = self.row_count()
+        visible_row_count = self.visible_row_count()
+        drawn_state = (self.first_row, row_count, visible_row_count, self.selected_row, self.known_generation)
+        if not force and drawn_state == self.drawn_state:
+            return
+        self.drawn_state = drawn_state
+        self.canvas.delete('all')
+        canvas_width = self.canvas.winfo_width()
+        for visible_index in range(min(visible_row_count + 1, row_count - self.first_row)):
+            view_row = self.first_row + visible_index
+            try:
+                result_row = self.result_store.get_row(self.store_row(view_row))
+            except IndexError:
+                # Хранилище очищено новым анализом; строки перечитаются при следующем refresh
+                break
+            row_text, row_tag = format_result_row(result_row)
+            row_top = visible_index * self.row_height
+            if view_row == self.selected_row:
+                self.canvas.create_rectangle(0, row_top, canvas_width, row_top + self.row_height,
+                                             fill="yellow", outline="")
+            self.canvas.create_text(5, row_top + 1, anchor='nw', text=row_text, font=self.font,
+                                    fill=self.color_scheme.get(row_tag, 'black'))
+        if row_count:
+            self.scrollbar.set(self.first_row / row_count, min(1.0, (self.first_row + visible_row_count) / row_count))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def view_row_at(self, y):
+        view_row = self.first_row + int(y // self.row_height)
+        return view_row if view_row < self.row_count() else None
+
+    def get_result_row(self, view_row):
+        return self.result_store.get_row(self.store_row(view_row))
+
+    def neighbor_rows(self, view_row, row_distance):
+        # Строки вокруг выделенной, ближние первыми - для упреждающей загрузки миниатюр
+        neighbor_rows = []
+        for distance in range(1, row_distance + 1):
+            for neighbor_row in (view_row + distance, view_row - distance):
+                if 0 <= neighbor_row < self.row_count():
+                    neighbor_rows.append(self.get_result_row(neighbor_row))
+        return neighbor_rows
+
+    def select_row(self, view_row):
+        self.selected_row = view_row
+        if view_row is not None:
+            # Выделенная строка остается на экране; слежение за концом списка отключается
+            if view_row < self.first_row:
+                self.first_row = view_row
+            elif view_row >= self.first_row + self.visible_row_count():
+                self.first_row = view_row - self.visible_row_count() + 1
+            self.follow_tail = False
+        self.redraw()
+        if view_row is not None and self.row_select_callback is not None:
+            self.row_select_callback(view_row, self.get_result_row(view_row))
+
+    def move_selection(self, row_delta):
+        if not self.row_count():
+            return
+        if self.selected_row is None:
+            self.select_row(self.first_row)
+        else:
+            self.select_row(min(max(0, self.selected_row + row_delta), self.row_count() - 1))
+
+    def select_clicked_row(self, event):
+        self.canvas.focus_set()
+        self.select_row(self.view_row_at(event.y))
+
+    def activate_clicked_row(self, event):
+        view_row = self.view_row_at(event.y)
+        if view_row is not None and self.row_activate_callback is not None:
+            self.row_activate_callback(self.get_result_row(view_row))
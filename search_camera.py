@@ -1,23 +1,64 @@
 import os
-import shutil
+import sys
 import tkinter as tk
-from tkinter import filedialog, scrolledtext, messagebox
+from tkinter import filedialog, scrolledtext, messagebox, ttk
 from PIL import Image, ImageDraw, ImageTk
-from PIL.ExifTags import TAGS
-import threading
 import time
+import queue
 import subprocess
+from extraction_pool import suggest_worker_count
+from move_engine import MoveJournal, UnfinishedJournalError
+from photo_engine import PhotoEngine, resolve_move_target_directory, find_unfinished_move_target
+from partition_rules import PartitionRuleSet
+from performance_metrics import DEFAULT_METRICS_DIRECTORY
+from photo_query import PhotoQuery, count_facet
+from job_scheduler import JobScheduler
+from date_sorter import DateSorter
+from result_store import AnalysisResultStore
+from result_view import VirtualResultList
+from thumbnail_cache import ThumbnailCache, ThumbnailLoader
+from similar_images import DEFAULT_MAX_DISTANCE, write_similar_groups_csv
+
+DUPLICATE_ACTION_LABELS = {
+    "не искать": None,
+    "пропускать": 'skip',
+    "жесткие ссылки": 'link',
+    "только сообщать": 'report'
+}
+
+FACET_LABELS = {
+    "модель": 'model',
+    "производитель": 'make',
+    "объектив": 'lens',
+    "год": 'year',
+    "месяц": 'month',
+    "расширение": 'extension',
+    "размер": 'dimensions'
+}
 
 class PhotoProcessor:
     def __init__(self, main_window):
         self.main_window = main_window
+        self.ui_update_queue = queue.SimpleQueue()
+        self.result_store = AnalysisResultStore()
+        self.preview_image_path = None
+        self.similar_groups_window = None
+        self.preview_photo_image = None
         self.initialize_user_interface()
+        self.thumbnail_loader = ThumbnailLoader(ThumbnailCache(thumbnail_size=self.application_settings['thumbnail_size']))
         self.configure_text_tags()
         self.setup_keyboard_shortcuts()
-        self.processing_paused = False
-        self.processing_stopped = False
-        self.analysis_thread = None
+        self.watch_job = None
+        self.partition_rules_path = None
         self.unique_camera_models = set()
+        self.last_status_update_at = 0.0
+        self.photo_engine = PhotoEngine(message_callback=self.add_log_message, metrics_directory=DEFAULT_METRICS_DIRECTORY)
+        self.job_scheduler = JobScheduler(job_callback=self.handle_job_change)
+        if MoveJournal.exists():
+            self.add_log_message(
+                "Обнаружено незавершенное перемещение: его можно продолжить или откатить",
+                'warning_text'
+            )
 
     def initialize_user_interface(self):
         self.main_window.title("Анализатор и сортировщик фотографий")
@@ -28,6 +69,11 @@ class PhotoProcessor:
             'default_target_directory': r"D:\target_directory",
             'default_camera_name': "Sony",
             'font_style': ('Arial', 10),
+            'log_flush_interval_ms': 100,
+            'log_flush_batch_size': 5000,
+            'status_update_interval_seconds': 0.5,
+            'thumbnail_size': 320,
+            'thumbnail_prefetch_rows': 5,
             'color_scheme': {
                 'normal_text': 'black',
                 'error_text': 'red',
@@ -41,7 +87,10 @@ class PhotoProcessor:
 
         self.create_source_target_directory_controls()
         self.create_camera_processing_controls()
+        self.create_query_controls()
+        self.create_status_bar()
         self.create_log_display_panel()
+        self.main_window.after(self.application_settings['log_flush_interval_ms'], self.flush_ui_updates)
 
     def configure_text_tags(self):
         for tag_name, color in self.application_settings['color_scheme'].items():
@@ -101,7 +150,7 @@ class PhotoProcessor:
         tk.Button(
             control_frame,
             text="Выбрать...",
-            command=lambda: self.select_directory(self.source_directory_entry)
+            command=self.select_source_directory
         ).grid(row=0, column=2, padx=5)
 
         tk.Label(control_frame, text="→").grid(row=0, column=3, padx=5)
@@ -118,6 +167,93 @@ class PhotoProcessor:
             command=lambda: self.select_directory(self.target_directory_entry)
         ).grid(row=0, column=6, padx=5)
 
+        tk.Label(control_frame, text="Потоков:").grid(row=0, column=7, padx=5, sticky='e')
+
+        self.worker_count_variable = tk.IntVar(
+            value=suggest_worker_count(self.application_settings['default_source_directory'])
+        )
+        tk.Spinbox(
+            control_frame,
+            from_=1,
+            to=64,
+            width=4,
+            textvariable=self.worker_count_variable,
+            font=self.application_settings['font_style']
+        ).grid(row=0, column=8, padx=5)
+
+        self.use_processes_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Процессы",
+            variable=self.use_processes_variable
+        ).grid(row=0, column=9, padx=5)
+
+        self.save_manifest_variable = tk.BooleanVar(value=True)
+        tk.Checkbutton(
+            control_frame,
+            text="Сохранять манифест",
+            variable=self.save_manifest_variable
+        ).grid(row=0, column=10, padx=5)
+
+        self.verify_copies_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Проверять копии",
+            variable=self.verify_copies_variable
+        ).grid(row=0, column=11, padx=5)
+
+        self.incremental_analysis_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Только изменения",
+            variable=self.incremental_analysis_variable
+        ).grid(row=0, column=12, padx=5)
+
+        tk.Label(control_frame, text="Дубликаты:").grid(row=0, column=13, padx=5, sticky='e')
+        self.duplicate_action_variable = tk.StringVar(value="не искать")
+        tk.OptionMenu(
+            control_frame,
+            self.duplicate_action_variable,
+            *DUPLICATE_ACTION_LABELS
+        ).grid(row=0, column=14, padx=5)
+
+        self.profile_run_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Профилирование",
+            variable=self.profile_run_variable
+        ).grid(row=0, column=15, padx=5)
+
+        # Для сетевых дисков: число потоков - начальное, дальше подбирается по задержкам
+        self.adaptive_concurrency_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Подбирать потоки",
+            variable=self.adaptive_concurrency_variable
+        ).grid(row=0, column=16, padx=5)
+
+        self.group_shots_variable = tk.BooleanVar(value=True)
+        tk.Checkbutton(
+            control_frame,
+            text="RAW+JPEG вместе",
+            variable=self.group_shots_variable
+        ).grid(row=0, column=17, padx=5)
+
+        # Для HDD и кардридеров: файлы читаются по месту на диске, а не по именам
+        self.disk_order_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Порядок диска",
+            variable=self.disk_order_variable
+        ).grid(row=0, column=18, padx=5)
+
+        self.scan_archives_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Внутри ZIP/TAR",
+            variable=self.scan_archives_variable
+        ).grid(row=0, column=19, padx=5)
+
         control_frame.grid_columnconfigure(1, weight=1)
         control_frame.grid_columnconfigure(5, weight=1)
 
@@ -216,8 +352,108 @@ class PhotoProcessor:
         )
         self.stop_button.grid(row=0, column=5, padx=5)
 
+        tk.Button(
+            control_frame,
+            text="Сжать индекс",
+            command=self.compact_metadata_index
+        ).grid(row=0, column=6, padx=5)
+
+        tk.Button(
+            control_frame,
+            text="Перестроить индекс",
+            command=self.rebuild_metadata_index
+        ).grid(row=0, column=7, padx=5)
+
+        tk.Button(
+            control_frame,
+            text="Продолжить перемещение",
+            command=self.resume_interrupted_move
+        ).grid(row=0, column=8, padx=5)
+
+        tk.Button(
+            control_frame,
+            text="Откатить перемещение",
+            command=self.rollback_interrupted_move
+        ).grid(row=0, column=9, padx=5)
+
+        self.watch_button = tk.Button(
+            control_frame,
+            text="Наблюдать",
+            command=self.toggle_watch_mode
+        )
+        self.watch_button.grid(row=0, column=10, padx=5)
+
+        tk.Button(
+            control_frame,
+            text="Разложить по камерам",
+            command=self.partition_all_cameras
+        ).grid(row=0, column=11, padx=5)
+
+        tk.Button(
+            control_frame,
+            text="Правила...",
+            command=self.select_partition_rules
+        ).grid(row=0, column=12, padx=5)
+
+        tk.Button(
+            control_frame,
+            text="По датам",
+            command=self.sort_photos_by_date
+        ).grid(row=0, column=13, padx=5)
+
+        tk.Button(
+            control_frame,
+            text="Похожие снимки",
+            command=self.find_similar_photos
+        ).grid(row=0, column=14, padx=5)
+
         control_frame.grid_columnconfigure(1, weight=1)
 
+    def create_query_controls(self):
+        # Фильтры по индексу метаданных; модель берется из поля названия камеры
+        control_frame = tk.Frame(self.main_window)
+        control_frame.pack(fill=tk.X, padx=10, pady=5)
+
+        tk.Label(control_frame, text="Фасет:").grid(row=0, column=0, padx=5, sticky='e')
+        self.facet_variable = tk.StringVar(value=next(iter(FACET_LABELS)))
+        tk.OptionMenu(control_frame, self.facet_variable, *FACET_LABELS).grid(row=0, column=1, padx=5)
+
+        self.query_filter_entries = {}
+        for column_index, (filter_name, filter_title, entry_width) in enumerate((
+                ('make', "Производитель:", 14),
+                ('lens', "Объектив:", 18),
+                ('date_from', "Дата с:", 11),
+                ('date_to', "по:", 11),
+                ('extensions', "Расширения:", 12))):
+            tk.Label(control_frame, text=filter_title).grid(row=0, column=2 + column_index * 2, padx=5, sticky='e')
+            filter_entry = tk.Entry(control_frame, font=self.application_settings['font_style'], width=entry_width)
+            filter_entry.grid(row=0, column=3 + column_index * 2, padx=5)
+            self.query_filter_entries[filter_name] = filter_entry
+
+        tk.Button(
+            control_frame,
+            text="Посчитать",
+            command=self.count_photo_facets
+        ).grid(row=0, column=12, padx=5)
+
+        tk.Button(
+            control_frame,
+            text="Переместить найденные",
+            command=self.move_query_photos
+        ).grid(row=0, column=13, padx=5)
+
+    def build_photo_query(self):
+        query_filters = {filter_name: entry.get().strip() for filter_name, entry in self.query_filter_entries.items()}
+        return PhotoQuery(
+            self.source_directory_entry.get(),
+            model=self.camera_name_entry.get().strip(),
+            make=query_filters['make'],
+            lens=query_filters['lens'],
+            date_from=query_filters['date_from'],
+            date_to=query_filters['date_to'],
+            extensions=query_filters['extensions'].replace(',', ' ').split()
+        )
+
     def create_control_icon(self, icon_type):
         icon_size = 25
         background_color = "#333333"
@@ -278,15 +514,79 @@ class PhotoProcessor:
 
         return ImageTk.PhotoImage(icon_image)
 
+    def create_status_bar(self):
+        # Скорость и оценка оставшегося времени текущего прогона; внизу окна
+        self.status_label = tk.Label(self.main_window, text="", anchor='w', font=self.application_settings['font_style'])
+        self.status_label.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 5))
+
+    def update_status_bar(self):
+        current_time = time.monotonic()
+        if current_time - self.last_status_update_at < self.application_settings['status_update_interval_seconds']:
+            return
+        self.last_status_update_at = current_time
+        current_job = self.job_scheduler.get_current_job()
+        if current_job is not None:
+            job_title = current_job.job_name + (" (пауза)" if current_job.is_paused() else "")
+            pending_count = self.job_scheduler.get_pending_count()
+            if pending_count:
+                job_title += f", в очереди {pending_count}"
+            self.status_label.config(text=f"{job_title} | {self.photo_engine.metrics.describe_progress()}")
+        elif self.photo_engine.metrics.finished_at is not None:
+            self.status_label.config(text=self.photo_engine.metrics.describe_progress() + " - готово")
+
     def create_log_display_panel(self):
         main_panel = tk.Frame(self.main_window)
         main_panel.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
 
-        tk.Label(main_panel, text="Журнал обработки:").grid(row=0, column=0, sticky='w')
+        tk.Label(main_panel, text="Результаты анализа:").grid(row=0, column=0, sticky='w')
         tk.Label(main_panel, text="Обнаруженные модели камер:").grid(row=0, column=2, sticky='w')
+        tk.Label(main_panel, text="Просмотр:").grid(row=0, column=3, sticky='w')
+
+        # Результаты по файлам хранятся компактно и рисуются только видимые строки:
+        # журнал ниже остается для заголовков, итогов и перемещений
+        result_filter_frame = tk.Frame(main_panel)
+        result_filter_frame.grid(row=1, column=0, sticky='ew', padx=(0, 5))
+        tk.Label(result_filter_frame, text="Путь содержит:").pack(side=tk.LEFT)
+        self.result_path_filter_entry = tk.Entry(result_filter_frame, font=self.application_settings['font_style'])
+        self.result_path_filter_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        tk.Label(result_filter_frame, text="Модель:").pack(side=tk.LEFT)
+        self.result_model_filter_entry = tk.Entry(
+            result_filter_frame, font=self.application_settings['font_style'], width=20
+        )
+        self.result_model_filter_entry.pack(side=tk.LEFT, padx=5)
+        self.matched_results_only_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            result_filter_frame,
+            text="Только совпадения",
+            variable=self.matched_results_only_variable,
+            command=self.apply_result_filter
+        ).pack(side=tk.LEFT, padx=5)
+        self.error_results_only_variable = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            result_filter_frame,
+            text="Только ошибки",
+            variable=self.error_results_only_variable,
+            command=self.apply_result_filter
+        ).pack(side=tk.LEFT, padx=5)
+        self.result_count_label = tk.Label(result_filter_frame, text="")
+        self.result_count_label.pack(side=tk.LEFT, padx=5)
+        self.result_path_filter_entry.bind("<Return>", self.apply_result_filter)
+        self.result_model_filter_entry.bind("<Return>", self.apply_result_filter)
+
+        self.result_view = VirtualResultList(
+            main_panel,
+            self.result_store,
+            self.application_settings['font_style'],
+            self.application_settings['color_scheme'],
+            row_activate_callback=self.open_result_location,
+            row_select_callback=self.show_result_preview
+        )
+        self.result_view.grid(row=2, column=0, sticky='nsew', padx=(0, 5))
+
+        tk.Label(main_panel, text="Журнал обработки:").grid(row=3, column=0, sticky='w')
 
         log_frame = tk.Frame(main_panel)
-        log_frame.grid(row=1, column=0, sticky='nsew', padx=(0, 5))
+        log_frame.grid(row=4, column=0, sticky='nsew', padx=(0, 5))
 
         self.log_display_text = tk.Text(
             log_frame,
@@ -295,7 +595,8 @@ class PhotoProcessor:
             bg="white",
             font=self.application_settings['font_style'],
             padx=5,
-            pady=5
+            pady=5,
+            height=10
         )
         self.log_display_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
@@ -304,7 +605,7 @@ class PhotoProcessor:
         self.log_display_text['yscrollcommand'] = log_scrollbar.set
 
         camera_list_frame = tk.Frame(main_panel)
-        camera_list_frame.grid(row=1, column=2, sticky='nsew', padx=(5, 0))
+        camera_list_frame.grid(row=1, column=2, rowspan=4, sticky='nsew', padx=(5, 0))
 
         self.camera_models_display = tk.Text(
             camera_list_frame,
@@ -322,41 +623,48 @@ class PhotoProcessor:
         camera_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.camera_models_display['yscrollcommand'] = camera_scrollbar.set
 
+        # Миниатюра выделенного файла: размер рамки постоянный, чтобы раскладка не прыгала
+        thumbnail_size = self.application_settings['thumbnail_size']
+        preview_frame = tk.Frame(main_panel)
+        preview_frame.grid(row=1, column=3, rowspan=4, sticky='n', padx=(5, 0))
+        preview_image_frame = tk.Frame(preview_frame, width=thumbnail_size, height=thumbnail_size, bg="#f0f0f0")
+        preview_image_frame.pack_propagate(False)
+        preview_image_frame.pack()
+        self.preview_image_label = tk.Label(preview_image_frame, bg="#f0f0f0")
+        self.preview_image_label.pack(fill=tk.BOTH, expand=True)
+        self.preview_caption_label = tk.Label(
+            preview_frame,
+            text="",
+            justify=tk.LEFT,
+            anchor='w',
+            wraplength=thumbnail_size,
+            font=self.application_settings['font_style']
+        )
+        self.preview_caption_label.pack(fill=tk.X, pady=(5, 0))
+
         self.camera_models_display.bind("<Button-1>", self.select_camera_model_from_list)
         self.log_display_text.bind("<Double-1>", self.open_file_location)
 
-        main_panel.grid_rowconfigure(1, weight=1)
+        main_panel.grid_rowconfigure(2, weight=3)
+        main_panel.grid_rowconfigure(4, weight=1)
         main_panel.grid_columnconfigure(0, weight=1)
         main_panel.grid_columnconfigure(2, weight=0)
+        main_panel.grid_columnconfigure(3, weight=0)
 
     def select_directory(self, entry_widget):
         selected_directory = filedialog.askdirectory()
         if selected_directory:
             entry_widget.delete(0, tk.END)
             entry_widget.insert(0, selected_directory)
+        return selected_directory
 
-    def start_photo_analysis(self):
-        if self.analysis_thread and self.analysis_thread.is_alive():
-            messagebox.showwarning("Внимание", "Анализ уже выполняется.")
-            return
-        self.processing_paused = False
-        self.processing_stopped = False
-        self.analysis_thread = threading.Thread(target=self.process_photo_collection)
-        self.analysis_thread.start()
-
-    def toggle_processing_pause(self):
-        self.processing_paused = not self.processing_paused
-        if self.processing_paused:
-            self.pause_button.config(text=" Продолжить")
-        else:
-            self.pause_button.config(text=" Пауза")
-
-    def stop_photo_processing(self):
-        self.processing_stopped = True
-        self.processing_paused = False
-        self.pause_button.config(text=" Пауза")
+    def select_source_directory(self):
+        selected_directory = self.select_directory(self.source_directory_entry)
+        if selected_directory:
+            # Для HDD меньше потоков, для SSD и сетевых дисков - больше
+            self.worker_count_variable.set(suggest_worker_count(selected_directory))
 
-    def process_photo_collection(self):
+    def start_photo_analysis(self):
         source_directory = self.source_directory_entry.get()
         target_directory = self.target_directory_entry.get()
         camera_name_to_find = self.camera_name_entry.get().strip()
@@ -368,46 +676,158 @@ class PhotoProcessor:
         if not self.validate_directory_paths(source_directory, target_directory):
             return
 
+        self.submit_engine_job(
+            "Анализ", self.process_photo_collection,
+            source_directory, camera_name_to_find, self.incremental_analysis_variable.get()
+        )
+
+    def toggle_processing_pause(self):
+        current_job = self.job_scheduler.get_current_job()
+        if current_job is None:
+            return
+        if current_job.is_paused():
+            current_job.resume()
+        else:
+            current_job.pause()
+        self.refresh_job_controls()
+
+    def stop_photo_processing(self):
+        # Отменяются и текущее задание, и все ожидающие в очереди
+        self.job_scheduler.cancel_all()
+        self.refresh_job_controls()
+
+    def read_engine_settings(self):
+        # Настройки читаются из виджетов в главном потоке при постановке задания в очередь
+        return {
+            'worker_count': self.worker_count_variable.get(),
+            'use_processes': self.use_processes_variable.get(),
+            'verify_copies': self.verify_copies_variable.get(),
+            'save_manifest': self.save_manifest_variable.get(),
+            'duplicate_action': DUPLICATE_ACTION_LABELS[self.duplicate_action_variable.get()],
+            'profile_mode': 'sampling' if self.profile_run_variable.get() else None,
+            'adaptive_concurrency': self.adaptive_concurrency_variable.get(),
+            'group_shots': self.group_shots_variable.get(),
+            'disk_order': self.disk_order_variable.get(),
+            'scan_archives': self.scan_archives_variable.get()
+        }
+
+    def submit_engine_job(self, job_name, perform_function, *arguments):
+        # Задание может ждать в очереди, поэтому настройки движка применяются при его запуске,
+        # а не при нажатии кнопки - иначе они изменились бы посреди предыдущего задания
+        if self.job_scheduler.is_busy():
+            self.add_log_message(f"Задание '{job_name}' поставлено в очередь", 'warning_text')
+        engine_settings = self.read_engine_settings()
+
+        def run_engine_job(job):
+            for setting_name, setting_value in engine_settings.items():
+                setattr(self.photo_engine, setting_name, setting_value)
+            return perform_function(job, *arguments)
+
+        return self.job_scheduler.submit(job_name, run_engine_job)
+
+    def handle_job_change(self, job):
+        # Вызывается из потока планировщика при запуске и завершении задания
+        if job.is_done():
+            status_tag = {'finished': 'header_text', 'cancelled': 'warning_text', 'failed': 'error_text'}[job.state]
+            self.add_log_message(f"Задание {job.describe()}", status_tag)
+            if isinstance(job.error, UnfinishedJournalError):
+                # Журнал мог появиться, пока задание ждало в очереди
+                self.run_on_ui_thread(lambda: messagebox.showerror("Перемещение", str(job.error)))
+        self.run_on_ui_thread(self.refresh_job_controls)
+
+    def check_no_unfinished_move(self):
+        # Новое перемещение не начинается поверх журнала прерванного - иначе его уже не откатить
+        if not MoveJournal.exists(self.photo_engine.journal_path):
+            return True
+        messagebox.showerror(
+            "Перемещение",
+            "Есть незавершенное перемещение.\nСначала нажмите \"Продолжить перемещение\" или \"Откатить перемещение\"."
+        )
+        return False
+
+    def refresh_job_controls(self):
+        current_job = self.job_scheduler.get_current_job()
+        if current_job is not None and current_job.is_paused():
+            self.pause_button.config(text=" Продолжить")
+        else:
+            self.pause_button.config(text=" Пауза")
+        if self.watch_job is not None and not self.watch_job.is_done():
+            self.watch_button.config(text="Остановить наблюдение")
+        else:
+            self.watch_button.config(text="Наблюдать")
+
+    def process_photo_collection(self, job, source_directory, camera_name_to_find, incremental_analysis):
         self.clear_log_messages()
+        self.result_store.clear()
         self.add_log_message(f"=== ПОИСК ФОТОГРАФИЙ КАМЕРЫ: {camera_name_to_find.upper()} ===", 'header_text')
 
         total_photos_processed = 0
         matching_photos_found = 0
 
-        for root_directory, _, files in os.walk(source_directory):
-            while self.processing_paused:
-                time.sleep(0.1)
-            if self.processing_stopped:
-                self.add_log_message("\n=== АНАЛИЗ ПРЕРВАН ===", 'error_text')
-                return
-            for filename in files:
-                if self.is_valid_image_file(filename):
-                    total_photos_processed += 1
-                    full_file_path = os.path.join(root_directory, filename)
-                    relative_file_path = os.path.relpath(full_file_path, source_directory)
-
-                    try:
-                        camera_model = self.extract_camera_model(full_file_path)
-                        if camera_model:
-                            if camera_model not in self.unique_camera_models:
-                                self.unique_camera_models.add(camera_model)
-                                self.add_camera_model_to_list(camera_model)
-                            if camera_name_to_find.lower() in camera_model.lower():
-                                self.add_log_message(f"{relative_file_path} - ", 'match_text', end='')
-                                self.add_log_message(f"{camera_model}", 'camera_model_text')
-                                matching_photos_found += 1
-                            else:
-                                self.add_log_message(f"{relative_file_path} - ", 'normal_text', end='')
-                                self.add_log_message(f"{camera_model}", 'camera_model_text')
-                        else:
-                            self.add_log_message(f"{relative_file_path} - Модель камеры не определена", 'normal_text')
-                    except Exception as error:
-                        self.add_log_message(f"ОШИБКА: {relative_file_path} - {str(error)}", 'error_text')
-
+        analyze = self.photo_engine.analyze
+        if incremental_analysis:
+            analyze = self.photo_engine.analyze_incremental
+        analysis_results = analyze(
+            source_directory,
+            camera_name_to_find,
+            should_stop=job.should_stop,
+            wait_while_paused=job.wait_while_paused
+        )
+        for analysis_result in analysis_results:
+            total_photos_processed += 1
+            job.report_progress(analysis_result.error)
+            self.log_analysis_result(analysis_result)
+            matching_photos_found += analysis_result.matched
+
+        if job.should_stop():
+            self.add_log_message("\n=== АНАЛИЗ ПРЕРВАН ===", 'error_text')
+            return None
         self.add_log_message("\n=== РЕЗУЛЬТАТЫ АНАЛИЗА ===", 'header_text')
         self.add_log_message(f"Всего обработано фотографий: {total_photos_processed}", 'header_text')
         status_tag = 'match_text' if matching_photos_found > 0 else 'normal_text'
         self.add_log_message(f"Найдено соответствующих фотографий: {matching_photos_found}", status_tag)
+        return f"найдено {matching_photos_found}"
+
+    def log_analysis_result(self, analysis_result):
+        # Строки по файлам идут в компактное хранилище результатов, а не в журнал
+        camera_model = analysis_result.camera_model
+        if camera_model and camera_model not in self.unique_camera_models:
+            self.unique_camera_models.add(camera_model)
+            self.add_camera_model_to_list(camera_model)
+        self.result_store.add(
+            analysis_result.relative_path, camera_model, analysis_result.matched, analysis_result.error
+        )
+
+    def apply_result_filter(self, event=None):
+        self.result_view.set_filter(
+            text=self.result_path_filter_entry.get().strip(),
+            camera_model=self.result_model_filter_entry.get().strip(),
+            matched_only=self.matched_results_only_variable.get(),
+            errors_only=self.error_results_only_variable.get()
+        )
+
+    def toggle_watch_mode(self):
+        if self.watch_job is not None and not self.watch_job.is_done():
+            self.watch_job.cancel()
+            return
+        source_directory = self.source_directory_entry.get()
+        if not os.path.isdir(source_directory):
+            self.add_log_message(f"ОШИБКА: Исходная папка не существует!\n{source_directory}", 'error_text')
+            return
+        # Наблюдение - обычное задание: следующие задания ждут в очереди, пока его не остановят
+        self.watch_job = self.submit_engine_job(
+            "Наблюдение", self.process_watch_events, source_directory, self.camera_name_entry.get().strip()
+        )
+        self.refresh_job_controls()
+
+    def process_watch_events(self, job, source_directory, camera_name):
+        self.add_log_message(f"=== НАБЛЮДЕНИЕ ЗА ПАПКОЙ: {source_directory} ===", 'header_text')
+        try:
+            for watch_event in self.photo_engine.watch(source_directory, camera_name, job.cancel_event):
+                job.report_progress(watch_event.result.error)
+                self.log_analysis_result(watch_event.result)
+        finally:
+            self.add_log_message("=== НАБЛЮДЕНИЕ ОСТАНОВЛЕНО ===", 'header_text')
 
     def move_matching_photos(self):
         source_directory = self.source_directory_entry.get()
@@ -421,61 +841,429 @@ class PhotoProcessor:
         if not self.validate_directory_paths(source_directory, base_target_directory):
             return
 
-        # Проверяем существование папки и добавляем "!" при необходимости
-        target_directory = os.path.join(base_target_directory, camera_name_to_move)
-        counter = 1
-        while os.path.exists(target_directory):
-            target_directory = os.path.join(base_target_directory, f"{camera_name_to_move}_{counter}")
-            counter += 1
+        # Повторное перемещение той же камеры из той же папки сначала доделывает прерванное
+        # и продолжает в его папку, а не в новую _N
+        target_directory = find_unfinished_move_target(
+            base_target_directory, camera_name_to_move, self.photo_engine.journal_path, source_directory
+        )
+        resume_unfinished = target_directory is not None
+        if not resume_unfinished:
+            if not self.check_no_unfinished_move():
+                return
+            target_directory = resolve_move_target_directory(base_target_directory, camera_name_to_move)
 
         confirmation_message = (
             f"Вы уверены, что хотите переместить все фотографии камеры '{camera_name_to_move}'?\n"
             f"Из: {source_directory}\n"
             f"В: {target_directory}"
         )
+        if resume_unfinished:
+            confirmation_message += "\n\nСначала будет доделано прерванное перемещение в эту папку."
         if not messagebox.askyesno("Подтверждение", confirmation_message):
             return
 
+        self.submit_engine_job(
+            "Перемещение", self.perform_photo_move, source_directory, target_directory, camera_name_to_move,
+            resume_unfinished
+        )
+
+    def perform_photo_move(self, job, source_directory, target_directory, camera_name_to_move, resume_unfinished=False):
         self.clear_log_messages()
         self.add_log_message(f"=== ПЕРЕМЕЩЕНИЕ ФОТОГРАФИЙ КАМЕРЫ: {camera_name_to_move.upper()} ===", 'header_text')
         self.add_log_message(f"Фотографии будут перемещены в: {target_directory}", 'header_text')
 
+        if resume_unfinished:
+            self.add_log_message("Продолжение прерванного перемещения:", 'header_text')
+            self.log_move_journal_results(job, resume=True)
+            if MoveJournal.exists(self.photo_engine.journal_path):
+                self.add_log_message(
+                    "Прерванное перемещение не завершено: продолжите или откатите его", 'error_text'
+                )
+                return "прерванное перемещение не завершено"
+
         successfully_moved_count = 0
+        skipped_duplicate_count = 0
         error_count = 0
 
-        for root_directory, _, files in os.walk(source_directory):
-            for filename in files:
-                if self.is_valid_image_file(filename):
-                    full_file_path = os.path.join(root_directory, filename)
-                    relative_file_path = os.path.relpath(full_file_path, source_directory)
+        move_results = self.photo_engine.move(
+            source_directory, target_directory, camera_name_to_move,
+            should_stop=job.should_stop,
+            wait_while_paused=job.wait_while_paused
+        )
+        for move_result in move_results:
+            job.report_progress(move_result.error)
+            relative_file_path = os.path.relpath(move_result.source_path, source_directory)
 
-                    try:
-                        camera_model = self.extract_camera_model(full_file_path)
-                        if camera_model and camera_name_to_move.lower() in camera_model.lower():
-                            # Сохраняем структуру подпапок внутри целевой папки
-                            target_relative_path = os.path.join(os.path.basename(target_directory), relative_file_path)
-                            full_target_path = os.path.join(base_target_directory, target_relative_path)
+            if move_result.error is not None:
+                self.add_log_message(f"ОШИБКА ПЕРЕМЕЩЕНИЯ {relative_file_path}: {str(move_result.error)}", 'error_text')
+                error_count += 1
+                continue
 
-                            os.makedirs(os.path.dirname(full_target_path), exist_ok=True)
+            if move_result.method == 'duplicate':
+                self.add_log_message(
+                    f"Дубликат пропущен: {relative_file_path} (уже есть {move_result.target_path})", 'warning_text'
+                )
+                skipped_duplicate_count += 1
+                continue
 
-                            shutil.move(full_file_path, full_target_path)
-                            self.add_log_message(f"Успешно перемещено: {relative_file_path}", 'success_text')
-                            successfully_moved_count += 1
-                    except Exception as error:
-                        self.add_log_message(f"ОШИБКА ПЕРЕМЕЩЕНИЯ {relative_file_path}: {str(error)}", 'error_text')
-                        error_count += 1
+            self.add_log_message(f"Успешно перемещено: {relative_file_path}", 'success_text')
+            successfully_moved_count += 1
 
         self.add_log_message("\n=== ИТОГИ ПЕРЕМЕЩЕНИЯ ===", 'header_text')
         self.add_log_message(f"Успешно перемещено фотографий: {successfully_moved_count}", 'success_text')
+        if skipped_duplicate_count:
+            self.add_log_message(f"Пропущено дубликатов: {skipped_duplicate_count}", 'warning_text')
         status_tag = 'error_text' if error_count > 0 else 'normal_text'
         self.add_log_message(f"Ошибок при перемещении: {error_count}", status_tag)
 
         if successfully_moved_count > 0:
-            messagebox.showinfo(
+            self.run_on_ui_thread(lambda: messagebox.showinfo(
                 "Завершено",
                 f"Успешно перемещено {successfully_moved_count} фотографий камеры {camera_name_to_move}\n"
                 f"в папку: {target_directory}"
+            ))
+        return f"перемещено {successfully_moved_count}"
+
+    def count_photo_facets(self):
+        if not os.path.isdir(self.source_directory_entry.get()):
+            self.add_log_message(f"ОШИБКА: Исходная папка не существует!\n{self.source_directory_entry.get()}", 'error_text')
+            return
+        facet_title = self.facet_variable.get()
+        photo_query = self.build_photo_query()
+        self.job_scheduler.submit(
+            "Подсчет фасета",
+            lambda job: self.perform_facet_count(job, FACET_LABELS[facet_title], facet_title, photo_query)
+        )
+
+    def perform_facet_count(self, job, facet_name, facet_title, photo_query):
+        # Считается по индексу без чтения файлов, поэтому без паузы и прогресса
+        started_at = time.perf_counter()
+        facet_counts = count_facet(self.photo_engine.metadata_index, facet_name, photo_query)
+        self.replace_camera_model_list(
+            [f"{facet_count.value} ({facet_count.count})" for facet_count in facet_counts if facet_count.value]
+        )
+        self.add_log_message(
+            f"Фасет '{facet_title}' ({photo_query.describe()}): значений {len(facet_counts)}, "
+            f"файлов {sum(facet_count.count for facet_count in facet_counts)}, "
+            f"{(time.perf_counter() - started_at) * 1000:.1f} мс",
+            'header_text'
+        )
+
+    def find_similar_photos(self):
+        source_directory = self.source_directory_entry.get()
+        if not os.path.isdir(source_directory):
+            self.add_log_message(f"ОШИБКА: Исходная папка не существует!\n{source_directory}", 'error_text')
+            return
+        self.submit_engine_job("Поиск похожих", self.perform_similar_search, source_directory)
+
+    def perform_similar_search(self, job, source_directory):
+        self.add_log_message("=== ПОИСК ПОХОЖИХ СНИМКОВ ===", 'header_text')
+        similar_groups, errors = self.photo_engine.find_similar_images(
+            source_directory, DEFAULT_MAX_DISTANCE, should_stop=job.should_stop, wait_while_paused=job.wait_while_paused
+        )
+        for _, error in errors:
+            job.report_progress(error)
+        if not job.should_stop():
+            self.run_on_ui_thread(lambda: self.show_similar_groups(source_directory, similar_groups))
+        return f"групп {len(similar_groups)}, снимков в них {sum(len(group.file_paths) for group in similar_groups)}"
+
+    def show_similar_groups(self, source_directory, similar_groups):
+        # Группы похожих - дерево в отдельном окне; выбранный файл показывается в панели просмотра
+        if self.similar_groups_window is not None and self.similar_groups_window.winfo_exists():
+            self.similar_groups_window.destroy()
+        self.similar_groups_window = tk.Toplevel(self.main_window)
+        self.similar_groups_window.title(f"Похожие снимки: групп {len(similar_groups)}")
+        self.similar_groups_window.geometry("700x500")
+
+        button_frame = tk.Frame(self.similar_groups_window)
+        button_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Button(
+            button_frame,
+            text="Сохранить CSV...",
+            command=lambda: self.export_similar_groups(similar_groups)
+        ).pack(side=tk.LEFT)
+        tk.Label(button_frame, text=source_directory).pack(side=tk.LEFT, padx=10)
+
+        tree_frame = tk.Frame(self.similar_groups_window)
+        tree_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        group_tree = ttk.Treeview(tree_frame, columns=('distance',), selectmode='browse')
+        group_tree.heading('#0', text="Снимок")
+        group_tree.heading('distance', text="Различие, бит")
+        group_tree.column('distance', width=110, stretch=False, anchor='center')
+        group_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        tree_scrollbar = tk.Scrollbar(tree_frame, command=group_tree.yview)
+        tree_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        group_tree['yscrollcommand'] = tree_scrollbar.set
+
+        file_paths_by_item = {}
+        for group_number, similar_group in enumerate(similar_groups, 1):
+            group_item = group_tree.insert(
+                '', tk.END, text=f"Группа {group_number}: снимков {len(similar_group.file_paths)}",
+                values=(f"до {similar_group.max_distance}",), open=group_number == 1
             )
+            for file_path in similar_group.file_paths:
+                file_item = group_tree.insert(group_item, tk.END, text=os.path.relpath(file_path, source_directory))
+                file_paths_by_item[file_item] = file_path
+
+        def preview_selected_file(event):
+            selected_items = group_tree.selection()
+            if selected_items and selected_items[0] in file_paths_by_item:
+                # Остальные снимки группы загружаются заранее - их обычно смотрят следом
+                sibling_paths = [
+                    file_paths_by_item[sibling_item]
+                    for sibling_item in group_tree.get_children(group_tree.parent(selected_items[0]))
+                ]
+                file_path = file_paths_by_item[selected_items[0]]
+                self.show_file_preview(
+                    file_path, group_tree.item(selected_items[0], 'text'),
+                    [sibling_path for sibling_path in sibling_paths if sibling_path != file_path]
+                )
+
+        def open_selected_file(event):
+            selected_items = group_tree.selection()
+            if selected_items and selected_items[0] in file_paths_by_item:
+                self.open_containing_directory(file_paths_by_item[selected_items[0]])
+
+        group_tree.bind("<<TreeviewSelect>>", preview_selected_file)
+        group_tree.bind("<Double-1>", open_selected_file)
+
+    def export_similar_groups(self, similar_groups):
+        csv_path = filedialog.asksaveasfilename(
+            parent=self.similar_groups_window, defaultextension=".csv", filetypes=[("CSV", "*.csv")]
+        )
+        if not csv_path:
+            return
+        try:
+            write_similar_groups_csv(similar_groups, csv_path)
+        except OSError as error:
+            self.add_log_message(f"ОШИБКА: не удалось сохранить {csv_path} - {str(error)}", 'error_text')
+            return
+        self.add_log_message(f"Группы похожих снимков сохранены: {csv_path}", 'success_text')
+
+    def move_query_photos(self):
+        source_directory = self.source_directory_entry.get()
+        target_directory = self.target_directory_entry.get()
+        if not self.validate_directory_paths(source_directory, target_directory):
+            return
+        if not self.check_no_unfinished_move():
+            return
+        photo_query = self.build_photo_query()
+
+        confirmation_message = (
+            f"Переместить найденные фотографии ({photo_query.describe()})?\n"
+            f"Из: {source_directory}\n"
+            f"В: {target_directory}"
+        )
+        if not messagebox.askyesno("Подтверждение", confirmation_message):
+            return
+
+        self.submit_engine_job(
+            "Перемещение по запросу", self.perform_query_move, source_directory, target_directory, photo_query
+        )
+
+    def perform_query_move(self, job, source_directory, target_directory, photo_query):
+        self.clear_log_messages()
+        self.add_log_message(f"=== ПЕРЕМЕЩЕНИЕ ПО ЗАПРОСУ: {photo_query.describe()} ===", 'header_text')
+        successfully_moved_count = 0
+        error_count = 0
+        try:
+            move_results = self.photo_engine.move_query(
+                source_directory, target_directory, photo_query,
+                should_stop=job.should_stop,
+                wait_while_paused=job.wait_while_paused
+            )
+            for move_result in move_results:
+                job.report_progress(move_result.error)
+                if move_result.error is not None:
+                    self.add_log_message(f"ОШИБКА ПЕРЕМЕЩЕНИЯ {move_result.source_path}: {str(move_result.error)}", 'error_text')
+                    error_count += 1
+                    continue
+                if move_result.method == 'duplicate':
+                    self.add_log_message(
+                        f"Дубликат пропущен: {move_result.source_path} (уже есть {move_result.target_path})", 'warning_text'
+                    )
+                    continue
+                self.add_log_message(f"{move_result.source_path} → {move_result.target_path}", 'success_text')
+                successfully_moved_count += 1
+        except ValueError as error:
+            self.add_log_message(f"ОШИБКА: {str(error)}", 'error_text')
+            return None
+
+        self.add_log_message("\n=== ИТОГИ ПЕРЕМЕЩЕНИЯ ===", 'header_text')
+        self.add_log_message(f"Успешно перемещено фотографий: {successfully_moved_count}", 'success_text')
+        status_tag = 'error_text' if error_count > 0 else 'normal_text'
+        self.add_log_message(f"Ошибок при перемещении: {error_count}", status_tag)
+        return f"перемещено {successfully_moved_count}"
+
+    def select_partition_rules(self):
+        rules_path = filedialog.askopenfilename(filetypes=[("Правила раскладки", "*.json"), ("Все файлы", "*.*")])
+        if not rules_path:
+            return
+        try:
+            PartitionRuleSet.load(rules_path)
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Ошибка", f"Не удалось загрузить правила:\n{str(error)}")
+            return
+        self.partition_rules_path = rules_path
+        self.add_log_message(f"Правила раскладки: {rules_path}", 'header_text')
+
+    def partition_all_cameras(self):
+        source_directory = self.source_directory_entry.get()
+        target_directory = self.target_directory_entry.get()
+        if not self.validate_directory_paths(source_directory, target_directory):
+            return
+        if not self.check_no_unfinished_move():
+            return
+        try:
+            rule_set = PartitionRuleSet.load(self.partition_rules_path) if self.partition_rules_path else PartitionRuleSet()
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Ошибка", f"Не удалось загрузить правила:\n{str(error)}")
+            return
+
+        confirmation_message = (
+            "Разложить фотографии всех камер по папкам "
+            + ("по правилам?\n" if self.partition_rules_path else "<модель камеры>?\n")
+            + f"Из: {source_directory}\nВ: {target_directory}"
+        )
+        if not messagebox.askyesno("Подтверждение", confirmation_message):
+            return
+
+        self.submit_engine_job("Раскладка", self.perform_partition, source_directory, target_directory, rule_set)
+
+    def perform_partition(self, job, source_directory, target_directory, rule_set):
+        self.clear_log_messages()
+        self.add_log_message("=== РАСКЛАДКА ФОТОГРАФИЙ ПО КАМЕРАМ ===", 'header_text')
+        moved_count_by_directory = {}
+        error_count = 0
+        try:
+            move_results = self.photo_engine.partition(
+                source_directory, target_directory, rule_set,
+                should_stop=job.should_stop,
+                wait_while_paused=job.wait_while_paused
+            )
+            for move_result in move_results:
+                job.report_progress(move_result.error)
+                relative_file_path = os.path.relpath(move_result.source_path, source_directory)
+                if move_result.error is not None:
+                    self.add_log_message(f"ОШИБКА ПЕРЕМЕЩЕНИЯ {relative_file_path}: {str(move_result.error)}", 'error_text')
+                    error_count += 1
+                    continue
+                if move_result.method == 'duplicate':
+                    self.add_log_message(
+                        f"Дубликат пропущен: {relative_file_path} (уже есть {move_result.target_path})", 'warning_text'
+                    )
+                    continue
+                destination = os.path.relpath(move_result.target_path, target_directory)
+                self.add_log_message(f"{relative_file_path} → {destination}", 'success_text')
+                destination_root = destination.split(os.sep, 1)[0]
+                moved_count_by_directory[destination_root] = moved_count_by_directory.get(destination_root, 0) + 1
+        except ValueError as error:
+            self.add_log_message(f"ОШИБКА: {str(error)}", 'error_text')
+            return None
+
+        self.add_log_message("\n=== ИТОГИ РАСКЛАДКИ ===", 'header_text')
+        for destination_root, moved_count in sorted(moved_count_by_directory.items()):
+            self.add_log_message(f"{destination_root}: {moved_count}", 'success_text')
+        status_tag = 'error_text' if error_count > 0 else 'normal_text'
+        self.add_log_message(f"Ошибок при перемещении: {error_count}", status_tag)
+        return f"перемещено {sum(moved_count_by_directory.values())}"
+
+    def sort_photos_by_date(self):
+        source_directory = self.source_directory_entry.get()
+        target_directory = self.target_directory_entry.get()
+        if not self.validate_directory_paths(source_directory, target_directory):
+            return
+        confirmation_message = (
+            "Разложить фотографии по папкам ГГГГ/ММ/ДД по дате съемки?\n"
+            f"Из: {source_directory}\nВ: {target_directory}"
+        )
+        if not messagebox.askyesno("Подтверждение", confirmation_message):
+            return
+        self.submit_engine_job("Сортировка по датам", self.perform_date_sort, source_directory, target_directory)
+
+    def perform_date_sort(self, job, source_directory, target_directory):
+        self.clear_log_messages()
+        self.add_log_message("=== СОРТИРОВКА ФОТОГРАФИЙ ПО ДАТАМ ===", 'header_text')
+        date_sorter = DateSorter(
+            target_directory,
+            worker_count=self.photo_engine.worker_count,
+            verify_copies=self.photo_engine.verify_copies
+        )
+        status_counts = {}
+        sort_results = date_sorter.sort(
+            source_directory, should_stop=job.should_stop, wait_while_paused=job.wait_while_paused
+        )
+        for sort_result in sort_results:
+            job.report_progress(sort_result.message if sort_result.status == 'error' else None)
+            status_counts[sort_result.status] = status_counts.get(sort_result.status, 0) + 1
+            relative_file_path = os.path.relpath(sort_result.source_path, source_directory)
+            if sort_result.status == 'error':
+                self.add_log_message(f"ОШИБКА ПЕРЕМЕЩЕНИЯ {relative_file_path}: {sort_result.message}", 'error_text')
+            elif sort_result.status == 'moved':
+                destination = os.path.relpath(sort_result.target_path, target_directory)
+                self.add_log_message(f"{relative_file_path} → {destination}", 'success_text')
+            elif sort_result.status == 'unsupported':
+                self.add_log_message(f"{relative_file_path} - {sort_result.message}", 'normal_text')
+            else:
+                self.add_log_message(f"{relative_file_path} - дата съемки не определена", 'normal_text')
+
+        self.add_log_message("\n=== ИТОГИ СОРТИРОВКИ ===", 'header_text')
+        self.add_log_message(f"Перемещено: {status_counts.get('moved', 0)}", 'success_text')
+        self.add_log_message(f"Без даты: {status_counts.get('unchanged', 0)}", 'normal_text')
+        if status_counts.get('unsupported'):
+            self.add_log_message(
+                f"Формат не поддерживается (видео, HEIC, DNG...): {status_counts['unsupported']}", 'normal_text'
+            )
+        status_tag = 'error_text' if status_counts.get('error') else 'normal_text'
+        self.add_log_message(f"Ошибок при перемещении: {status_counts.get('error', 0)}", status_tag)
+        return f"перемещено {status_counts.get('moved', 0)}, без даты {status_counts.get('unchanged', 0)}"
+
+    def resume_interrupted_move(self):
+        self.start_move_journal_processing(resume=True)
+
+    def rollback_interrupted_move(self):
+        self.start_move_journal_processing(resume=False)
+
+    def start_move_journal_processing(self, resume):
+        if not MoveJournal.exists():
+            messagebox.showinfo("Перемещение", "Незавершенных перемещений нет.")
+            return
+        if not resume and not messagebox.askyesno(
+                "Подтверждение", "Вернуть все уже перемещенные файлы на исходные места?"):
+            return
+        self.submit_engine_job(
+            "Продолжение перемещения" if resume else "Откат перемещения", self.process_move_journal, resume
+        )
+
+    def process_move_journal(self, job, resume):
+        self.clear_log_messages()
+        if resume:
+            self.add_log_message("=== ПРОДОЛЖЕНИЕ ПРЕРВАННОГО ПЕРЕМЕЩЕНИЯ ===", 'header_text')
+        else:
+            self.add_log_message("=== ОТКАТ ПРЕРВАННОГО ПЕРЕМЕЩЕНИЯ ===", 'header_text')
+
+        error_count = self.log_move_journal_results(job, resume)
+
+        if job.should_stop():
+            self.add_log_message("\nОстановлено. Журнал сохранен, перемещение можно продолжить", 'warning_text')
+        elif error_count == 0:
+            self.add_log_message("\nЖурнал перемещения закрыт", 'header_text')
+        else:
+            self.add_log_message(f"\nОшибок: {error_count}. Журнал сохранен для повторной попытки", 'error_text')
+
+    def log_move_journal_results(self, job, resume):
+        error_count = 0
+        move_results = self.photo_engine.process_move_journal(
+            resume, should_stop=job.should_stop, wait_while_paused=job.wait_while_paused
+        )
+        for move_result in move_results:
+            job.report_progress(move_result.error)
+            if move_result.error is not None:
+                self.add_log_message(f"ОШИБКА ПЕРЕМЕЩЕНИЯ {move_result.source_path}: {str(move_result.error)}", 'error_text')
+                error_count += 1
+                continue
+            self.add_log_message(f"{move_result.source_path} → {move_result.target_path}", 'success_text')
+        return error_count
 
     def validate_directory_paths(self, source_path, target_path):
         if not os.path.isdir(source_path):
@@ -486,49 +1274,123 @@ class PhotoProcessor:
             return False
         return True
 
-    def is_valid_image_file(self, filename):
-        valid_extensions = ('.jpg', '.jpeg', '.tiff', '.png', '.nef', '.cr2', '.arw', '.raf', '.raw')
-        return filename.lower().endswith(valid_extensions)
+    def compact_metadata_index(self):
+        self.job_scheduler.submit("Сжатие индекса", self.perform_index_compaction)
 
-    def extract_camera_model(self, image_path):
-        try:
-            with Image.open(image_path) as image:
-                exif_data = image._getexif()
-                if exif_data:
-                    for tag_id, value in exif_data.items():
-                        if TAGS.get(tag_id) == "Model" and value:
-                            return str(value).strip()
-        except Exception:
-            return None
-        return None
+    def perform_index_compaction(self, job):
+        removed_count = self.photo_engine.metadata_index.compact()
+        self.add_log_message(
+            f"Индекс сжат: удалено записей {removed_count}, осталось {self.photo_engine.metadata_index.entry_count()}",
+            'header_text'
+        )
 
+    def rebuild_metadata_index(self):
+        source_directory = self.source_directory_entry.get()
+        if not os.path.isdir(source_directory):
+            self.add_log_message(f"ОШИБКА: Исходная папка не существует!\n{source_directory}", 'error_text')
+            return
+        # Задания выполняются по порядку: анализ начнется после очистки индекса
+        self.job_scheduler.submit(
+            "Очистка индекса", lambda job: self.photo_engine.metadata_index.invalidate_directory(source_directory)
+        )
+        self.start_photo_analysis()
+
+    # Виджеты меняются только в главном потоке: рабочие потоки кладут
+    # изменения в очередь, а flush_ui_updates применяет их пачками
     def add_log_message(self, message, tag='normal_text', end='\n'):
-        self.log_display_text.config(state=tk.NORMAL)
-        self.log_display_text.insert(tk.END, message, tag)
-        if end:
-            self.log_display_text.insert(tk.END, end)
-        self.log_display_text.config(state=tk.DISABLED)
-        self.log_display_text.see(tk.END)
-        self.main_window.update()
+        self.ui_update_queue.put(('log', message + end if end else message, tag))
 
     def clear_log_messages(self):
-        self.log_display_text.config(state=tk.NORMAL)
-        self.log_display_text.delete(1.0, tk.END)
-        self.log_display_text.config(state=tk.DISABLED)
+        self.ui_update_queue.put(('clear', None, None))
 
     def add_camera_model_to_list(self, model_name):
-        self.camera_models_display.config(state=tk.NORMAL)
-        self.camera_models_display.insert(tk.END, model_name + '\n')
-        self.camera_models_display.config(state=tk.DISABLED)
+        self.ui_update_queue.put(('camera', model_name + '\n', None))
+
+    def replace_camera_model_list(self, lines):
+        # Список моделей заменяется результатом фасета; новый анализ снова добавит модели
+        self.unique_camera_models = set()
+        self.ui_update_queue.put(('camera_list', ''.join(line + '\n' for line in lines), None))
+
+    def run_on_ui_thread(self, callback):
+        self.ui_update_queue.put(('callback', callback, None))
+
+    def flush_ui_updates(self):
+        flush_started_at = time.perf_counter()
+        log_chunks = []
+        camera_chunks = []
+        callbacks = []
+        for _ in range(self.application_settings['log_flush_batch_size']):
+            try:
+                update_kind, payload, tag = self.ui_update_queue.get_nowait()
+            except queue.Empty:
+                break
+            if update_kind == 'log':
+                log_chunks.extend((payload, tag))
+            elif update_kind == 'camera':
+                camera_chunks.append(payload)
+            elif update_kind == 'camera_list':
+                camera_chunks = [payload]
+                self.camera_models_display.config(state=tk.NORMAL)
+                self.camera_models_display.delete(1.0, tk.END)
+                self.camera_models_display.config(state=tk.DISABLED)
+            elif update_kind == 'clear':
+                log_chunks = []
+                self.log_display_text.config(state=tk.NORMAL)
+                self.log_display_text.delete(1.0, tk.END)
+                self.log_display_text.config(state=tk.DISABLED)
+            elif update_kind == 'callback':
+                callbacks.append(payload)
+
+        if log_chunks:
+            self.log_display_text.config(state=tk.NORMAL)
+            self.log_display_text.insert(tk.END, *log_chunks)
+            self.log_display_text.config(state=tk.DISABLED)
+            self.log_display_text.see(tk.END)
+        if camera_chunks:
+            self.camera_models_display.config(state=tk.NORMAL)
+            self.camera_models_display.insert(tk.END, ''.join(camera_chunks))
+            self.camera_models_display.config(state=tk.DISABLED)
+        for callback in callbacks:
+            callback()
+        if log_chunks:
+            # Перерисовка журнала - отдельный этап статистики: видно, не тормозит ли прогон вывод
+            self.photo_engine.metrics.record(
+                'log_display', busy_seconds=time.perf_counter() - flush_started_at, item_count=len(log_chunks) // 2
+            )
+            self.photo_engine.metrics.observe_queue_depth('log_display', self.ui_update_queue.qsize())
+        self.result_view.refresh()
+        self.result_count_label.config(text=f"строк: {self.result_view.row_count()} из {len(self.result_store)}")
+        self.update_status_bar()
+
+        self.main_window.after(self.application_settings['log_flush_interval_ms'], self.flush_ui_updates)
 
     def select_camera_model_from_list(self, event):
         try:
             click_position = f"@0,{event.y}"
             line_start = self.camera_models_display.index(click_position + " linestart")
             line_end = self.camera_models_display.index(click_position + " lineend")
-            selected_model = self.camera_models_display.get(line_start, line_end)
-            self.camera_name_entry.delete(0, tk.END)
-            self.camera_name_entry.insert(0, selected_model.strip())
+            selected_value = self.camera_models_display.get(line_start, line_end).strip()
+            if not selected_value:
+                return
+            # Строка фасета "значение (количество)" попадает в фильтр по выбранному фасету
+            facet_count_start = selected_value.rfind(' (')
+            if facet_count_start != -1 and selected_value.endswith(')') \
+                    and selected_value[facet_count_start + 2:-1].isdigit():
+                selected_value = selected_value[:facet_count_start]
+            facet_name = FACET_LABELS[self.facet_variable.get()]
+            if facet_name in ('year', 'month'):
+                target_entries = [self.query_filter_entries['date_from'], self.query_filter_entries['date_to']]
+            elif facet_name in ('make', 'lens'):
+                target_entries = [self.query_filter_entries[facet_name]]
+            elif facet_name == 'extension':
+                target_entries = [self.query_filter_entries['extensions']]
+            elif facet_name == 'model':
+                target_entries = [self.camera_name_entry]
+            else:
+                return
+            for target_entry in target_entries:
+                target_entry.delete(0, tk.END)
+                target_entry.insert(0, selected_value)
         except tk.TclError:
             pass
 
@@ -537,14 +1399,7 @@ class PhotoProcessor:
             index = self.log_display_text.index(f"@0,{event.y}")
             line = self.log_display_text.get(index + " linestart", index + " lineend")
             file_path = line.split(" - ")[0].strip()
-            source_directory = self.source_directory_entry.get()
-            full_file_path = os.path.join(source_directory, file_path)
-
-            if os.path.isfile(full_file_path):
-                if os.name == 'nt':  # For Windows
-                    os.startfile(os.path.dirname(full_file_path))
-                elif os.name == 'posix':  # For MacOS and Linux
-                    subprocess.Popen(['open' if sys.platform == 'darwin' else 'xdg-open', os.path.dirname(full_file_path)])
+            self.open_containing_directory(os.path.join(self.source_directory_entry.get(), file_path))
 
             # Выделяем строку
             self.log_display_text.tag_add("highlight", index + " linestart", index + " lineend")
@@ -552,7 +1407,54 @@ class PhotoProcessor:
         except tk.TclError:
             pass
 
+    def open_result_location(self, result_row):
+        self.open_containing_directory(os.path.join(self.source_directory_entry.get(), result_row.relative_path))
+
+    def show_result_preview(self, view_row, result_row):
+        # Соседние строки загружаются заранее, чтобы листание стрелками брало миниатюры из кэша
+        source_directory = self.source_directory_entry.get()
+        neighbor_rows = self.result_view.neighbor_rows(view_row, self.application_settings['thumbnail_prefetch_rows'])
+        self.show_file_preview(
+            os.path.join(source_directory, result_row.relative_path),
+            f"{result_row.relative_path}\n{result_row.camera_model or 'Модель камеры не определена'}",
+            [
+                os.path.join(source_directory, neighbor_row.relative_path)
+                for neighbor_row in neighbor_rows if neighbor_row.error is None
+            ]
+        )
+
+    def show_file_preview(self, file_path, caption_text, prefetch_paths=()):
+        # Декодирование только в фоновых потоках загрузчика
+        self.preview_image_path = file_path
+        self.preview_caption_label.config(text=caption_text)
+        self.thumbnail_loader.request([file_path], self.handle_thumbnail_loaded, prefetch_paths=prefetch_paths)
+
+    def handle_thumbnail_loaded(self, image_path, thumbnail, error):
+        self.run_on_ui_thread(lambda: self.display_thumbnail(image_path, thumbnail, error))
+
+    def display_thumbnail(self, image_path, thumbnail, error):
+        # Ответ на прошлое выделение приходит после нового - он уже не нужен
+        if image_path != self.preview_image_path:
+            return
+        if thumbnail is None:
+            self.preview_photo_image = None
+            self.preview_image_label.config(image='', text=f"Нет миниатюры:\n{str(error)}",
+                                             wraplength=self.application_settings['thumbnail_size'])
+            return
+        self.preview_photo_image = ImageTk.PhotoImage(thumbnail)
+        self.preview_image_label.config(image=self.preview_photo_image, text='')
+
+    def open_containing_directory(self, full_file_path):
+        if os.path.isfile(full_file_path):
+            if os.name == 'nt':  # For Windows
+                os.startfile(os.path.dirname(full_file_path))
+            elif os.name == 'posix':  # For MacOS and Linux
+                subprocess.Popen(['open' if sys.platform == 'darwin' else 'xdg-open', os.path.dirname(full_file_path)])
+
 if __name__ == "__main__":
     application_window = tk.Tk()
     application = PhotoProcessor(application_window)
     application_window.mainloop()
+    application.job_scheduler.shutdown()
+    application.thumbnail_loader.shutdown()
+    application.photo_engine.close()
@@ -0,0 +1,163 @@
+import os
+import collections
+
+from exif_reader import extract_photo_metadata
+from tree_walker import IMAGE_EXTENSIONS
+from move_engine import MoveTask
+
+SIDECAR_EXTENSIONS = frozenset(('.xmp',))
+# Порядок чтения метаданных в снимке: EXIF JPEG лежит в начале файла, у TIFF-RAW
+# заголовок тоже в начале, RAF и PNG читаются дольше
+METADATA_READ_PRIORITY = {
+    '.jpg': 0, '.jpeg': 0,
+    '.nef': 1, '.arw': 1, '.cr2': 1, '.tiff': 1, '.raw': 1,
+    '.raf': 2,
+    '.png': 3
+}
+UNKNOWN_READ_PRIORITY = 4
+
+# Файлы одного кадра (RAW, JPEG) в одной папке с одинаковым именем без расширения
+ShotGroup = collections.namedtuple('ShotGroup', 'directory_path stem members')
+
+
+def shot_stem(filename):
+    # IMG_0001.ARW, IMG_0001.JPG, IMG_0001.xmp и IMG_0001.ARW.xmp - один снимок
+    stem, extension = os.path.splitext(filename)
+    if extension.lower() in SIDECAR_EXTENSIONS:
+        inner_stem, inner_extension = os.path.splitext(stem)
+        if inner_extension.lower() in IMAGE_EXTENSIONS:
+            stem = inner_stem
+    return os.path.normcase(stem)
+
+
+def is_shot_member(filename):
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS | SIDECAR_EXTENSIONS
+
+
+def read_priority(walked_file):
+    return (
+        METADATA_READ_PRIORITY.get(os.path.splitext(walked_file.path)[1].lower(), UNKNOWN_READ_PRIORITY),
+        walked_file.file_size
+    )
+
+
+def group_directory_files(walked_files, group_shots):
+    groups = collections.OrderedDict()
+    for walked_file in walked_files:
+        filename = os.path.basename(walked_file.path)
+        group_key = shot_stem(filename) if group_shots else filename
+        groups.setdefault(group_key, []).append(walked_file)
+    for group_key, members in groups.items():
+        yield ShotGroup(os.path.dirname(members[0].path), group_key, members)
+
+
+def group_shot_files(walked_files, group_shots=True):
+    # Обходчик отдает файлы папки подряд, поэтому группы собираются по одной папке за раз.
+    # group_shots=False - каждый файл сам по себе
+    directory_files = []
+    current_directory = None
+    for walked_file in walked_files:
+        directory_path = os.path.dirname(walked_file.path)
+        if directory_path != current_directory and directory_files:
+            yield from group_directory_files(directory_files, group_shots)
+            directory_files = []
+        current_directory = directory_path
+        directory_files.append(walked_file)
+    yield from group_directory_files(directory_files, group_shots)
+
+
+def extract_shot_group_metadata(shot_group):
+    # Возвращает (PhotoMetadata, число прочитанных файлов). Обычно читается один файл -
+    # самый дешевый; следующий только если в нем нет модели камеры или он не читается
+    first_error = None
+    photo_metadata = None
+    read_count = 0
+    for walked_file in sorted(shot_group.members, key=read_priority):
+        read_count += 1
+        try:
+            member_metadata = extract_photo_metadata(walked_file.path)
+        except Exception as error:
+            first_error = first_error or error
+            continue
+        if photo_metadata is None:
+            photo_metadata = member_metadata
+        if member_metadata.camera_model:
+            return member_metadata, read_count
+    if photo_metadata is None:
+        raise first_error
+    return photo_metadata, read_count
+
+
+class ShotGroupExpander:
+    # Дополняет задачи перемещения остальными файлами снимков (парный RAW или JPEG, XMP),
+    # чтобы снимок переезжал целиком. Ошибка в одном файле снимка отменяет перемещение
+    # всего снимка, кроме отсутствующих файлов - остальные члены группы от них не зависят
+    def __init__(self):
+        self.directory_members = {}
+        self.added_count = 0
+        self.blocked_count = 0
+
+    def list_directory_members(self, directory_path):
+        members_by_stem = self.directory_members.get(directory_path)
+        if members_by_stem is None:
+            members_by_stem = {}
+            try:
+                with os.scandir(directory_path) as directory_entries:
+                    for directory_entry in directory_entries:
+                        if is_shot_member(directory_entry.name) and directory_entry.is_file():
+                            members_by_stem.setdefault(shot_stem(directory_entry.name), []).append(directory_entry.name)
+            except OSError:
+                pass
+            for member_names in members_by_stem.values():
+                member_names.sort()
+            self.directory_members[directory_path] = members_by_stem
+        return members_by_stem
+
+    def expand(self, move_tasks):
+        # Задачи одной папки идут подряд, как у group_shot_files: снимки папки собираются
+        # и отдаются, как только начинается следующая папка, а не после всего списка
+        grouped_tasks = collections.OrderedDict()
+        current_directory = None
+        for move_task in move_tasks:
+            directory_path, filename = os.path.split(move_task.source_path)
+            if directory_path != current_directory and grouped_tasks:
+                yield from self.expand_directory(current_directory, grouped_tasks)
+                grouped_tasks = collections.OrderedDict()
+            current_directory = directory_path
+            grouped_tasks.setdefault(shot_stem(filename), []).append(move_task)
+        yield from self.expand_directory(current_directory, grouped_tasks)
+
+    def expand_directory(self, directory_path, grouped_tasks):
+        for stem, shot_tasks in grouped_tasks.items():
+            yield from self.expand_shot(directory_path, stem, shot_tasks)
+        # Список папки больше не нужен
+        self.directory_members.pop(directory_path, None)
+
+    def expand_shot(self, directory_path, stem, shot_tasks):
+        planned_names = {os.path.basename(move_task.source_path) for move_task in shot_tasks}
+        target_directory = next(
+            (os.path.dirname(move_task.target_path) for move_task in shot_tasks if move_task.error is None), None
+        )
+        if target_directory is not None:
+            for member_name in self.list_directory_members(directory_path).get(stem, ()):
+                if member_name not in planned_names:
+                    self.added_count += 1
+                    shot_tasks.append(MoveTask(
+                        os.path.join(directory_path, member_name), os.path.join(target_directory, member_name), None
+                    ))
+        failed_task = next(
+            (move_task for move_task in shot_tasks
+             if move_task.error is not None and not isinstance(move_task.error, FileNotFoundError)),
+            None
+        )
+        for move_task in shot_tasks:
+            if failed_task is not None and move_task.error is None:
+                self.blocked_count += 1
+                move_task = MoveTask(move_task.source_path, None, ValueError(
+                    f"Снимок не перемещен целиком: {os.path.basename(failed_task.source_path)} - "
+                    f"{str(failed_task.error)}"
+                ))
+            yield move_task
+
+    def describe(self):
+        return f"Снимки: добавлено парных файлов и XMP {self.added_count}, не перемещено из-за ошибок {self.blocked_count}"
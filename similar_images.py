@@ -0,0 +1,255 @@
+import io
+import csv
+import collections
+
+from exif_reader import read_embedded_preview, extract_orientation
+from photo_index import NOT_INDEXED
+from extraction_pool import ExtractionPool, NO_CACHED_RESULT, UNKNOWN_DEVICE_WORKER_COUNT
+from thumbnail_cache import ORIENTATION_TRANSPOSES
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+HASH_KIND = 'dhash'
+# Пересжатие и уменьшение меняют 0-3 бита dHash, соседние кадры серии - обычно до 4-6.
+# Чем больше порог, тем короче куски для поиска и тем больше пар приходится сравнивать
+DEFAULT_MAX_DISTANCE = 4
+
+# file_paths - снимки группы в порядке обхода; max_distance - наибольшее расстояние
+# среди найденных пар группы
+SimilarGroup = collections.namedtuple('SimilarGroup', 'file_paths max_distance')
+
+
+def compute_difference_hash(image_path, hash_size=HASH_SIZE):
+    # dHash: кадр уменьшается до (hash_size + 1) x hash_size в оттенках серого, бит -
+    # ярче ли пиксель соседа справа. Декодируется встроенное превью или JPEG в draft-режиме
+    from PIL import Image
+    preview_bytes = read_embedded_preview(image_path)
+    with Image.open(io.BytesIO(preview_bytes) if preview_bytes else image_path) as image:
+        image.draft('L', (hash_size * 8, hash_size * 8))
+        grayscale_image = image.convert('L')
+    # Повернутый при экспорте кадр должен совпасть с исходником, у которого есть только тег ориентации
+    transpose_name = ORIENTATION_TRANSPOSES.get(extract_orientation(image_path))
+    if transpose_name:
+        grayscale_image = grayscale_image.transpose(getattr(Image, transpose_name))
+    pixels = grayscale_image.resize((hash_size + 1, hash_size), Image.BOX).tobytes()
+    hash_value = 0
+    for row_start in range(0, len(pixels), hash_size + 1):
+        for column in range(row_start, row_start + hash_size):
+            hash_value = (hash_value << 1) | (pixels[column] < pixels[column + 1])
+    return hash_value
+
+
+def split_hash_chunks(bit_count, chunk_count):
+    # (сдвиг, маска) для chunk_count непересекающихся кусков хэша почти равной длины
+    base_width, extra_bits = divmod(bit_count, chunk_count)
+    chunks = []
+    shift = 0
+    for chunk_index in range(chunk_count):
+        width = base_width + (chunk_index < extra_bits)
+        chunks.append((shift, (1 << width) - 1))
+        shift += width
+    return chunks
+
+
+def count_bits(numpy, values):
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(values)
+    byte_bit_counts = numpy.array([bin(byte_value).count('1') for byte_value in range(256)], dtype=numpy.uint8)
+    return byte_bit_counts[values.view(numpy.uint8)].reshape(-1, 8).sum(axis=1, dtype=numpy.uint8)
+
+
+def find_close_pairs_numpy(numpy, unique_hashes, max_distance):
+    # Хэши, отличающиеся не больше чем в max_distance битах, совпадают хотя бы в одном из
+    # max_distance + 1 кусков. Для каждого куска хэши сортируются по нему, и сравниваются
+    # только соседи внутри серий одинаковых значений - сдвигами всего массива, без цикла по парам
+    first_indices = []
+    second_indices = []
+    pair_distances = []
+    for shift, mask in split_hash_chunks(HASH_BITS, max_distance + 1):
+        chunk_values = (unique_hashes >> numpy.uint64(shift)) & numpy.uint64(mask)
+        order = numpy.argsort(chunk_values, kind='stable')
+        sorted_chunks = chunk_values[order]
+        sorted_hashes = unique_hashes[order]
+        active_positions = numpy.arange(len(order) - 1)
+        offset = 1
+        while len(active_positions):
+            # Позиции, у которых серия одинаковых кусков продолжается еще на offset элементов
+            active_positions = active_positions[active_positions + offset < len(order)]
+            active_positions = active_positions[
+                sorted_chunks[active_positions] == sorted_chunks[active_positions + offset]
+            ]
+            distances = count_bits(numpy, sorted_hashes[active_positions] ^ sorted_hashes[active_positions + offset])
+            close_positions = active_positions[distances <= max_distance]
+            first_indices.append(order[close_positions])
+            second_indices.append(order[close_positions + offset])
+            pair_distances.append(distances[distances <= max_distance])
+            offset += 1
+    if not first_indices:
+        return (numpy.empty(0, dtype=numpy.int64),) * 2 + (numpy.empty(0, dtype=numpy.uint8),)
+    return numpy.concatenate(first_indices), numpy.concatenate(second_indices), numpy.concatenate(pair_distances)
+
+
+def connected_components_numpy(numpy, node_count, first_indices, second_indices):
+    # Метка компоненты - наименьший номер в ней: метки тянутся к минимуму по ребрам,
+    # затем сокращаются переходом по меткам, пока не перестанут меняться
+    labels = numpy.arange(node_count)
+    while True:
+        edge_labels = numpy.minimum(labels[first_indices], labels[second_indices])
+        new_labels = labels.copy()
+        numpy.minimum.at(new_labels, first_indices, edge_labels)
+        numpy.minimum.at(new_labels, second_indices, edge_labels)
+        new_labels = new_labels[new_labels]
+        if numpy.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def group_similar_hashes_numpy(numpy, hash_values, max_distance):
+    hashes = numpy.array(hash_values, dtype=numpy.uint64)
+    # Одинаковые хэши (точные копии, повторные экспорты) сводятся к одному до поиска пар
+    unique_hashes, hash_labels = numpy.unique(hashes, return_inverse=True)
+    first_indices, second_indices, pair_distances = find_close_pairs_numpy(numpy, unique_hashes, max_distance)
+    component_labels = connected_components_numpy(numpy, len(unique_hashes), first_indices, second_indices)
+    file_components = component_labels[hash_labels.reshape(-1)]
+    component_sizes = numpy.bincount(file_components, minlength=len(unique_hashes))
+    component_distances = numpy.zeros(len(unique_hashes), dtype=numpy.int64)
+    numpy.maximum.at(component_distances, component_labels[first_indices], pair_distances.astype(numpy.int64))
+    grouped_files = numpy.flatnonzero(component_sizes[file_components] > 1)
+    groups = collections.defaultdict(list)
+    for file_index, component in zip(grouped_files.tolist(), file_components[grouped_files].tolist()):
+        groups[component].append(file_index)
+    return [(file_indices, int(component_distances[component])) for component, file_indices in groups.items()]
+
+
+def group_similar_hashes_python(hash_values, max_distance):
+    # Тот же поиск по кускам без NumPy: словарь кусок -> хэши и объединение пар в группы
+    unique_hashes = sorted(set(hash_values))
+    parents = list(range(len(unique_hashes)))
+    component_distances = collections.Counter()
+
+    def find_root(node):
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    close_pairs = set()
+    for shift, mask in split_hash_chunks(HASH_BITS, max_distance + 1):
+        buckets = collections.defaultdict(list)
+        for hash_index, hash_value in enumerate(unique_hashes):
+            buckets[(hash_value >> shift) & mask].append(hash_index)
+        for bucket in buckets.values():
+            for position, first_index in enumerate(bucket):
+                for second_index in bucket[position + 1:]:
+                    distance = bin(unique_hashes[first_index] ^ unique_hashes[second_index]).count('1')
+                    if distance <= max_distance:
+                        close_pairs.add((first_index, second_index, distance))
+    for first_index, second_index, distance in close_pairs:
+        first_root, second_root = find_root(first_index), find_root(second_index)
+        if first_root != second_root:
+            parents[max(first_root, second_root)] = min(first_root, second_root)
+            component_distances[min(first_root, second_root)] = max(
+                component_distances[first_root], component_distances[second_root], distance
+            )
+        else:
+            component_distances[first_root] = max(component_distances[first_root], distance)
+    hash_indices = {hash_value: hash_index for hash_index, hash_value in enumerate(unique_hashes)}
+    groups = collections.defaultdict(list)
+    for file_index, hash_value in enumerate(hash_values):
+        groups[find_root(hash_indices[hash_value])].append(file_index)
+    return [
+        (file_indices, component_distances[component])
+        for component, file_indices in groups.items() if len(file_indices) > 1
+    ]
+
+
+def group_similar_hashes(hash_values, max_distance=DEFAULT_MAX_DISTANCE):
+    # Возвращает [(номера хэшей группы, наибольшее расстояние в группе)]
+    if not hash_values:
+        return []
+    try:
+        import numpy
+    except ImportError:
+        return group_similar_hashes_python(hash_values, max_distance)
+    return group_similar_hashes_numpy(numpy, hash_values, max_distance)
+
+
+def write_similar_groups_csv(similar_groups, csv_path):
+    # Одна строка на файл - удобно открыть в таблице и отметить лишние кадры
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(('group', 'max_distance', 'path'))
+        for group_number, similar_group in enumerate(similar_groups, 1):
+            for file_path in similar_group.file_paths:
+                csv_writer.writerow((group_number, similar_group.max_distance, file_path))
+
+
+class SimilarImageFinder:
+    # Похожие снимки (серии, повторные экспорты) по dHash. Хэши кэшируются в индексе
+    # метаданных рядом с хэшами содержимого; progress_callback(ошибка, из кэша) - по каждому файлу
+    def __init__(self, metadata_index, worker_count=UNKNOWN_DEVICE_WORKER_COUNT,
+                 should_stop=None, wait_while_paused=None, progress_callback=None):
+        self.metadata_index = metadata_index
+        self.worker_count = worker_count
+        self.should_stop = should_stop
+        self.wait_while_paused = wait_while_paused
+        self.progress_callback = progress_callback
+        self.statistics = collections.Counter()
+        self.errors = []
+
+    def lookup_cached_hash(self, walked_file):
+        digest = self.metadata_index.get_file_hash(
+            walked_file.path, walked_file.file_size, walked_file.modification_time, HASH_KIND
+        )
+        return NO_CACHED_RESULT if digest is NOT_INDEXED else int(digest, 16)
+
+    def calculate_hashes(self, walked_files):
+        extraction_pool = ExtractionPool(self.worker_count)
+        pool_results = extraction_pool.map_ordered(
+            lambda walked_file: compute_difference_hash(walked_file.path),
+            walked_files,
+            cached_result_lookup=self.lookup_cached_hash,
+            should_stop=self.should_stop,
+            wait_while_paused=self.wait_while_paused
+        )
+        hashed_files = []
+        for pool_result in pool_results:
+            walked_file = pool_result.item
+            self.statistics['files'] += 1
+            if self.progress_callback is not None:
+                self.progress_callback(pool_result.error, pool_result.from_cache)
+            if pool_result.error is not None:
+                self.errors.append((walked_file.path, pool_result.error))
+                continue
+            if pool_result.from_cache:
+                self.statistics['cached_hashes'] += 1
+            else:
+                self.statistics['hashed'] += 1
+                self.metadata_index.store_file_hash(
+                    walked_file.path, walked_file.file_size, walked_file.modification_time, HASH_KIND,
+                    format(pool_result.value, f'0{HASH_BITS // 4}x')
+                )
+            hashed_files.append((walked_file, pool_result.value))
+        self.metadata_index.flush()
+        return hashed_files
+
+    def group_hashed_files(self, hashed_files, max_distance=DEFAULT_MAX_DISTANCE):
+        hash_groups = group_similar_hashes([hash_value for _, hash_value in hashed_files], max_distance)
+        similar_groups = [
+            SimilarGroup([hashed_files[file_index][0].path for file_index in sorted(file_indices)], group_distance)
+            for file_indices, group_distance in hash_groups
+        ]
+        similar_groups.sort(key=lambda similar_group: (-len(similar_group.file_paths), similar_group.file_paths[0]))
+        self.statistics['groups'] = len(similar_groups)
+        self.statistics['grouped_files'] = sum(len(similar_group.file_paths) for similar_group in similar_groups)
+        return similar_groups
+
+    def find_similar_groups(self, walked_files, max_distance=DEFAULT_MAX_DISTANCE):
+        return self.group_hashed_files(self.calculate_hashes(walked_files), max_distance)
+
+    def describe_statistics(self):
+        return (
+            f"Поиск похожих: файлов {self.statistics['files']}, хэшей посчитано {self.statistics['hashed']}, "
+            f"из кэша {self.statistics['cached_hashes']}, групп {self.statistics['groups']}, "
+            f"снимков в группах {self.statistics['grouped_files']}"
+        )
@@ -1,50 +1,104 @@
-import sys
 import os
+import argparse
 import subprocess
 
+from exiftool_driver import ExifToolBatchSorter
+from date_sorter import DateSorter
+
 EXIFTOOL_PATH = r"C:\exiftool\exiftool.exe"
 TARGET_FOLDER = r"C:\Photos\Sorted"
+EXIFTOOL_PROCESS_COUNT = 2
+EXIFTOOL_CHUNK_SIZE = 200
+EXIFTOOL_CHUNK_TIMEOUT = 600
+BUILTIN_WORKER_COUNT = 8
+PROGRESS_STEP = 200
+
+def parse_arguments():
+    # Перетаскивание папки на скрипт передает ее единственным аргументом, остальное - необязательно
+    parser = argparse.ArgumentParser(description="Сортировка фотографий по папкам ГГГГ/ММ/ДД")
+    parser.add_argument("source", nargs='?', help="исходная папка")
+    parser.add_argument("--target", default=TARGET_FOLDER, help="целевая папка")
+    parser.add_argument(
+        "--engine", choices=("auto", "exiftool", "builtin"), default="auto",
+        help="exiftool, встроенный сортировщик или auto (exiftool, если он установлен)"
+    )
+    parser.add_argument("--exiftool", default=EXIFTOOL_PATH, help="путь к exiftool")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов exiftool или потоков")
+    parser.add_argument("--no-pause", action="store_true", help="не ждать Enter в конце")
+    return parser.parse_args()
+
+def create_sorter(arguments):
+    engine = arguments.engine
+    if engine == "auto":
+        engine = "exiftool" if os.path.isfile(arguments.exiftool) else "builtin"
+    if engine == "exiftool":
+        print(f"Сортировка через ExifTool: {arguments.exiftool}")
+        return ExifToolBatchSorter(
+            arguments.exiftool,
+            arguments.target,
+            process_count=arguments.workers or EXIFTOOL_PROCESS_COUNT,
+            chunk_size=EXIFTOOL_CHUNK_SIZE,
+            chunk_timeout=EXIFTOOL_CHUNK_TIMEOUT
+        )
+    print("Сортировка встроенным модулем")
+    return DateSorter(arguments.target, worker_count=arguments.workers or BUILTIN_WORKER_COUNT)
+
+def iterate_sort_results(sorter, source_folder):
+    if isinstance(sorter, DateSorter):
+        return sorter.sort(source_folder), None
+    chunks, resumed = sorter.prepare_chunks(source_folder)
+    total_files = sum(len(chunk.file_paths) for chunk in chunks)
+    if resumed:
+        print(f"Продолжение прерванной сортировки: осталось пакетов {len(chunks)}, файлов {total_files}")
+    else:
+        print(f"Найдено файлов: {total_files}, пакетов: {len(chunks)}")
+    return sorter.sort(chunks), total_files
 
 def main():
-    if len(sys.argv) < 2:
+    arguments = parse_arguments()
+    wait_for_enter = (lambda: None) if arguments.no_pause else (lambda: input("Нажмите Enter для завершения..."))
+    if not arguments.source:
         print("Пожалуйста, перетащите папку на этот скрипт.")
-        input("Нажмите Enter для завершения...")
+        wait_for_enter()
         return
-    
-    source_folder = os.path.normpath(sys.argv[1])
+
+    source_folder = os.path.normpath(arguments.source)
     print(f"Перетащенная папка: {source_folder}")
 
-    if not os.path.exists(TARGET_FOLDER):
-        print(f"Целевая папка не существует: {TARGET_FOLDER}")
-        input("Нажмите Enter для завершения...")
+    if not os.path.exists(arguments.target):
+        print(f"Целевая папка не существует: {arguments.target}")
+        wait_for_enter()
         return
 
-    os.chdir(TARGET_FOLDER)
-    subprocess.run(["explorer", TARGET_FOLDER], shell=True)
-
-    command = [
-        EXIFTOOL_PATH,
-        "-r",
-        "-d", "%Y/%m/%d",
-        "-Directory<DateTimeOriginal",
-        "-Directory<CreateDate",
-        "-charset", "FileName=cp1251",
-        source_folder
-    ]
-    
+    if os.name == 'nt':
+        subprocess.run(["explorer", arguments.target], shell=True)
+
     try:
-        result = subprocess.run(command, capture_output=True, text=True, encoding="cp1251", timeout=3600)
-        print("Вывод ExifTool:")
-        print(result.stdout)
-        if result.stderr:
-            print("Ошибки ExifTool:")
-            print(result.stderr)
-    except subprocess.TimeoutExpired:
-        print("ExifTool выполняется слишком долго. Возможно, ошибка.")
+        sort_results, total_files = iterate_sort_results(create_sorter(arguments), source_folder)
+        status_counts = {}
+        processed_files = 0
+        for file_result in sort_results:
+            processed_files += 1
+            status_counts[file_result.status] = status_counts.get(file_result.status, 0) + 1
+            if file_result.status in ('error', 'pending'):
+                print(f"Ошибка: {file_result.source_path} - {file_result.message}")
+            if processed_files % PROGRESS_STEP == 0 or processed_files == total_files:
+                print(f"Обработано {processed_files}" + (f" из {total_files}" if total_files else ""))
+
+        print("Итоги:")
+        print(f"  перемещено: {status_counts.get('moved', 0)}")
+        print(f"  без даты или не изменено: {status_counts.get('unchanged', 0)}")
+        print(f"  ошибок: {status_counts.get('error', 0)}")
+        if status_counts.get('unsupported'):
+            print(f"  не поддерживается встроенным модулем (видео, HEIC, DNG...): {status_counts['unsupported']}")
+            print("Для этих файлов укажите путь к exiftool (--engine exiftool).")
+        if status_counts.get('pending'):
+            print(f"  не обработано из-за таймаута: {status_counts['pending']}")
+            print("Запустите скрипт для той же папки еще раз, чтобы продолжить.")
     except Exception as e:
         print(f"Произошла ошибка: {e}")
 
-    input("Нажмите Enter для завершения...")
+    wait_for_enter()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
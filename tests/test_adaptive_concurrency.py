@@ -0,0 +1,92 @@
+import unittest
+from unittest import mock
+
+from adaptive_concurrency import AdaptiveConcurrencyController
+
+BASE_LATENCY_SECONDS = 0.02
+
+
+class FakeClock:
+    # Подменяет модуль time у контроллера: время идет только по задержкам симуляции
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def queued_latency(device_capacity):
+    # Устройство выполняет device_capacity операций параллельно, остальные ждут в очереди:
+    # сверх этого задержка растет быстрее числа операций, а пропускная способность падает
+    def latency_for_limit(limit):
+        return BASE_LATENCY_SECONDS * max(1.0, limit / device_capacity) ** 2
+    return latency_for_limit
+
+
+class AdaptiveConcurrencyControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        clock_patcher = mock.patch('adaptive_concurrency.time', self.clock)
+        clock_patcher.start()
+        self.addCleanup(clock_patcher.stop)
+
+    def run_rounds(self, controller, latency_for_limit, round_count, in_flight_count=None, error=False):
+        # За раунд выполняется "окно" из current_limit одновременных операций
+        for _ in range(round_count):
+            limit = controller.current_limit()
+            latency = latency_for_limit(limit)
+            controller.observe_in_flight(limit if in_flight_count is None else in_flight_count)
+            self.clock.now += latency
+            for _ in range(limit):
+                controller.record(latency, error)
+
+    def test_slow_start_doubles_while_latency_is_flat(self):
+        controller = AdaptiveConcurrencyController(initial_limit=4, max_limit=64)
+        self.run_rounds(controller, queued_latency(1000), 40)
+        self.assertEqual([adjustment.limit for adjustment in controller.adjustments], [8, 16, 32, 64])
+        self.assertEqual({adjustment.reason for adjustment in controller.adjustments}, {'increase'})
+        self.assertEqual(controller.current_limit(), 64)
+
+    def test_queueing_latency_decreases_then_grows_additively(self):
+        controller = AdaptiveConcurrencyController(initial_limit=4, max_limit=64)
+        self.run_rounds(controller, queued_latency(8), 200)
+        adjustments = list(controller.adjustments)
+        self.assertEqual([adjustment.limit for adjustment in adjustments[:3]], [8, 16, 11])
+        self.assertEqual(adjustments[2].reason, 'latency')
+        self.assertFalse(controller.slow_start)
+        # После первого снижения - рост на 1 и мультипликативное снижение около емкости устройства
+        for previous_adjustment, adjustment in zip(adjustments[2:], adjustments[3:]):
+            if adjustment.reason == 'increase':
+                self.assertEqual(adjustment.limit, previous_adjustment.limit + 1)
+            else:
+                self.assertEqual(adjustment.reason, 'latency')
+                self.assertEqual(adjustment.limit, int(previous_adjustment.limit * 0.7))
+        self.assertGreater(len(adjustments), 6)
+        self.assertTrue(all(6 <= adjustment.limit <= 16 for adjustment in adjustments[1:]))
+        self.assertEqual(controller.highest_limit, 16)
+
+    def test_errors_decrease_limit_to_minimum(self):
+        controller = AdaptiveConcurrencyController(initial_limit=16, min_limit=2)
+        self.run_rounds(controller, queued_latency(1000), 30, error=True)
+        self.assertEqual({adjustment.reason for adjustment in controller.adjustments}, {'errors'})
+        self.assertEqual([adjustment.limit for adjustment in controller.adjustments], [11, 7, 4, 2])
+        self.assertEqual(controller.current_limit(), 2)
+        self.assertEqual(controller.lowest_limit, 2)
+
+    def test_limit_does_not_grow_while_pool_is_not_saturated(self):
+        controller = AdaptiveConcurrencyController(initial_limit=8)
+        self.run_rounds(controller, queued_latency(1000), 20, in_flight_count=3)
+        self.assertEqual(list(controller.adjustments), [])
+        self.assertEqual(controller.current_limit(), 8)
+
+    def test_baseline_latency_is_the_lowest_interval_average(self):
+        controller = AdaptiveConcurrencyController(initial_limit=8, max_limit=8)
+        self.run_rounds(controller, lambda limit: 0.05, 2)
+        self.run_rounds(controller, lambda limit: 0.01, 2)
+        self.run_rounds(controller, lambda limit: 0.03, 2)
+        self.assertAlmostEqual(controller.baseline_latency, 0.01)
+        self.assertIn('базовая задержка 10.0 мс', controller.describe())
+
+
+if __name__ == '__main__':
+    unittest.main()
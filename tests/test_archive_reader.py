@@ -0,0 +1,151 @@
+import io
+import os
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+import unittest
+
+import archive_reader
+from archive_reader import (
+    ArchiveError, ArchiveMemberFile, HEADER_PREFIX_SIZE, split_archive_path, normalize_member_name,
+    load_archive_catalog, list_archive_directory, open_archive_member, stat_path, calculate_member_checksum,
+    extract_archive_member
+)
+from exif_reader import READ_BLOCK_SIZE, extract_photo_metadata, measure_header_size
+from photo_benchmark import build_tiff_header, build_jpeg_file
+
+MEMBER_MODIFICATION_TIME = 1600000000
+
+
+class ArchiveReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.work_directory = tempfile.mkdtemp(prefix='archive_reader_test_')
+        self.photo_content = build_jpeg_file(
+            build_tiff_header('SONY', 'ILCE-7M3', '2021:05:06 10:11:12'), os.urandom(300 * 1024)
+        )
+
+    def tearDown(self):
+        # Каталоги кэшируются на уровне модуля, у сжатого TAR в них открыт файл
+        with archive_reader.archive_catalogs_lock:
+            archive_catalogs = list(archive_reader.archive_catalogs.values())
+            archive_reader.archive_catalogs.clear()
+        for archive_catalog in archive_catalogs:
+            archive_catalog.close()
+        shutil.rmtree(self.work_directory, ignore_errors=True)
+
+    def create_zip(self, members, compress_type=zipfile.ZIP_STORED, extra=b''):
+        archive_path = os.path.join(self.work_directory, 'photos.zip')
+        with zipfile.ZipFile(archive_path, 'w') as zip_file:
+            for member_name, content in members.items():
+                zip_info = zipfile.ZipInfo(member_name, date_time=(2020, 1, 2, 3, 4, 6))
+                zip_info.compress_type = compress_type
+                zip_info.extra = extra
+                zip_file.writestr(zip_info, content)
+        return archive_path
+
+    def create_tar(self, members, file_name='photos.tar'):
+        archive_path = os.path.join(self.work_directory, file_name)
+        with tarfile.open(archive_path, 'w:gz' if file_name.endswith('.gz') else 'w') as tar_file:
+            for member_name, content in members.items():
+                tar_info = tarfile.TarInfo(member_name)
+                tar_info.size = len(content)
+                tar_info.mtime = MEMBER_MODIFICATION_TIME
+                tar_file.addfile(tar_info, io.BytesIO(content))
+        return archive_path
+
+    def read_member(self, path):
+        with open_archive_member(path) as member_file:
+            return member_file.read()
+
+    def test_split_archive_path(self):
+        archive_path = self.create_zip({'DCIM/a.jpg': b'a'})
+        self.assertEqual(
+            split_archive_path(os.path.join(archive_path, 'DCIM', 'a.jpg')), (archive_path, 'DCIM/a.jpg')
+        )
+        self.assertEqual(split_archive_path(archive_path), (archive_path, ''))
+        self.assertIsNone(split_archive_path(os.path.join(self.work_directory, 'photos.zipx', 'a.jpg')))
+        self.assertIsNone(split_archive_path(os.path.join(self.work_directory, 'missing.zip', 'a.jpg')))
+
+    def test_normalize_member_name(self):
+        self.assertEqual(normalize_member_name('./DCIM//a.jpg'), 'DCIM/a.jpg')
+        self.assertEqual(normalize_member_name('/DCIM/a.jpg'), 'DCIM/a.jpg')
+        self.assertEqual(normalize_member_name('DCIM\\a.jpg'), 'DCIM/a.jpg')
+        self.assertIsNone(normalize_member_name('../a.jpg'))
+        self.assertIsNone(normalize_member_name('DCIM/../../a.jpg'))
+
+    def test_members_leaving_the_archive_are_skipped(self):
+        archive_path = self.create_tar({'../evil.jpg': b'x', 'DCIM/../../evil.jpg': b'x', 'DCIM/a.jpg': b'a'})
+        self.assertEqual(list(load_archive_catalog(archive_path).members), ['DCIM/a.jpg'])
+        archive_members, subdirectory_paths = list_archive_directory(archive_path)
+        self.assertEqual(archive_members, [])
+        self.assertEqual(subdirectory_paths, [os.path.join(archive_path, 'DCIM')])
+        with self.assertRaises(FileNotFoundError):
+            stat_path(os.path.join(archive_path, 'evil.jpg'))
+
+    def test_stored_zip_member_is_read_past_local_header(self):
+        # Поле extra в локальном заголовке сдвигает начало данных
+        archive_path = self.create_zip({'DCIM/a.jpg': self.photo_content}, extra=b'\xfe\xca\x04\x00abcd')
+        member_path = os.path.join(archive_path, 'DCIM', 'a.jpg')
+        with open_archive_member(member_path) as member_file:
+            self.assertIsInstance(member_file, ArchiveMemberFile)
+            member_file.seek(-10, io.SEEK_END)
+            self.assertEqual(member_file.read(), self.photo_content[-10:])
+            member_file.seek(0)
+            self.assertEqual(member_file.read(), self.photo_content)
+        self.assertEqual(extract_photo_metadata(member_path).camera_model, 'ILCE-7M3')
+        self.assertEqual(stat_path(member_path).st_size, len(self.photo_content))
+
+    def test_deflated_zip_member_gives_only_prefix(self):
+        archive_path = self.create_zip({'a.jpg': self.photo_content}, zipfile.ZIP_DEFLATED)
+        member_path = os.path.join(archive_path, 'a.jpg')
+        self.assertEqual(self.read_member(member_path), self.photo_content[:HEADER_PREFIX_SIZE])
+        self.assertEqual(extract_photo_metadata(member_path).date_time, '2021:05:06 10:11:12')
+        self.assertEqual(
+            calculate_member_checksum(member_path), hashlib.blake2b(self.photo_content).hexdigest()
+        )
+
+    def test_compressed_tar_keeps_only_header_prefix(self):
+        archive_path = self.create_tar({'DCIM/a.jpg': self.photo_content}, 'photos.tar.gz')
+        member_path = os.path.join(archive_path, 'DCIM', 'a.jpg')
+        header_prefix = load_archive_catalog(archive_path).get_member('DCIM/a.jpg').header_prefix
+        self.assertEqual(header_prefix, self.photo_content[:measure_header_size(self.photo_content)])
+        # Заголовок читается блоками: от 300 КБ члена в каталоге остается один блок
+        self.assertEqual(len(header_prefix), READ_BLOCK_SIZE)
+        self.assertEqual(extract_photo_metadata(member_path).camera_model, 'ILCE-7M3')
+        target_path = os.path.join(self.work_directory, 'a.jpg')
+        self.assertEqual(
+            extract_archive_member(member_path, target_path), hashlib.blake2b(self.photo_content).hexdigest()
+        )
+        with open(target_path, 'rb') as target_file:
+            self.assertEqual(target_file.read(), self.photo_content)
+        self.assertEqual(os.stat(target_path).st_mtime_ns, MEMBER_MODIFICATION_TIME * 1_000_000_000)
+
+    def test_plain_tar_member_is_read_in_place(self):
+        archive_path = self.create_tar({'a.jpg': b'first', 'b.jpg': self.photo_content})
+        member_path = os.path.join(archive_path, 'b.jpg')
+        self.assertIsNone(load_archive_catalog(archive_path).get_member('b.jpg').header_prefix)
+        self.assertEqual(self.read_member(member_path), self.photo_content)
+        self.assertEqual(stat_path(member_path).st_mtime_ns, MEMBER_MODIFICATION_TIME * 1_000_000_000)
+
+    def test_extraction_checks_zip_crc(self):
+        archive_path = self.create_zip({'a.jpg': self.photo_content})
+        with open(archive_path, 'r+b') as archive_file:
+            archive_bytes = archive_file.read()
+            # Портим байт данных члена: размер тот же, CRC32 в каталоге уже не сходится
+            archive_file.seek(archive_bytes.index(self.photo_content) + len(self.photo_content) // 2)
+            archive_file.write(b'\x00' if archive_bytes[archive_file.tell()] else b'\x01')
+        with self.assertRaisesRegex(ArchiveError, 'Контрольная сумма'):
+            extract_archive_member(os.path.join(archive_path, 'a.jpg'), os.path.join(self.work_directory, 'a.jpg'))
+
+    def test_damaged_archive_raises_archive_error(self):
+        archive_path = os.path.join(self.work_directory, 'broken.zip')
+        with open(archive_path, 'wb') as archive_file:
+            archive_file.write(b'PK\x03\x04 not really a zip')
+        with self.assertRaises(ArchiveError):
+            load_archive_catalog(archive_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
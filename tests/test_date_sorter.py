@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from date_sorter import DateSorter, DEFAULT_DATE_SORT_JOURNAL_PATH, parse_exif_date
+from move_engine import MoveJournal, DEFAULT_JOURNAL_PATH
+from photo_benchmark import build_tiff_header, build_jpeg_file, build_tiff_file
+
+
+class DateSorterTest(unittest.TestCase):
+    def setUp(self):
+        self.work_directory = tempfile.mkdtemp(prefix='date_sorter_test_')
+        self.source_directory = os.path.join(self.work_directory, 'source')
+        self.target_directory = os.path.join(self.work_directory, 'target')
+        self.journal_path = os.path.join(self.work_directory, 'date_sort_journal.jsonl')
+        os.makedirs(self.target_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_directory, ignore_errors=True)
+
+    def create_file(self, relative_path, content):
+        file_path = os.path.join(self.source_directory, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as output_file:
+            output_file.write(content)
+        return file_path
+
+    def create_sorter(self):
+        return DateSorter(self.target_directory, worker_count=2, journal_path=self.journal_path)
+
+    def test_has_its_own_journal(self):
+        self.assertNotEqual(DEFAULT_DATE_SORT_JOURNAL_PATH, DEFAULT_JOURNAL_PATH)
+
+    def test_parse_exif_date(self):
+        self.assertEqual(parse_exif_date('2021:05:06 10:11:12').day, 6)
+        self.assertEqual(parse_exif_date('2021:05:06').month, 5)
+        self.assertIsNone(parse_exif_date('0000:00:00 00:00:00'))
+        self.assertIsNone(parse_exif_date(None))
+
+    def test_sorts_dated_photos_and_reports_the_rest(self):
+        jpeg_path = self.create_file(
+            'a/1.jpg', build_jpeg_file(build_tiff_header('SONY', 'ILCE-7M3', '2021:05:06 10:11:12'), b'x' * 10)
+        )
+        raw_path = self.create_file(
+            'a/2.nef', build_tiff_file(build_tiff_header('NIKON', 'Z 6', '2019:12:31 23:59:59', '>'), b'x' * 10)
+        )
+        undated_path = self.create_file('b/3.jpg', build_jpeg_file(None, b'x' * 10))
+        video_path = self.create_file('b/4.mov', b'\x00\x00\x00\x18ftypqt  ')
+        results = {result.source_path: result for result in self.create_sorter().sort(self.source_directory)}
+        self.assertEqual(results[jpeg_path].status, 'moved')
+        self.assertEqual(results[jpeg_path].target_path, os.path.join(self.target_directory, '2021', '05', '06', '1.jpg'))
+        self.assertTrue(os.path.isfile(results[raw_path].target_path))
+        self.assertIn(os.path.join('2019', '12', '31'), results[raw_path].target_path)
+        self.assertEqual(results[undated_path].status, 'unchanged')
+        self.assertEqual(results[video_path].status, 'unsupported')
+        self.assertTrue(os.path.isfile(video_path))
+        self.assertFalse(os.path.exists(self.journal_path))
+
+    def test_finishes_interrupted_sort_before_starting_a_new_one(self):
+        content = build_jpeg_file(build_tiff_header('Canon', 'Canon EOS R5', '2020:01:02 03:04:05'), b'x' * 10)
+        interrupted_path = self.create_file('a/1.jpg', content)
+        new_path = self.create_file('a/2.jpg', content)
+        interrupted_target = os.path.join(self.target_directory, 'planned', '1.jpg')
+        move_journal = MoveJournal.create(self.source_directory, self.target_directory, self.journal_path)
+        move_journal.record_planned(interrupted_path, interrupted_target)
+        move_journal.close()
+        results = {result.source_path: result for result in self.create_sorter().sort(self.source_directory)}
+        # Прерванное перемещение доделывается туда, куда было запланировано
+        self.assertEqual(results[interrupted_path].target_path, interrupted_target)
+        self.assertTrue(os.path.isfile(interrupted_target))
+        self.assertEqual(results[new_path].status, 'moved')
+        self.assertFalse(os.path.exists(self.journal_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from photo_index import PhotoMetadataIndex
+from duplicate_finder import DuplicateFinder, PARTIAL_HASH_BLOCK_SIZE, stat_walked_file
+
+LARGE_FILE_SIZE = 4 * PARTIAL_HASH_BLOCK_SIZE
+
+
+class DuplicateFinderTest(unittest.TestCase):
+    def setUp(self):
+        self.work_directory = tempfile.mkdtemp(prefix='duplicate_finder_test_')
+        self.metadata_index = PhotoMetadataIndex(os.path.join(self.work_directory, 'index.sqlite3'))
+        self.large_content = os.urandom(LARGE_FILE_SIZE)
+
+    def tearDown(self):
+        self.metadata_index.close()
+        shutil.rmtree(self.work_directory, ignore_errors=True)
+
+    def create_file(self, filename, content):
+        file_path = os.path.join(self.work_directory, 'photos', filename)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as output_file:
+            output_file.write(content)
+        return stat_walked_file(file_path)
+
+    def replace_byte(self, content, position):
+        return content[:position] + bytes([content[position] ^ 0xFF]) + content[position + 1:]
+
+    def create_stage_files(self):
+        # a и a_copy - дубликаты; other_header отсеивается частичным хэшем, other_middle
+        # совпадает с a в начале и конце и отсеивается только полным; small - целиком в частичном
+        small_content = os.urandom(1024)
+        return [
+            self.create_file('a.jpg', self.large_content),
+            self.create_file('other_header.jpg', self.replace_byte(self.large_content, 10)),
+            self.create_file('other_middle.jpg', self.replace_byte(self.large_content, LARGE_FILE_SIZE // 2)),
+            self.create_file('a_copy.jpg', self.large_content),
+            self.create_file('small.jpg', small_content),
+            self.create_file('small_copy.jpg', small_content),
+            self.create_file('unique_size.jpg', os.urandom(100)),
+            self.create_file('empty_1.jpg', b''),
+            self.create_file('empty_2.jpg', b'')
+        ]
+
+    def group_names(self, duplicate_groups):
+        return sorted(
+            [os.path.basename(walked_file.path) for walked_file in duplicate_group.walked_files]
+            for duplicate_group in duplicate_groups
+        )
+
+    def test_stages_narrow_candidates(self):
+        duplicate_finder = DuplicateFinder(self.metadata_index, worker_count=2)
+        duplicate_groups = duplicate_finder.find_duplicate_groups(self.create_stage_files())
+        self.assertEqual(self.group_names(duplicate_groups), [['a.jpg', 'a_copy.jpg'], ['small.jpg', 'small_copy.jpg']])
+        statistics = duplicate_finder.statistics
+        self.assertEqual(statistics['files'], 9)
+        # Пустые файлы и файл уникального размера не читаются вовсе
+        self.assertEqual(statistics['size_candidates'], 6)
+        self.assertEqual(statistics['partial_hashed'], 6)
+        # other_header отсеян по частичному хэшу, small покрыт им целиком
+        self.assertEqual(statistics['full_hashed'], 3)
+        self.assertEqual(statistics['duplicates'], 2)
+        self.assertEqual(duplicate_finder.errors, [])
+
+    def test_hashes_are_reused_from_index(self):
+        walked_files = self.create_stage_files()
+        DuplicateFinder(self.metadata_index).find_duplicate_groups(walked_files)
+        duplicate_finder = DuplicateFinder(self.metadata_index)
+        duplicate_groups = duplicate_finder.find_duplicate_groups(walked_files)
+        self.assertEqual(len(duplicate_groups), 2)
+        self.assertEqual(duplicate_finder.statistics['partial_hashed'] + duplicate_finder.statistics['full_hashed'], 0)
+        self.assertEqual(duplicate_finder.statistics['cached_hashes'], 9)
+
+    def test_changed_file_is_hashed_again(self):
+        walked_files = self.create_stage_files()
+        DuplicateFinder(self.metadata_index).find_duplicate_groups(walked_files)
+        # Тот же размер, другое время изменения: кэш по (путь, размер, время) уже не подходит
+        changed_file = self.create_file('a_copy.jpg', self.replace_byte(self.large_content, 5))
+        os.utime(changed_file.path, ns=(1, 1))
+        walked_files[3] = stat_walked_file(changed_file.path)
+        duplicate_groups = DuplicateFinder(self.metadata_index).find_duplicate_groups(walked_files)
+        self.assertEqual(self.group_names(duplicate_groups), [['small.jpg', 'small_copy.jpg']])
+
+    def test_find_move_duplicates(self):
+        reference_file = self.create_file('archive/a.jpg', self.large_content)
+        candidate_files = [
+            self.create_file('card/a.jpg', self.large_content),
+            self.create_file('card/b.jpg', self.large_content[::-1]),
+            self.create_file('card/b_again.jpg', self.large_content[::-1]),
+            self.create_file('card/c.jpg', os.urandom(200))
+        ]
+        other_reference_file = self.create_file('archive/other_size.jpg', os.urandom(300))
+        duplicate_of = DuplicateFinder(self.metadata_index).find_move_duplicates(
+            candidate_files, [reference_file, other_reference_file]
+        )
+        self.assertEqual(duplicate_of, {
+            candidate_files[0].path: reference_file.path,
+            candidate_files[2].path: candidate_files[1].path
+        })
+
+    def test_unreadable_file_is_reported(self):
+        walked_files = [self.create_file('a.jpg', self.large_content), self.create_file('b.jpg', self.large_content)]
+        os.remove(walked_files[1].path)
+        duplicate_finder = DuplicateFinder(self.metadata_index)
+        self.assertEqual(duplicate_finder.find_duplicate_groups(walked_files), [])
+        self.assertEqual([path for path, _ in duplicate_finder.errors], [walked_files[1].path])
+        self.assertIsInstance(duplicate_finder.errors[0][1], FileNotFoundError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+
+from exif_reader import (
+    ExifReaderError, EMPTY_PHOTO_METADATA, EXIF_TAG_MODEL, EXIF_TAG_ORIENTATION, EXIF_TAG_PIXEL_X_DIMENSION,
+    EXIF_TAG_JPEG_INTERCHANGE_FORMAT, EXIF_TAG_JPEG_INTERCHANGE_FORMAT_LENGTH, PNG_SIGNATURE, RAF_SIGNATURE,
+    read_exif_tags, extract_photo_metadata, extract_camera_model, extract_photo_date, extract_orientation,
+    find_embedded_previews, read_embedded_preview
+)
+from photo_benchmark import build_ifd, ascii_entry, build_tiff_header, build_jpeg_file, build_tiff_file
+
+TIFF_TYPE_SHORT = 3
+TIFF_TYPE_LONG = 4
+
+
+def short_entry(byte_order, tag_id, value):
+    return tag_id, TIFF_TYPE_SHORT, 1, struct.pack(byte_order + 'H', value)
+
+
+def long_entry(byte_order, tag_id, value):
+    return tag_id, TIFF_TYPE_LONG, 1, struct.pack(byte_order + 'I', value)
+
+
+def build_tiff_with_thumbnail(byte_order, ifd0_entries, thumbnail):
+    # IFD0 -> IFD1 с миниатюрой JPEG сразу за ним, как в EXIF у камер
+    ifd0_size = len(build_ifd(byte_order, ifd0_entries, 8))
+    ifd1_offset = 8 + ifd0_size
+    thumbnail_offset = ifd1_offset + 2 + 2 * 12 + 4
+    ifd1_entries = [
+        long_entry(byte_order, EXIF_TAG_JPEG_INTERCHANGE_FORMAT, thumbnail_offset),
+        long_entry(byte_order, EXIF_TAG_JPEG_INTERCHANGE_FORMAT_LENGTH, len(thumbnail))
+    ]
+    byte_order_mark = b'II' if byte_order == '<' else b'MM'
+    return (byte_order_mark + struct.pack(byte_order + 'HI', 42, 8)
+            + build_ifd(byte_order, ifd0_entries, 8, ifd1_offset) + build_ifd(byte_order, ifd1_entries, ifd1_offset)
+            + thumbnail)
+
+
+class ExifReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.work_directory = tempfile.mkdtemp(prefix='exif_reader_test_')
+        self.tiff_header = build_tiff_header('FUJIFILM', 'X-T4', '2022:07:08 09:10:11')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_directory, ignore_errors=True)
+
+    def create_file(self, filename, content):
+        file_path = os.path.join(self.work_directory, filename)
+        with open(file_path, 'wb') as output_file:
+            output_file.write(content)
+        return file_path
+
+    def assert_fujifilm_metadata(self, file_path):
+        photo_metadata = extract_photo_metadata(file_path)
+        self.assertEqual(photo_metadata.camera_make, 'FUJIFILM')
+        self.assertEqual(photo_metadata.camera_model, 'X-T4')
+        self.assertEqual(photo_metadata.date_time, '2022:07:08 09:10:11')
+
+    def test_jpeg(self):
+        file_path = self.create_file('a.jpg', build_jpeg_file(self.tiff_header, b'x' * 100000))
+        self.assert_fujifilm_metadata(file_path)
+        self.assertEqual(extract_camera_model(file_path), 'X-T4')
+        self.assertEqual(extract_photo_date(file_path), '2022:07:08 09:10:11')
+
+    def test_tiff_in_both_byte_orders(self):
+        for byte_order in ('<', '>'):
+            with self.subTest(byte_order=byte_order):
+                tiff_header = build_tiff_header('NIKON', 'Z 6', '2019:12:31 23:59:59', byte_order)
+                file_path = self.create_file('a.nef', build_tiff_file(tiff_header, b'x' * 100))
+                photo_metadata = extract_photo_metadata(file_path)
+                self.assertEqual((photo_metadata.camera_model, photo_metadata.date_time),
+                                 ('Z 6', '2019:12:31 23:59:59'))
+
+    def test_raf(self):
+        # Заголовок RAF: по смещению 84 - смещение и длина встроенного JPEG с EXIF
+        jpeg_content = build_jpeg_file(self.tiff_header, b'x' * 100)
+        jpeg_offset = 160
+        raf_header = (RAF_SIGNATURE + b'0201').ljust(84, b'\x00') + struct.pack('>II', jpeg_offset, len(jpeg_content))
+        file_path = self.create_file('a.raf', raf_header.ljust(jpeg_offset, b'\x00') + jpeg_content)
+        self.assert_fujifilm_metadata(file_path)
+        with open(file_path, 'rb') as image_file:
+            self.assertEqual(find_embedded_previews(image_file), [(jpeg_offset, len(jpeg_content))])
+
+    def test_png_exif_chunk(self):
+        def png_chunk(chunk_type, data):
+            return struct.pack('>I', len(data)) + chunk_type + data + b'\x00' * 4
+
+        file_path = self.create_file('a.png', PNG_SIGNATURE + png_chunk(b'IHDR', b'\x00' * 13)
+                                     + png_chunk(b'eXIf', self.tiff_header) + png_chunk(b'IEND', b''))
+        self.assert_fujifilm_metadata(file_path)
+
+    def test_orientation_and_dimensions(self):
+        ifd0_entries = [
+            ascii_entry(EXIF_TAG_MODEL, 'ILCE-7M3'), short_entry('>', EXIF_TAG_ORIENTATION, 6),
+            long_entry('>', EXIF_TAG_PIXEL_X_DIMENSION, 6000)
+        ]
+        tiff_header = b'MM' + struct.pack('>HI', 42, 8) + build_ifd('>', ifd0_entries, 8)
+        file_path = self.create_file('a.jpg', build_jpeg_file(tiff_header, b'x' * 10))
+        self.assertEqual(extract_orientation(file_path), 6)
+        self.assertEqual(extract_photo_metadata(file_path).image_width, 6000)
+        self.assertIsNone(extract_orientation(self.create_file('b.jpg', build_jpeg_file(self.tiff_header, b''))))
+
+    def test_thumbnail_in_ifd1_is_found(self):
+        thumbnail = build_jpeg_file(None, b't' * 5000)
+        tiff_header = build_tiff_with_thumbnail('<', [ascii_entry(EXIF_TAG_MODEL, 'X-T4')], thumbnail)
+        file_path = self.create_file('a.jpg', build_jpeg_file(tiff_header, b'x' * 100))
+        with open(file_path, 'rb') as image_file:
+            previews = find_embedded_previews(image_file)
+        # Смещение - от начала файла: SOI, маркер и длина APP1, "Exif\0\0"
+        thumbnail_offset = 2 + 4 + 6 + tiff_header.index(thumbnail)
+        self.assertEqual(previews, [(thumbnail_offset, len(thumbnail))])
+        self.assertEqual(read_embedded_preview(file_path), thumbnail)
+        self.assertEqual(extract_camera_model(file_path), 'X-T4')
+
+    def test_jpeg_without_exif(self):
+        file_path = self.create_file('a.jpg', build_jpeg_file(None, b'x' * 10))
+        self.assertEqual(read_exif_tags(file_path, (EXIF_TAG_MODEL,)), {})
+        self.assertEqual(extract_photo_metadata(file_path), EMPTY_PHOTO_METADATA)
+
+    def test_truncated_and_unknown_files_raise_reader_error(self):
+        truncated_path = self.create_file('a.jpg', build_jpeg_file(self.tiff_header, b'')[:40])
+        unknown_path = self.create_file('a.bin', b'not an image at all')
+        for file_path in (truncated_path, unknown_path):
+            with self.subTest(file_path=file_path):
+                with self.assertRaises(ExifReaderError):
+                    read_exif_tags(file_path, (EXIF_TAG_MODEL,))
+                self.assertIsNone(extract_photo_metadata(file_path).camera_model)
+        self.assertEqual(extract_photo_metadata(os.path.join(self.work_directory, 'missing.jpg')),
+                         EMPTY_PHOTO_METADATA)
+
+
+if __name__ == '__main__':
+    unittest.main()
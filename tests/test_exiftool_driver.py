@@ -0,0 +1,189 @@
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+from exiftool_driver import (
+    ExifToolProcess, ExifToolBatchSorter, ExifToolSortState, UnfinishedSortError, plan_chunks
+)
+
+# Поддельный exiftool в режиме -stay_open: принимает команды из stdin до -executeN,
+# переносит файлы из argfile в подпапку "sorted" рабочей папки и отвечает {readyN}.
+# Файлы с "bad" в имени дают ошибку в stderr, с "hang" - зависание, пока есть hang_flag.
+# Каждый запуск дописывает строку в start_log
+FAKE_EXIFTOOL_SOURCE = textwrap.dedent('''\
+    import os
+    import sys
+    import time
+
+    start_log, hang_flag = sys.argv[1], sys.argv[2]
+    with open(start_log, 'a') as log_file:
+        log_file.write(str(os.getpid()) + '\\n')
+    arguments = []
+    for line in sys.stdin:
+        line = line.rstrip('\\n')
+        if arguments[-1:] == ['-stay_open'] and line == 'False':
+            break
+        if not line.startswith('-execute'):
+            arguments.append(line)
+            continue
+        file_paths = []
+        echo_text = None
+        for position, argument in enumerate(arguments):
+            if argument == '-@':
+                with open(arguments[position + 1], encoding='utf-8') as argument_file:
+                    file_paths.extend(path.rstrip('\\n') for path in argument_file)
+            elif argument == '-echo4':
+                echo_text = arguments[position + 1]
+        for file_path in file_paths:
+            if 'hang' in os.path.basename(file_path) and os.path.exists(hang_flag):
+                time.sleep(3600)
+            if 'bad' in os.path.basename(file_path):
+                sys.stderr.write('Error: Bad format - ' + file_path + '\\n')
+                continue
+            os.makedirs('sorted', exist_ok=True)
+            os.rename(file_path, os.path.join('sorted', os.path.basename(file_path)))
+        if echo_text is not None:
+            sys.stderr.write(echo_text + '\\n')
+        sys.stderr.flush()
+        sys.stdout.write('{ready' + line[len('-execute'):] + '}\\n')
+        sys.stdout.flush()
+        arguments = []
+''')
+
+
+@unittest.skipIf(os.name == 'nt', "поддельный exiftool запускается через #!")
+class ExifToolDriverTest(unittest.TestCase):
+    def setUp(self):
+        self.work_directory = tempfile.mkdtemp(prefix='exiftool_test_')
+        self.source_directory = os.path.join(self.work_directory, 'source')
+        self.target_directory = os.path.join(self.work_directory, 'target')
+        self.state_path = os.path.join(self.work_directory, 'state', 'exiftool_sort_state.jsonl')
+        self.start_log = os.path.join(self.work_directory, 'starts.log')
+        self.hang_flag = os.path.join(self.work_directory, 'hang.flag')
+        os.makedirs(self.target_directory)
+        self.exiftool_path = os.path.join(self.work_directory, 'fake_exiftool')
+        with open(self.exiftool_path, 'w') as script_file:
+            script_file.write(
+                f"#!/bin/sh\nexec '{sys.executable}' '{self.exiftool_path}.py' "
+                f"'{self.start_log}' '{self.hang_flag}' \"$@\"\n"
+            )
+        with open(self.exiftool_path + '.py', 'w') as script_file:
+            script_file.write(FAKE_EXIFTOOL_SOURCE)
+        os.chmod(self.exiftool_path, os.stat(self.exiftool_path).st_mode | stat.S_IEXEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_directory, ignore_errors=True)
+
+    def create_photos(self, directory_name, filenames):
+        directory_path = os.path.join(self.source_directory, directory_name)
+        os.makedirs(directory_path, exist_ok=True)
+        for filename in filenames:
+            with open(os.path.join(directory_path, filename), 'wb') as photo_file:
+                photo_file.write(b'\xff\xd8' + filename.encode())
+        return [os.path.join(directory_path, filename) for filename in filenames]
+
+    def start_count(self):
+        with open(self.start_log) as log_file:
+            return len(log_file.read().split())
+
+    def create_sorter(self, chunk_timeout=30):
+        return ExifToolBatchSorter(
+            self.exiftool_path, self.target_directory, process_count=1, chunk_size=2,
+            chunk_timeout=chunk_timeout, state_path=self.state_path
+        )
+
+    def test_process_answers_several_commands(self):
+        exiftool_process = ExifToolProcess(self.exiftool_path, self.target_directory)
+        try:
+            for _ in range(3):
+                output_lines, error_lines = exiftool_process.execute(['-ver'], timeout_seconds=30)
+                self.assertEqual(output_lines, [])
+                self.assertEqual(error_lines, [])
+        finally:
+            exiftool_process.close()
+        self.assertEqual(self.start_count(), 1)
+
+    def test_chunks_do_not_cross_directories(self):
+        self.create_photos('a', ['1.jpg', '2.jpg', '3.jpg'])
+        self.create_photos('b', ['4.jpg'])
+        chunks = plan_chunks(self.source_directory, chunk_size=2)
+        self.assertEqual([len(chunk.file_paths) for chunk in chunks], [2, 1, 1])
+        self.assertEqual([chunk.chunk_number for chunk in chunks], [0, 1, 2])
+        self.assertEqual(len({os.path.dirname(path) for path in chunks[2].file_paths}), 1)
+
+    def test_sort_moves_files_reports_errors_and_removes_state(self):
+        moved_paths = self.create_photos('a', ['1.jpg', '2.jpg']) + self.create_photos('b', ['3.jpg'])
+        bad_path = self.create_photos('c', ['bad.jpg'])[0]
+        sorter = self.create_sorter()
+        chunks, resumed = sorter.prepare_chunks(self.source_directory)
+        self.assertFalse(resumed)
+        results = {result.source_path: result for result in sorter.sort(chunks)}
+        self.assertEqual({results[path].status for path in moved_paths}, {'moved'})
+        self.assertEqual(results[bad_path].status, 'error')
+        self.assertIn('Bad format', results[bad_path].message)
+        self.assertTrue(os.path.isfile(os.path.join(self.target_directory, 'sorted', '1.jpg')))
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_timeout_restarts_process_and_resume_runs_only_unfinished_chunks(self):
+        first_paths = self.create_photos('a', ['1.jpg', '2.jpg'])
+        hang_paths = self.create_photos('b', ['hang.jpg'])
+        last_paths = self.create_photos('c', ['3.jpg'])
+        open(self.hang_flag, 'w').close()
+        sorter = self.create_sorter(chunk_timeout=2)
+        chunks, _ = sorter.prepare_chunks(self.source_directory)
+        results = {result.source_path: result for result in sorter.sort(chunks)}
+        self.assertEqual(results[hang_paths[0]].status, 'pending')
+        self.assertIn('не ответил', results[hang_paths[0]].message)
+        # После таймаута тот же рабочий поток продолжает с перезапущенным exiftool
+        self.assertEqual({results[path].status for path in first_paths + last_paths}, {'moved'})
+        self.assertEqual(self.start_count(), 2)
+        self.assertTrue(os.path.isfile(self.state_path))
+
+        os.remove(self.hang_flag)
+        sorter = self.create_sorter()
+        pending_chunks, resumed = sorter.prepare_chunks(self.source_directory)
+        self.assertTrue(resumed)
+        self.assertEqual([chunk.file_paths for chunk in pending_chunks], [hang_paths])
+        results = list(sorter.sort(pending_chunks))
+        self.assertEqual([result.status for result in results], ['moved'])
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_unfinished_state_of_other_folders_is_not_overwritten(self):
+        self.create_photos('a', ['1.jpg'])
+        other_directory = os.path.join(self.work_directory, 'other')
+        for source_directory, target_directory in ((other_directory, self.target_directory),
+                                                   (self.source_directory, other_directory)):
+            with self.subTest(source_directory=source_directory, target_directory=target_directory):
+                sort_state = ExifToolSortState(self.state_path)
+                sort_state.create(source_directory, target_directory, [])
+                sort_state.close()
+                with open(self.state_path, encoding='utf-8') as state_file:
+                    state_text = state_file.read()
+                with self.assertRaisesRegex(UnfinishedSortError, 'незавершенная сортировка'):
+                    self.create_sorter().prepare_chunks(self.source_directory)
+                with open(self.state_path, encoding='utf-8') as state_file:
+                    self.assertEqual(state_file.read(), state_text)
+                with self.assertRaises(UnfinishedSortError):
+                    ExifToolSortState(self.state_path).create(self.source_directory, self.target_directory, [])
+                os.remove(self.state_path)
+
+    def test_state_ignores_torn_last_line(self):
+        photo_paths = self.create_photos('a', ['1.jpg', '2.jpg', '3.jpg'])
+        sorter = self.create_sorter()
+        chunks, _ = sorter.prepare_chunks(self.source_directory)
+        sorter.sort_state.mark_done(0)
+        sorter.sort_state.close()
+        with open(self.state_path, 'a', encoding='utf-8') as state_file:
+            state_file.write('{"op": "done", "ch')
+        sort_state = ExifToolSortState(self.state_path)
+        pending_chunks = sort_state.load(self.source_directory)
+        sort_state.close()
+        self.assertEqual([chunk.file_paths for chunk in pending_chunks], [photo_paths[2:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
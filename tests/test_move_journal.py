@@ -0,0 +1,223 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import move_engine
+from move_engine import (
+    MoveEngine, MoveJournal, MoveTask, UnfinishedJournalError, PARTIAL_SUFFIX, copy_file_contents
+)
+from photo_engine import find_unfinished_move_target
+
+
+class MoveJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.work_directory = tempfile.mkdtemp(prefix='move_journal_test_')
+        self.source_directory = os.path.join(self.work_directory, 'source')
+        self.target_directory = os.path.join(self.work_directory, 'target')
+        self.journal_path = os.path.join(self.work_directory, 'journal', 'move_journal.jsonl')
+        os.makedirs(self.source_directory)
+        os.makedirs(self.target_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_directory, ignore_errors=True)
+
+    def create_file(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as output_file:
+            output_file.write(content)
+        return path
+
+    def read_file(self, path):
+        with open(path, 'rb') as input_file:
+            return input_file.read()
+
+    def source_path(self, filename):
+        return os.path.join(self.source_directory, filename)
+
+    def target_path(self, filename):
+        return os.path.join(self.target_directory, 'camera', filename)
+
+    def force_copy(self, engine):
+        # Цель "на другом устройстве": вместо rename идет копирование через .partial
+        ensure_directory = engine.directory_cache.ensure_directory
+        return mock.patch.object(
+            engine.directory_cache, 'ensure_directory',
+            side_effect=lambda directory_path: ensure_directory(directory_path) + 1
+        )
+
+    def interrupted_journal(self, planned_moves, completed_moves=()):
+        # Журнал, каким его оставляет сбой посреди перемещения
+        journal = MoveJournal.create(self.source_directory, self.target_directory, self.journal_path)
+        for source_path, target_path in completed_moves:
+            journal.record_planned(source_path, target_path)
+            journal.record_completed(source_path, target_path)
+        for source_path, target_path in planned_moves:
+            journal.record_planned(source_path, target_path)
+        journal.close()
+
+    def test_create_refuses_unfinished_journal(self):
+        self.interrupted_journal([(self.source_path('a.jpg'), self.target_path('a.jpg'))])
+        journal_text = self.read_file(self.journal_path)
+        with self.assertRaises(UnfinishedJournalError):
+            MoveJournal.create(self.source_directory, self.target_directory, self.journal_path)
+        self.assertEqual(self.read_file(self.journal_path), journal_text)
+
+    def test_load_ignores_torn_last_line(self):
+        self.interrupted_journal([(self.source_path('b.jpg'), self.target_path('b.jpg'))],
+                                 [(self.source_path('a.jpg'), self.target_path('a.jpg'))])
+        with open(self.journal_path, 'a', encoding='utf-8') as journal_file:
+            journal_file.write('{"op": "done", "sou')
+        header, pending_moves, completed_moves = MoveJournal.load(self.journal_path)
+        self.assertEqual(header['source'], self.source_directory)
+        self.assertEqual(pending_moves, [MoveTask(self.source_path('b.jpg'), self.target_path('b.jpg'), None)])
+        self.assertEqual(completed_moves, [(self.source_path('a.jpg'), self.target_path('a.jpg'))])
+
+    def test_move_records_every_file_and_rollback_restores_sources(self):
+        contents = {'a.jpg': b'a' * 100, 'b.jpg': b'b' * 200}
+        move_tasks = [
+            MoveTask(self.create_file(self.source_path(filename), content), self.target_path(filename), None)
+            for filename, content in contents.items()
+        ]
+        engine = MoveEngine(worker_count=2)
+        journal = MoveJournal.create(self.source_directory, self.target_directory, self.journal_path)
+        with self.force_copy(engine):
+            results = list(engine.move_files(move_tasks, journal))
+        journal.close()
+        self.assertEqual([result.method for result in results], ['copy', 'copy'])
+        self.assertEqual([result.error for result in results], [None, None])
+        _, pending_moves, completed_moves = MoveJournal.load(self.journal_path)
+        self.assertEqual(pending_moves, [])
+        self.assertEqual(len(completed_moves), 2)
+
+        rollback_results = list(MoveEngine().rollback_journal(self.journal_path))
+        self.assertEqual([result.error for result in rollback_results], [None, None])
+        for filename, content in contents.items():
+            self.assertEqual(self.read_file(self.source_path(filename)), content)
+            self.assertFalse(os.path.exists(self.target_path(filename)))
+        self.assertEqual(MoveJournal.load(self.journal_path)[2], [])
+
+    def test_resume_finishes_interrupted_moves(self):
+        # a.jpg - сбой до копирования, от копии остался .partial;
+        # b.jpg - копия готова, но исходник не успели удалить
+        source_a = self.create_file(self.source_path('a.jpg'), b'a' * 100)
+        self.create_file(self.target_path('a.jpg') + PARTIAL_SUFFIX, b'a' * 10)
+        source_b = self.create_file(self.source_path('b.jpg'), b'b' * 100)
+        self.create_file(self.target_path('b.jpg'), b'b' * 100)
+        shutil.copystat(source_b, self.target_path('b.jpg'))
+        self.interrupted_journal([(source_a, self.target_path('a.jpg')), (source_b, self.target_path('b.jpg'))])
+
+        results = {result.source_path: result for result in MoveEngine().resume_journal(self.journal_path)}
+        self.assertEqual(results[source_a].method, 'rename')
+        self.assertEqual(results[source_b].method, 'resumed')
+        self.assertFalse(os.path.exists(source_a) or os.path.exists(source_b))
+        self.assertFalse(os.path.exists(self.target_path('a.jpg') + PARTIAL_SUFFIX))
+        self.assertEqual(self.read_file(self.target_path('a.jpg')), b'a' * 100)
+        self.assertEqual(MoveJournal.load(self.journal_path)[1], [])
+
+    def test_resume_moves_every_file_left_after_crash(self):
+        contents = {f'{number}.jpg': bytes([number]) * 100 for number in range(8)}
+        move_tasks = [
+            MoveTask(self.create_file(self.source_path(filename), content), self.target_path(filename), None)
+            for filename, content in contents.items()
+        ]
+        journal = MoveJournal.create(self.source_directory, self.target_directory, self.journal_path)
+        journal.record_plan(move_tasks)
+        # Процесс падает на третьем файле: ни done, ни failed для оставшихся в журнале нет
+        engine = MoveEngine(worker_count=2)
+        transfer_file = engine.transfer_file
+        transfer_calls = []
+
+        def crashing_transfer_file(source_path, target_path):
+            transfer_calls.append(source_path)
+            if len(transfer_calls) > 2:
+                raise SystemExit("сбой")
+            return transfer_file(source_path, target_path)
+
+        with mock.patch.object(engine, 'transfer_file', crashing_transfer_file):
+            with self.assertRaises(SystemExit):
+                list(engine.move_files(move_tasks, journal))
+        journal.close()
+        remaining_paths = {move_task.source_path for move_task in move_tasks if os.path.exists(move_task.source_path)}
+        self.assertEqual(len(remaining_paths), 6)
+
+        results = list(MoveEngine().resume_journal(self.journal_path))
+        self.assertEqual({result.source_path for result in results}, remaining_paths)
+        self.assertEqual([result.error for result in results], [None] * len(results))
+        for filename, content in contents.items():
+            self.assertFalse(os.path.exists(self.source_path(filename)))
+            self.assertEqual(self.read_file(self.target_path(filename)), content)
+        self.assertEqual(MoveJournal.load(self.journal_path)[1], [])
+
+    def test_resume_finishes_interrupted_duplicate_link(self):
+        original_path = self.create_file(self.target_path('a.jpg'), b'a' * 100)
+        source_path = self.create_file(self.source_path('copy_of_a.jpg'), b'a' * 100)
+        link_target_path = self.target_path('copy_of_a.jpg')
+        journal = MoveJournal.create(self.source_directory, self.target_directory, self.journal_path)
+        journal.record_plan([MoveTask(source_path, link_target_path, None, original_path)])
+        journal.close()
+        # Ссылка создана до сбоя, исходник остался
+        os.link(original_path, link_target_path)
+        results = list(MoveEngine().resume_journal(self.journal_path))
+        self.assertEqual([(result.method, result.error) for result in results], [('resumed', None)])
+        self.assertFalse(os.path.exists(source_path))
+        self.assertTrue(os.path.samefile(original_path, link_target_path))
+
+    def test_rerun_reuses_target_of_unfinished_move(self):
+        camera_directory = os.path.join(self.target_directory, 'Canon_1')
+        os.makedirs(os.path.join(self.target_directory, 'Canon'))
+        os.makedirs(camera_directory)
+        MoveJournal.create(self.source_directory, camera_directory, self.journal_path).close()
+        self.assertEqual(
+            find_unfinished_move_target(self.target_directory, 'Canon', self.journal_path, self.source_directory),
+            camera_directory
+        )
+        # Другая камера, другая исходная папка или другая целевая папка - не продолжение
+        self.assertIsNone(find_unfinished_move_target(self.target_directory, 'Can', self.journal_path))
+        self.assertIsNone(
+            find_unfinished_move_target(self.target_directory, 'Canon', self.journal_path, self.work_directory)
+        )
+        self.assertIsNone(find_unfinished_move_target(self.source_directory, 'Canon', self.journal_path))
+        MoveJournal.discard(self.journal_path)
+        self.assertIsNone(find_unfinished_move_target(self.target_directory, 'Canon', self.journal_path))
+
+    def test_resume_keeps_source_when_target_differs(self):
+        source_path = self.create_file(self.source_path('a.jpg'), b'a' * 100)
+        # Тот же размер, но другое время изменения и содержимое - это не копия исходника
+        self.create_file(self.target_path('a.jpg'), b'x' * 100)
+        os.utime(self.target_path('a.jpg'), ns=(1, 1))
+        self.interrupted_journal([(source_path, self.target_path('a.jpg'))])
+        results = list(MoveEngine().resume_journal(self.journal_path))
+        self.assertIsInstance(results[0].error, FileExistsError)
+        self.assertEqual(self.read_file(source_path), b'a' * 100)
+
+    def test_resume_with_checksums_rejects_same_size_and_time(self):
+        source_path = self.create_file(self.source_path('a.jpg'), b'a' * 100)
+        self.create_file(self.target_path('a.jpg'), b'x' * 100)
+        shutil.copystat(source_path, self.target_path('a.jpg'))
+        self.interrupted_journal([(source_path, self.target_path('a.jpg'))])
+        results = list(MoveEngine(verify_checksums=True).resume_journal(self.journal_path))
+        self.assertIsInstance(results[0].error, FileExistsError)
+        self.assertTrue(os.path.exists(source_path))
+
+    def test_short_kernel_copy_falls_back_to_full_copy(self):
+        content = os.urandom(3 * 1024 * 1024)
+        source_path = self.create_file(self.source_path('a.jpg'), content)
+        target_path = self.target_path('a.jpg')
+        os.makedirs(os.path.dirname(target_path))
+        # Ядро копирует первый кусок и затем возвращает 0, как при обрыве на сетевом диске
+        kernel_copy_calls = []
+
+        def short_kernel_copy(*arguments):
+            kernel_copy_calls.append(arguments)
+            return 1024 if len(kernel_copy_calls) == 1 else 0
+
+        with mock.patch.object(move_engine.os, 'copy_file_range', short_kernel_copy, create=True), \
+                mock.patch.object(move_engine.os, 'sendfile', lambda *arguments: 0, create=True):
+            copy_file_contents(source_path, target_path)
+        self.assertEqual(self.read_file(target_path), content)
+
+
+if __name__ == '__main__':
+    unittest.main()
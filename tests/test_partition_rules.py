@@ -0,0 +1,91 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from partition_rules import PartitionRule, PartitionRuleSet, sanitize_directory_name
+
+
+class PartitionRuleTest(unittest.TestCase):
+    def test_rejects_broken_templates_at_load_time(self):
+        for target in ('', '/', '{}', '{0}', '{model', '{model.name}', '{model[x]}', '{camera}', 5):
+            with self.subTest(target=target):
+                with self.assertRaises(ValueError):
+                    PartitionRule(target)
+
+    def test_rejects_invalid_model_regex(self):
+        with self.assertRaisesRegex(ValueError, 'Неверное регулярное выражение'):
+            PartitionRule('{model}', model_regex='ILCE-(7')
+
+    def test_formats_target_with_date_and_unsafe_model(self):
+        rule = PartitionRule('{year}/{month}/{model}_{extension}')
+        self.assertEqual(
+            rule.format_target('Canon: EOS/R5', '.CR3', '2021:05:06 10:00:00'),
+            os.path.join('2021', '05', 'Canon_ EOS_R5_CR3')
+        )
+        self.assertEqual(
+            rule.format_target(None, '.jpg', None), os.path.join('unknown_date', '00', 'unknown_camera_jpg')
+        )
+        self.assertTrue(rule.uses_date)
+
+    def test_sanitize_directory_name(self):
+        self.assertEqual(sanitize_directory_name(' a<b>c. '), 'a_b_c')
+        self.assertEqual(sanitize_directory_name('..'), '_')
+
+
+class PartitionRuleSetTest(unittest.TestCase):
+    def setUp(self):
+        self.work_directory = tempfile.mkdtemp(prefix='partition_rules_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_directory, ignore_errors=True)
+
+    def write_rules(self, rules_data):
+        rules_path = os.path.join(self.work_directory, 'rules.json')
+        with open(rules_path, 'w', encoding='utf-8') as rules_file:
+            json.dump(rules_data, rules_file)
+        return rules_path
+
+    def test_load_reports_invalid_regex_as_value_error(self):
+        rules_path = self.write_rules([{'target': 'Sony', 'model_regex': 'ILCE-[7'}])
+        with self.assertRaises(ValueError):
+            PartitionRuleSet.load(rules_path)
+
+    def test_load_reports_missing_target(self):
+        rules_path = self.write_rules({'rules': [{'model': 'sony'}]})
+        with self.assertRaisesRegex(ValueError, 'target'):
+            PartitionRuleSet.load(rules_path)
+
+    def test_first_matching_rule_wins(self):
+        rules_path = self.write_rules({
+            'rules': [
+                {'target': 'raw/{model}', 'extensions': ['cr2', '.ARW']},
+                {'target': 'sony', 'model_regex': '^ilce-'},
+                {'target': 'old/{model}', 'date_to': '2010-12-31'}
+            ],
+            'unknown_model_target': 'no camera'
+        })
+        rule_set = PartitionRuleSet.load(rules_path)
+        self.assertTrue(rule_set.needs_date)
+        self.assertEqual(rule_set.route('ILCE-7M3', '.ARW'), os.path.join('raw', 'ILCE-7M3'))
+        self.assertEqual(rule_set.route('ILCE-7M3', '.jpg'), 'sony')
+        self.assertEqual(rule_set.route('Canon EOS 5D', '.jpg', '2009:01:01 00:00:00'),
+                         os.path.join('old', 'Canon EOS 5D'))
+        self.assertEqual(rule_set.route('Canon EOS 5D', '.jpg', '2019:01:01 00:00:00'), 'Canon EOS 5D')
+        self.assertEqual(rule_set.route(None, '.jpg'), 'no camera')
+
+    def test_unmatched_files_stay_when_routing_by_model_is_off(self):
+        rule_set = PartitionRuleSet(
+            [PartitionRule('canon', model='canon')], route_unmatched_by_model=False
+        )
+        self.assertFalse(rule_set.needs_date)
+        self.assertEqual(rule_set.route('Canon EOS R5', '.JPG'), 'canon')
+        self.assertIsNone(rule_set.route('NIKON D750', '.jpg'))
+        self.assertIsNone(rule_set.route(None, '.jpg'))
+        # Без правил по дате результат запоминается по (модель, расширение)
+        self.assertEqual(rule_set.route_cache[('Canon EOS R5', '.jpg')], 'canon')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import io
+import os
+import hashlib
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from exif_reader import read_embedded_preview, extract_orientation
+from photo_index import DEFAULT_INDEX_DIRECTORY, normalize_index_path
+
+DEFAULT_THUMBNAIL_DIRECTORY = os.path.join(DEFAULT_INDEX_DIRECTORY, "thumbnails")
+DEFAULT_THUMBNAIL_SIZE = 320
+DEFAULT_MEMORY_LIMIT_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_LIMIT_BYTES = 512 * 1024 * 1024
+DEFAULT_DECODE_WORKER_COUNT = 2
+# Объем дискового кэша проверяется не на каждой записи, а раз в столько миниатюр
+DISK_PRUNE_INTERVAL = 200
+THUMBNAIL_JPEG_QUALITY = 85
+
+# Поворот PIL для ориентации EXIF 2-8, как в ImageOps.exif_transpose
+ORIENTATION_TRANSPOSES = {
+    2: 'FLIP_LEFT_RIGHT',
+    3: 'ROTATE_180',
+    4: 'FLIP_TOP_BOTTOM',
+    5: 'TRANSPOSE',
+    6: 'ROTATE_270',
+    7: 'TRANSVERSE',
+    8: 'ROTATE_90'
+}
+
+
+def decode_thumbnail(image_path, thumbnail_size=DEFAULT_THUMBNAIL_SIZE):
+    # Сначала встроенное превью (у RAW - единственный быстрый путь), иначе сам файл.
+    # draft() заставляет декодер JPEG сразу выдать кадр в 1/2-1/8 размера
+    from PIL import Image
+    preview_bytes = read_embedded_preview(image_path)
+    with Image.open(io.BytesIO(preview_bytes) if preview_bytes else image_path) as image:
+        image.draft('RGB', (thumbnail_size, thumbnail_size))
+        image.thumbnail((thumbnail_size, thumbnail_size))
+        thumbnail = image.convert('RGB')
+    transpose_name = ORIENTATION_TRANSPOSES.get(extract_orientation(image_path))
+    if transpose_name:
+        thumbnail = thumbnail.transpose(getattr(Image, transpose_name))
+    return thumbnail
+
+
+def thumbnail_memory_size(thumbnail):
+    return thumbnail.width * thumbnail.height * len(thumbnail.getbands())
+
+
+class ThumbnailCache:
+    # Миниатюры по ключу (путь, размер, время изменения, сторона миниатюры): LRU в памяти
+    # с ограничением по байтам и JPEG-файлы на диске. Исходный файл декодируется,
+    # только если миниатюры нет ни там, ни там
+    def __init__(self, cache_directory=DEFAULT_THUMBNAIL_DIRECTORY, thumbnail_size=DEFAULT_THUMBNAIL_SIZE,
+                 memory_limit_bytes=DEFAULT_MEMORY_LIMIT_BYTES, disk_limit_bytes=DEFAULT_DISK_LIMIT_BYTES):
+        self.cache_directory = cache_directory
+        self.thumbnail_size = thumbnail_size
+        self.memory_limit_bytes = memory_limit_bytes
+        self.disk_limit_bytes = disk_limit_bytes
+        self.memory_cache = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.disk_writes_since_prune = 0
+        self.statistics = collections.Counter()
+        self.lock = threading.Lock()
+
+    def cache_key(self, image_path):
+        file_stat = os.stat(image_path)
+        key_text = f"{normalize_index_path(image_path)}|{file_stat.st_size}|{file_stat.st_mtime_ns}|{self.thumbnail_size}"
+        return hashlib.sha1(key_text.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def disk_path(self, cache_key):
+        return os.path.join(self.cache_directory, cache_key[:2], cache_key + ".jpg")
+
+    def get_from_memory(self, cache_key):
+        with self.lock:
+            thumbnail = self.memory_cache.get(cache_key)
+            if thumbnail is not None:
+                self.memory_cache.move_to_end(cache_key)
+            return thumbnail
+
+    def put_in_memory(self, cache_key, thumbnail):
+        with self.lock:
+            previous_thumbnail = self.memory_cache.pop(cache_key, None)
+            if previous_thumbnail is not None:
+                self.memory_bytes -= thumbnail_memory_size(previous_thumbnail)
+            self.memory_cache[cache_key] = thumbnail
+            self.memory_bytes += thumbnail_memory_size(thumbnail)
+            while self.memory_bytes > self.memory_limit_bytes and len(self.memory_cache) > 1:
+                _, evicted_thumbnail = self.memory_cache.popitem(last=False)
+                self.memory_bytes -= thumbnail_memory_size(evicted_thumbnail)
+
+    def load_from_disk(self, disk_path):
+        from PIL import Image
+        try:
+            with Image.open(disk_path) as disk_image:
+                thumbnail = disk_image.convert('RGB')
+        except OSError:
+            return None
+        # Время изменения файла - время последнего использования для очистки кэша
+        try:
+            os.utime(disk_path)
+        except OSError:
+            pass
+        return thumbnail
+
+    def store_on_disk(self, disk_path, thumbnail):
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        partial_path = f"{disk_path}.{threading.get_ident()}.partial"
+        try:
+            thumbnail.save(partial_path, 'JPEG', quality=THUMBNAIL_JPEG_QUALITY)
+            os.replace(partial_path, disk_path)
+        except OSError:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return
+        with self.lock:
+            self.disk_writes_since_prune += 1
+            prune_needed = self.disk_writes_since_prune >= DISK_PRUNE_INTERVAL
+            if prune_needed:
+                self.disk_writes_since_prune = 0
+        if prune_needed:
+            self.prune_disk_cache()
+
+    def load_thumbnail(self, image_path):
+        # Читает и декодирует файлы - вызывать из фонового потока
+        cache_key = self.cache_key(image_path)
+        thumbnail = self.get_from_memory(cache_key)
+        if thumbnail is not None:
+            self.statistics['memory_hits'] += 1
+            return thumbnail
+        disk_path = self.disk_path(cache_key)
+        thumbnail = self.load_from_disk(disk_path)
+        if thumbnail is not None:
+            self.statistics['disk_hits'] += 1
+        else:
+            thumbnail = decode_thumbnail(image_path, self.thumbnail_size)
+            self.statistics['decoded'] += 1
+            self.store_on_disk(disk_path, thumbnail)
+        self.put_in_memory(cache_key, thumbnail)
+        return thumbnail
+
+    def prune_disk_cache(self):
+        # Удаляет давно не использованные миниатюры, пока кэш не станет меньше 90% лимита
+        cached_files = []
+        for directory_path, _, file_names in os.walk(self.cache_directory):
+            for file_name in file_names:
+                file_path = os.path.join(directory_path, file_name)
+                try:
+                    file_stat = os.stat(file_path)
+                except OSError:
+                    continue
+                cached_files.append((file_stat.st_mtime, file_stat.st_size, file_path))
+        total_bytes = sum(file_size for _, file_size, _ in cached_files)
+        if total_bytes <= self.disk_limit_bytes:
+            return 0
+        removed_count = 0
+        for _, file_size, file_path in sorted(cached_files):
+            if total_bytes <= self.disk_limit_bytes * 0.9:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            total_bytes -= file_size
+            removed_count += 1
+        return removed_count
+
+
+class ThumbnailLoader:
+    # Декодирование в фоновых потоках. Новый запрос отменяет еще не начатые запросы
+    # прошлого выделения, поэтому быстрый просмотр не копит очередь декодирования
+    def __init__(self, thumbnail_cache, worker_count=DEFAULT_DECODE_WORKER_COUNT):
+        self.thumbnail_cache = thumbnail_cache
+        self.executor = ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="thumbnail")
+        self.pending_futures = []
+        self.lock = threading.Lock()
+
+    def request(self, image_paths, result_callback, prefetch_paths=()):
+        # result_callback(путь, миниатюра или None, ошибка или None) вызывается из фонового потока;
+        # prefetch_paths только прогревают кэш (соседние строки списка)
+        with self.lock:
+            for pending_future in self.pending_futures:
+                pending_future.cancel()
+            self.pending_futures = [
+                self.executor.submit(self.load, image_path, result_callback) for image_path in image_paths
+            ] + [
+                self.executor.submit(self.load, image_path, None) for image_path in prefetch_paths
+            ]
+
+    def load(self, image_path, result_callback):
+        try:
+            thumbnail, error = self.thumbnail_cache.load_thumbnail(image_path), None
+        except Exception as load_error:
+            thumbnail, error = None, load_error
+        if result_callback is not None:
+            result_callback(image_path, thumbnail, error)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
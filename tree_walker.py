@@ -0,0 +1,103 @@
+import os
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from archive_reader import is_archive_file_name, split_archive_path, list_archive_directory
+
+IMAGE_EXTENSIONS = frozenset(('.jpg', '.jpeg', '.tiff', '.png', '.nef', '.cr2', '.arw', '.raf', '.raw'))
+DEFAULT_SCAN_WORKER_COUNT = 4
+
+# inode - из того же stat, нужен для чтения в порядке диска; 0 - неизвестен
+WalkedFile = collections.namedtuple('WalkedFile', 'path file_size modification_time inode', defaults=(0,))
+DirectoryListing = collections.namedtuple('DirectoryListing', 'directory_path files subdirectories error')
+
+
+def has_image_extension(filename, extensions=IMAGE_EXTENSIONS):
+    return os.path.splitext(filename)[1].lower() in extensions
+
+
+def scan_archive_directory(directory_path, extensions):
+    # Архив и папки внутри него - виртуальные папки: список берется из каталога архива
+    files = []
+    try:
+        archive_members, subdirectories = list_archive_directory(directory_path)
+    except OSError as error:
+        return DirectoryListing(directory_path, files, [], error)
+    for file_path, archive_member in archive_members:
+        if has_image_extension(archive_member.name, extensions):
+            files.append(WalkedFile(file_path, archive_member.file_size, archive_member.modification_time))
+    files.sort()
+    subdirectories.sort()
+    return DirectoryListing(directory_path, files, subdirectories, None)
+
+
+def scan_directory(directory_path, extensions=IMAGE_EXTENSIONS, should_stop=None, scan_archives=False):
+    # Один проход scandir: размер и время берутся из DirEntry, без повторного os.stat по пути.
+    # scan_archives - ZIP и TAR обходятся как подпапки
+    if scan_archives and split_archive_path(directory_path) is not None:
+        return scan_archive_directory(directory_path, extensions)
+    files = []
+    subdirectories = []
+    try:
+        with os.scandir(directory_path) as directory_entries:
+            for directory_entry in directory_entries:
+                if should_stop and should_stop():
+                    break
+                try:
+                    if directory_entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(directory_entry.path)
+                    elif scan_archives and is_archive_file_name(directory_entry.name) and directory_entry.is_file():
+                        subdirectories.append(directory_entry.path)
+                    elif has_image_extension(directory_entry.name, extensions) and directory_entry.is_file():
+                        entry_stat = directory_entry.stat()
+                        files.append(WalkedFile(
+                            directory_entry.path, entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ino
+                        ))
+                except OSError:
+                    # Файл исчез или недоступен между листингом и stat
+                    continue
+    except OSError as error:
+        return DirectoryListing(directory_path, files, subdirectories, error)
+    files.sort()
+    subdirectories.sort()
+    return DirectoryListing(directory_path, files, subdirectories, None)
+
+
+class TreeWalker:
+    # Порядок выдачи как у os.walk(topdown=True): файлы папки, затем подпапки в глубину.
+    # Листинги подпапок запрашиваются заранее в пуле потоков - на SMB/NFS это
+    # основная задержка обхода
+    def __init__(self, extensions=IMAGE_EXTENSIONS, scan_worker_count=DEFAULT_SCAN_WORKER_COUNT,
+                 should_stop=None, wait_while_paused=None, error_callback=None, scan_archives=False):
+        self.extensions = frozenset(extension.lower() for extension in extensions)
+        self.scan_worker_count = max(1, int(scan_worker_count))
+        self.should_stop = should_stop
+        self.wait_while_paused = wait_while_paused
+        self.error_callback = error_callback
+        self.scan_archives = scan_archives
+
+    def walk(self, root_directory):
+        executor = ThreadPoolExecutor(max_workers=self.scan_worker_count)
+        pending_listings = [self.submit_scan(executor, root_directory)]
+        try:
+            while pending_listings:
+                directory_listing = pending_listings.pop().result()
+                if directory_listing.error is not None and self.error_callback:
+                    self.error_callback(directory_listing.directory_path, directory_listing.error)
+                for walked_file in directory_listing.files:
+                    if self.wait_while_paused:
+                        self.wait_while_paused()
+                    if self.should_stop and self.should_stop():
+                        return
+                    yield walked_file
+                pending_listings.extend(
+                    self.submit_scan(executor, subdirectory)
+                    for subdirectory in reversed(directory_listing.subdirectories)
+                )
+        finally:
+            for pending_listing in pending_listings:
+                pending_listing.cancel()
+            executor.shutdown(wait=True)
+
+    def submit_scan(self, executor, directory_path):
+        return executor.submit(scan_directory, directory_path, self.extensions, self.should_stop, self.scan_archives)